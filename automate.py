@@ -0,0 +1,138 @@
+""" The input lists of automate.ps1 in Python: for every project folder in the base directory, <project>/<project>_generated.tex
+contains an \\input for every .tex file of the project (recursively), with the same rules as automate.ps1:
+    - files named *_generated.tex, *<project>.tex, _* or *_ are left out (case-insensitive),
+    - so are files in folders that contain a .texignore or .texomit file (only that folder, not its subfolders),
+    - hidden files and folders (starting with .) are left out, like Get-ChildItem does without -Force,
+    - project folders starting with . or _ are skipped.
+Unlike automate.ps1, an InputListGenerator keeps the directory scan and only lists the folders again whose modification time changed,
+and it only writes the generated file if its content changed. processPool.py runs it in-process before every compilation
+(--generate-inputs). It doesn't create main files for new projects, use automate.ps1 for that.
+    python automate.py -b <base directory> [-p <project>] """
+import os
+import sys
+import time
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Dict, List, Optional
+
+GENERATED_SUFFIX = "_generated.tex"
+IGNORE_MARKERS = ('.texignore', '.texomit')
+FOOTER = "% Automatisch generierte Datei, jede Änderung wird wieder überschrieben"
+MTIME_GRANULARITY = 2 # seconds. A folder changed less than this before its scan is listed again next time, its mtime may not show a later change
+
+def isIncluded(fileName: str, projectName: str) -> bool:
+    """ The -Filter and -Exclude patterns of getIncludedTexFiles in automate.ps1 """
+    name = fileName.lower()
+    excluded = ('*' + GENERATED_SUFFIX, f"*{projectName.lower()}.tex", '_*', '*_')
+    return name.endswith('.tex') and not any(fnmatchcase(name, pattern) for pattern in excluded)
+
+class DirectoryScan:
+    """ The listing of one folder: its .tex files and subfolders (sorted like Get-ChildItem) and whether it is ignored """
+    def __init__(self, directory: Path, projectName: str) -> None:
+        self.scanTime = time.time()
+        self.mtime = directory.stat().st_mtime_ns
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name.lower())
+        visible = [entry for entry in entries if not entry.name.startswith('.')] # hidden, e.g. .git
+        self.texFiles = [Path(entry.path) for entry in visible if entry.is_file() and isIncluded(entry.name, projectName)]
+        self.subdirectories = [Path(entry.path) for entry in visible if entry.is_dir()]
+        self.ignored = any(entry.name in IGNORE_MARKERS for entry in entries)
+
+    def isCurrent(self, directory: Path) -> bool:
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except OSError:
+            return False
+        return mtime == self.mtime and mtime / 1e9 < self.scanTime - MTIME_GRANULARITY
+
+class InputListGenerator:
+    """ Writes the generated file of one project folder. rootPath is the main file relative to the generated file (% !TEX root). """
+
+    def __init__(self, projectDirectory: Path, rootPath: str) -> None:
+        self.projectDirectory = projectDirectory
+        self.name = projectDirectory.name
+        self.rootPath = rootPath
+        self.generatedFile = projectDirectory / (self.name + GENERATED_SUFFIX)
+        self.scans: Dict[Path, DirectoryScan] = {}
+        self.rescanned = 0 # folders listed in the last call of includedFiles
+        self.files: List[Path] = [] # the result of the last call of includedFiles
+
+    def includedFiles(self) -> List[Path]:
+        """ All .tex files of the project in the order of Get-ChildItem -Recurse (files of a folder, then its subfolders) """
+        files: List[Path] = []
+        scans: Dict[Path, DirectoryScan] = {}
+        self.rescanned = 0
+        pending = [self.projectDirectory]
+        while pending:
+            directory = pending.pop()
+            scan = self.scans.get(directory)
+            if scan is None or not scan.isCurrent(directory):
+                try:
+                    scan = DirectoryScan(directory, self.name)
+                except OSError: # removed in the meantime
+                    continue
+                self.rescanned += 1
+            scans[directory] = scan
+            if not scan.ignored:
+                files += scan.texFiles
+            pending += reversed(scan.subdirectories)
+        self.scans = scans # forget removed folders
+        self.files = files
+        return files
+
+    def content(self) -> str:
+        """ The generated file as automate.ps1 writes it, "" if the project has no .tex files """
+        inputs = "".join(f"\\input{{{file.absolute().as_posix()}}}\n" for file in self.includedFiles())
+        if inputs == "":
+            return ""
+        return f"% !TEX root = {self.rootPath} \n\\def\\currentPath{{{self.projectDirectory.absolute().as_posix()}}}\n{inputs}\n{FOOTER}\n"
+
+    def update(self) -> bool:
+        """ Write the generated file if its content changed. Returns whether it was written. """
+        content = self.content()
+        if content == "":
+            return False
+        try:
+            existing = self.generatedFile.read_text(encoding='utf-8-sig')
+        except OSError:
+            existing = None
+        if existing is not None and existing.replace('\r\n', '\n').rstrip('\n') == content.rstrip('\n'): # also the files of automate.ps1
+            return False
+        self.generatedFile.write_text(content, encoding='utf-8')
+        return True
+
+def projectDirectories(baseDirectory: Path) -> List[Path]:
+    return sorted(
+        (directory for directory in baseDirectory.iterdir() if directory.is_dir() and not directory.name.startswith(('.', '_'))),
+        key=lambda directory: directory.name.lower()
+    )
+
+def projectGenerator(projectDirectory: Path) -> InputListGenerator:
+    """ The generator of a project folder. Its main file is <base>/<project>.tex (old style) or <project>/<project>.tex. """
+    legacyMainFile = projectDirectory.parent / (projectDirectory.name + '.tex')
+    return InputListGenerator(projectDirectory, f"../{legacyMainFile.name}" if legacyMainFile.exists() else legacyMainFile.name)
+
+def generatorForMainFile(texFile: Path) -> Optional[InputListGenerator]:
+    """ The generator of the project whose main file is texFile, None if texFile is not the main file of a project folder """
+    texFile = Path(texFile).absolute()
+    for projectDirectory in (texFile.parent / texFile.stem, texFile.parent):
+        if projectDirectory.name == texFile.stem and projectDirectory.is_dir() and not projectDirectory.name.startswith(('.', '_')):
+            return projectGenerator(projectDirectory)
+    return None
+
+def main(arguments: List[str]):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-directory", "--root", "-b", "-r", default=".", help="The directory with all project folders. Default: the current directory.")
+    parser.add_argument("--project", "--folder", "-p", "-f", default="", help="Only generate the input list of this project (folder name or main file). Default: all projects.")
+    options = parser.parse_args(arguments)
+    baseDirectory = Path(options.base_directory)
+    project = Path(options.project).stem if options.project else ""
+    for projectDirectory in projectDirectories(baseDirectory):
+        if project and projectDirectory.name != project:
+            continue
+        generator = projectGenerator(projectDirectory)
+        written = generator.update()
+        print(f"{'Wrote' if written else 'Unchanged:'} {generator.generatedFile} ({len(generator.files)} files)")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
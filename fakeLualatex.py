@@ -0,0 +1,145 @@
+""" Stand-in for lualatex (and with --tool for xindex and biber), so that processPoolBenchmark.py can measure the scheduling without a TeX installation.
+It accepts the command lines of processPool.py and takes time and memory according to the document:
+FAKE_SECONDS_PER_PACKAGE per \\usepackage, FAKE_SECONDS_PER_FONT per \\setmainfont/\\setsansfont/\\setmonofont/\\newfontfamily
+and FAKE_SECONDS_PER_KB per KB of document body (environment variables override the defaults below).
+Like \\pauseExecution, it waits for a line on stdin after the preamble if LATEX_ALLOW_PAUSE_EXECUTION=true.
+Every \\label goes to the .aux file with its page, and like LaTeX it asks for a rerun if the labels differ from the last .aux file.
+With -ini it dumps the packages of the file into <jobname>.fmt (and fails for fonts, like fontspec does), with -fmt=<file> it takes
+FAKE_SECONDS_FORMAT_LOAD instead of the time of these packages and skips the preamble up to \\pauseExecution (see PreambleFormat).
+Like LuaTeX, it forgets the Lua functions of the preamble in a format, so the body must not call them. """
+import json
+import os
+import re
+import sys
+import time
+
+DEFAULTS = {
+    'FAKE_SECONDS_BASE': 0.1,
+    'FAKE_SECONDS_PER_PACKAGE': 0.02,
+    'FAKE_SECONDS_PER_FONT': 0.15,
+    'FAKE_SECONDS_PER_KB': 0.002,
+    'FAKE_MB_PER_PACKAGE': 2.0,
+    'FAKE_SECONDS_FORMAT_LOAD': 0.03,
+}
+HALT_LOG = "PAUSED EXECUTION!"
+packageRegex = re.compile(r"^\s*\\(?:usepackage|RequirePackage)(?:\[[^\]]*\])?\{([^}]*)\}", re.MULTILINE)
+fontRegex = re.compile(r"^\s*\\(?:setmainfont|setsansfont|setmonofont|newfontfamily)", re.MULTILINE)
+pauseRegex = re.compile(r"^\s*\\pauseExecution\s*$", re.MULTILINE)
+luaFunctionRegex = re.compile(r"\bfunction\s+([A-Za-z_]\w*)\s*\(")
+labelRegex = re.compile(r"\\label\{([^}]*)\}")
+referenceRegex = re.compile(r"\\ref\{([^}]*)\}")
+PAGE_SIZE = 3000 # characters of the body per page
+
+def setting(name: str) -> float:
+    return float(os.environ.get(name, DEFAULTS[name]))
+
+def tool(name: str, arguments):
+    """ xindex -k <path> writes <path>.ind, biber <path> writes <path>.bbl """
+    path = arguments[-1]
+    print(f"This is fake {name}, processing {path}", flush=True)
+    time.sleep(setting('FAKE_SECONDS_BASE') / 2)
+    inputFile, outputFile = (path + '.idx', path + '.ind') if name == 'xindex' else (path + '.bcf', path + '.bbl')
+    if os.path.exists(inputFile):
+        with open(outputFile, 'w', encoding='utf-8') as output:
+            output.write(f"% fake {name} output\n")
+
+def option(arguments, name: str, default: str = "") -> str:
+    return next((argument.split('=', 1)[1] for argument in arguments if argument.lstrip('-').startswith(name + '=')), default)
+
+def dumpFormat(arguments):
+    """ lualatex -ini -jobname=<name> -output-directory=<directory> &lualatex <file> """
+    outputDirectory = option(arguments, 'output-directory', '.')
+    with open(arguments[-1], encoding='utf-8') as dumpFile:
+        content = dumpFile.read()
+    print("This is fake LuaHBTeX (processPoolBenchmark), INITEX", flush=True)
+    packages = packageRegex.findall(content)
+    for package in packages:
+        print(f"(/usr/share/texmf/tex/latex/{package}/{package}.sty)", flush=True)
+        time.sleep(setting('FAKE_SECONDS_PER_PACKAGE'))
+    time.sleep(setting('FAKE_SECONDS_BASE'))
+    if fontRegex.search(content) or 'fontspec' in packages:
+        print("! luaotfload | Lua state of the loaded fonts can't be dumped.", flush=True)
+        sys.exit(1)
+    formatFile = os.path.join(outputDirectory, option(arguments, 'jobname', 'texput') + '.fmt')
+    with open(formatFile, 'w', encoding='utf-8') as fmt:
+        json.dump({'packages': packages, 'preamble': content}, fmt)
+    print(f"Beginning to dump on file {formatFile}", flush=True)
+
+def lualatex(arguments):
+    if '-ini' in arguments or '--ini' in arguments:
+        return dumpFormat(arguments)
+    outputDirectory = option(arguments, 'output-directory', '.')
+    formatFile = option(arguments, 'fmt')
+    jobName = os.path.splitext(arguments[-1])[0]
+    texFile = open(jobName + '.tex', encoding='utf-8') # like TeX, it reads the body after the pause from the file it opened here
+    content = texFile.read()
+    if formatFile: # the format redefines \documentclass to skip the preamble
+        pause = pauseRegex.search(content)
+        content = content[pause.end():] if pause is not None else content
+    beginDocument = content.find('\\begin{document}')
+    preamble, body = (content[:beginDocument], content[beginDocument:]) if beginDocument >= 0 else (content, "")
+    packages = packageRegex.findall(preamble)
+    fonts = len(fontRegex.findall(preamble))
+
+    print("This is fake LuaHBTeX (processPoolBenchmark)", flush=True)
+    print(f"({jobName}.tex", flush=True)
+    dumped = {'packages': [], 'preamble': ""}
+    if formatFile:
+        with open(formatFile, encoding='utf-8') as fmt:
+            dumped = json.load(fmt)
+        packages += dumped['packages']
+        time.sleep(setting('FAKE_SECONDS_FORMAT_LOAD'))
+    memory = bytearray(int(setting('FAKE_MB_PER_PACKAGE') * len(packages) * 1024 * 1024)) # resident, like loaded packages and fonts
+    for i in range(0, len(memory), 4096):
+        memory[i] = 1
+    if not formatFile:
+        for package in packages:
+            print(f"(/usr/share/texmf/tex/latex/{package}/{package}.sty)", flush=True)
+            time.sleep(setting('FAKE_SECONDS_PER_PACKAGE'))
+        time.sleep(setting('FAKE_SECONDS_BASE') + fonts * setting('FAKE_SECONDS_PER_FONT'))
+
+    pause = pauseRegex.search(content)
+    if pause is not None and os.environ.get('LATEX_ALLOW_PAUSE_EXECUTION') == 'true':
+        print(HALT_LOG, flush=True)
+        sys.stdin.readline()
+        texFile.seek(0) # TeX reads the body only now: in-place edits count, a file renamed over the old one doesn't
+        content = texFile.read()
+        beginDocument = content.find('\\begin{document}')
+        body = content[beginDocument:] if beginDocument >= 0 else ""
+    texFile.close()
+
+    for function in luaFunctionRegex.findall(dumped['preamble']):
+        if re.search(rf"\b{function}\s*\(", body):
+            print(f"[\\directlua]:1: attempt to call a nil value (global '{function}')", flush=True)
+            sys.exit(1)
+    pages = max(1, len(body) // PAGE_SIZE)
+    time.sleep(len(body) / 1024 * setting('FAKE_SECONDS_PER_KB'))
+    output = os.path.join(outputDirectory, os.path.basename(jobName))
+    try:
+        with open(output + '.aux', encoding='utf-8') as aux:
+            oldAux = aux.read()
+    except OSError:
+        oldAux = ""
+    for match in referenceRegex.finditer(body):
+        if f"\\newlabel{{{match[1]}}}" not in oldAux:
+            print(f"LaTeX Warning: Reference `{match[1]}' on page {match.start() // PAGE_SIZE + 1} undefined on input line 1.", flush=True)
+    print(" ".join(f"[{page}]" for page in range(1, pages + 1)), flush=True)
+    newAux = "\\relax\n" + "".join(f"\\newlabel{{{match[1]}}}{{{{{index + 1}}}{{{match.start() // PAGE_SIZE + 1}}}}}\n" for index, match in enumerate(labelRegex.finditer(body)))
+    if newAux != oldAux and labelRegex.search(body):
+        print("LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.", flush=True)
+    os.makedirs(outputDirectory, exist_ok=True)
+    with open(output + '.aux', 'w', encoding='utf-8') as aux:
+        aux.write(newAux)
+    with open(output + '.pdf', 'w', encoding='utf-8') as pdf:
+        pdf.write(f"%PDF fake {time.time()}\n")
+    with open(output + '.fls', 'w', encoding='utf-8') as fls:
+        fls.write(f"PWD {os.getcwd()}\nINPUT ./{jobName}.tex\n")
+    with open(output + '.log', 'w', encoding='utf-8') as log:
+        log.write(f"fake log of {jobName}\n")
+    print(f"Output written on {output}.pdf ({pages} pages, 1000 bytes).", flush=True)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--tool':
+        tool(sys.argv[2], sys.argv[3:])
+    else:
+        lualatex(sys.argv[1:])
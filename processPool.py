@@ -1,72 +1,256 @@
 #region Imports
+# The editor runs this script on every save, mostly as a client. So the modules only the server needs are imported lazily
+# (see lazyImport), and the client itself is in processPoolClient.py. Measure with python processPoolBenchmark.py startup
+# click stays eager: it parses the command line of every call (its decorators run on import), so only modules that import
+# processPool would save it. Editors that want to skip it call processPoolClient.py. json and socket are eager because
+# processPoolClient, which every client call needs, imports them anyway.
+from __future__ import annotations
+
 # builtin
+import importlib.util
 import itertools
+import math
 import os
 import random
 import re
+import shlex
 import signal
 import subprocess
 import sys
 import time
 import contextlib
+import struct
+import json
+import socket
+from collections import OrderedDict, deque
 from datetime import datetime
 from pathlib import Path
 
-# quasi builtin
-import socket
-import asyncio
-from asyncio.subprocess import PIPE, Process
-import requests
-import shutil
-
 # command line interface
 import click
+from processPoolClient import DEFAULT_HOST, DEFAULT_PORT, ROUTE_OBFUSCATION, STATUS_LOG, UnexpectedAnswer, compileRemotely, printStatus, socketPath
+
+# platform specific
+try:
+    import fcntl # reflinks (copy-on-write clones) on Linux
+except ImportError:
+    fcntl = None
 
 # types
 from enum import Enum
 from abc import ABCMeta, abstractmethod
-from typing import Awaitable, Callable, Dict, List, Optional, Union
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+def lazyImport(name: str):
+    """ Returns the module name, which is only executed when one of its attributes is used for the first time """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader) # type: ignore[union-attr]
+    spec.loader = loader # type: ignore[union-attr]
+    module = importlib.util.module_from_spec(spec) # type: ignore[arg-type]
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# only needed by the server
+asyncio = lazyImport('asyncio')
+hashlib = lazyImport('hashlib')
+ctypes = lazyImport('ctypes')
+requests = lazyImport('requests')
+shutil = lazyImport('shutil')
+glob = lazyImport('glob')
+automate = lazyImport('automate') # automate.py next to this file
 
 PathOrString = Union[os.PathLike, str]
 
 #endregion
 
 #region constants
-ROUTE_OBFUSCATION = 'aosijfoaisdoifnasodnifaosinf'
-DEFAULT_PORT = 65344
-DEFAULT_HOST = "127.0.0.1"
 HALT_LOG = "PAUSED EXECUTION!"
 VERBOSE = False
 
-PROCESS_TIMEOUT = 15
-WAIT_FOR_COMPLETION_SLEEP_TIME = 0.8
-WAIT_WHILE_PREPARING_SLEEP_TIME = 0.4
-EMPTY_UPDATE_LOG_MAX_TRIES = 50 # program might be in a loop for WAIT_FOR_COMPLETION_TIMEOUT  * EMPTY_UPDATE_LOG_MAX_TRIES seconds
+PROCESS_TIMEOUT = 15 # a runner that is not waiting gets killed after not printing anything for this many seconds
 WAIT_FOR_COMPLETION_TIMEOUT = 60
-STATE_WATCHER_SLEEP_TIME = 2
+BATCH_COMPILE_TIMEOUT = 30 * 60 # seconds, the same for a compilation of --batch
+BATCH_STATE = "processPool-batch.json" # in the output directory: the input hashes of the last successful --batch build of every document
+
+# pool sizing: every watcher keeps enough warm runners to cover the requests expected within one preamble time
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 6
+POOL_DEFAULT_SIZE = 2 # until the first preamble time and request rate are known
+POOL_STATS_WINDOW = 8 # number of recent preamble times and requests the estimates are based on
+POOL_RESIZE_INTERVAL = 60 # seconds. An idle watcher reconsiders its pool size this often, so the pool shrinks after bursts
+COMPILE_DEBOUNCE = 0.0 # seconds without a new request before a pending compilation starts
+PROJECT_WATCH_DEBOUNCE = 0.3 # seconds. A ProjectWatcher handles the changes of this time window together
+PROJECT_POLL_INTERVAL = 1 # seconds, if inotify is not available
+MAX_PARALLEL_COMPILES = 0 # compilations of all documents that run at the same time. 0: one per CPU core
+RUNNER_MEMORY_ESTIMATE_MB = 400 # resident memory of one paused LuaLaTeX runner
+POOL_MEMORY_BUDGET_MB = 4000 # for the runners of all watchers together
+MAX_TOTAL_RUNNERS = 0 # live runners of all watchers together, 0 = only limited by the memory budget
+WATCHER_IDLE_TIMEOUT = 30 * 60 # seconds without a request after which a watcher and all its runners are torn down
+SCHEDULER_SWEEP_INTERVAL = 60
+DEPENDENCY_CHECK_INTERVAL = 5 # seconds. The watcher stops runners whose preamble dependencies changed this often (only stat calls, the runners are not woken up)
+PAUSE_COMMAND = "\\pauseExecution"
+
+MAX_COMPILE_PASSES = 3 # per request: LaTeX passes until the cross-references, index and bibliography are settled (see RerunDetector)
+PASS_LOG = "PROCESSPOOL PASS " # printed before every further pass
 
 MAX_NONSTOP_RUNS = 2
 TOO_MANY_NONSTOP_RUNS_COOLDOWN = 180
 
 SIMPLE_BACKGROUND_CALL_TIMEOUT = 60 # seconds
+RELOAD_IDLE_POLL_INTERVAL = 0.1 # seconds. A server with changed code checks this often whether it is idle, see CodeReloader
+RELOAD_PREPARING_TIMEOUT = 30 # seconds. Before a reload, PREPARING runners get this long to pause, so that they can be handed over
+ATTACHED_PROCESS_POLL_INTERVAL = 0.1 # seconds, see AttachedProcess.wait
 
-OLD_TEMP_DIR_TIMEOUT_MIN = 15
+STALE_TEMP_DIR_TIMEOUT = 24 * 60 * 60 # seconds. Temp directories of other servers that may still be running are deleted after this time
+STAGE_LOG = "PROCESSPOOL STAGE " # the command prints this followed by the stage name when a stage starts
 BASE_POWERSHELL_COMMAND = """
 Set-Item 'Env:\\LATEX_ALLOW_PAUSE_EXECUTION' -Value 'true';
+echo "{STAGE_LOG}prepare";
 mkdir "{tempOutputDirectory}";
 Copy-Item "{outputDirectory}/{fileName}*" "{tempOutputDirectory}";
-xindex -k "{tempOutputDirectory}/{fileName}";
-biber "{tempOutputDirectory}/{fileName}";
+{preprocessing}
+echo "{STAGE_LOG}lualatex";
 lualatex --recorder --file-line-error --interaction=nonstopmode --synctex=1 --output-directory="{tempOutputDirectory}" "{fileName}";
+echo "{STAGE_LOG}copy";
 Copy-Item "{tempOutputDirectory}/{fileName}*" "{outputDirectory}" -Force;
 rm -r "{tempOutputDirectory}"
-""" #  --max-print-line=300 doesn't work with miktex and lualatex. Add max-print-line=300 to  initexmf --edit-config-file lualatex
+"""
+# tools that run before lualatex. They are skipped if their inputs didn't change since their last run (see PreprocessingTracker)
+PREPROCESSING_TOOLS = ('xindex', 'biber')
+PREPROCESSING_POWERSHELL_COMMANDS = {
+    'xindex': 'echo "{STAGE_LOG}xindex"; xindex -k "{tempOutputDirectory}/{fileName}";',
+    'biber': 'echo "{STAGE_LOG}biber"; biber "{tempOutputDirectory}/{fileName}";',
+} #  --max-print-line=300 doesn't work with miktex and lualatex. Add max-print-line=300 to  initexmf --edit-config-file lualatex
 # $Env:LATEX_ALLOW_PAUSE_EXECUTION="true"; # Somehow doesn't work inside pwsh -c " ... " (at least on linux)
 # Copy-Item (copy) is from powershell, has star syntax which cp from linux seemingly doesn't have. cp on Windows is an alias for Copy-Item.
 
+# the same pipeline for the native backend (see LatexPipeline), which runs these without a shell
+NATIVE_PREPROCESSING_COMMANDS = {
+    'xindex': ['xindex', '-k', '{tempOutputDirectory}/{fileName}'],
+    'biber': ['biber', '{tempOutputDirectory}/{fileName}'],
+}
+NATIVE_LATEX_COMMAND = ['lualatex', '--recorder', '--file-line-error', '--interaction=nonstopmode', '--synctex=1', '--output-directory={tempOutputDirectory}', '{fileName}']
+# the engines of the native backends (see RunnerBackend). Only lualatex can pause (\pauseExecution uses \directlua). The other
+# runners prepare everything up to the engine call and start it when continued, latexmk runs all passes itself.
+LATEX_ENGINE_COMMANDS = {
+    'lualatex': NATIVE_LATEX_COMMAND,
+    'pdflatex': ['pdflatex', '--recorder', '--file-line-error', '--interaction=nonstopmode', '--synctex=1', '--output-directory={tempOutputDirectory}', '{fileName}'],
+    'xelatex': ['xelatex', '--recorder', '--file-line-error', '--interaction=nonstopmode', '--synctex=1', '--output-directory={tempOutputDirectory}', '{fileName}'],
+    'latexmk': ['latexmk', '-lualatex', '-recorder', '-file-line-error', '-interaction=nonstopmode', '-synctex=1', '-outdir={tempOutputDirectory}', '{fileName}'],
+}
+PAUSING_ENGINES = ('lualatex',)
+# files the pipeline only writes. The native backend doesn't copy them into the temp directory.
+PURE_OUTPUT_SUFFIXES = ('.pdf', '.synctex.gz', '.synctex', '.log', '.fls')
+# files that LaTeX reads after \begin{document}. They are staged again when a runner is continued (see LatexPipeline.restage).
+RESTAGED_SUFFIXES = ('.aux', '.toc', '.lof', '.lot', '.out', '.bbl', '.ind')
+FICLONE = 0x40049409 # ioctl request of Linux for a reflink
+BACKEND = 'native' # see runnerBackends
+WATCH_ROOT = "" # see ProjectWatcher
+COMPILE_ON_SAVE = False
+WATCH_POLLING = False
+GENERATE_INPUTS = False # update <project>_generated.tex before every compilation, see automate.py
+BUILD_CACHE_DIRECTORY = "" # see BuildCache, "" = defaultBuildCacheDirectory()
+BUILD_CACHE_MAX_MB = 0 # 0 = no build cache, opt in with --build-cache-size
+BUILD_CACHE_MANIFEST = "manifest.json"
+BUILD_CACHE_LOG = "processPool.log" # the runner log of a cached build
+BUILD_CACHE_SUFFIXES = ('.pdf', '.synctex.gz', '.synctex', '.log', '.fls', *RESTAGED_SUFFIXES) # of a build, restored from the cache
+CACHE_LOG = "PROCESSPOOL CACHED " # printed instead of the log when a request is served from the build cache
+WARM_START = 'pause' # default strategy of the documents, see PreambleFormat
+WARM_START_STRATEGIES = ('pause', 'format')
+FORMAT_ENGINES = ('lualatex',) # engines of the native backends that can start from a format of the preamble
+MAX_CACHED_FORMATS = 8 # .fmt files in <build cache directory>/formats, the least recently used are deleted first
+FORMAT_BUILD_TIMEOUT = 120 # seconds
+# dumps {dumpFile} (the preamble followed by FORMAT_DUMP_SUFFIX, see PreambleFormat.build) into {formatDirectory}/{formatName}.fmt, run in the folder of the document
+FORMAT_BUILD_COMMAND = ['lualatex', '-ini', '--interaction=nonstopmode', '--jobname={formatName}', '--output-directory={formatDirectory}', '&lualatex', '{dumpFile}']
+# appended to the preamble in the dump file: in a compilation with the format, \documentclass skips the preamble of the main file up to PAUSE_COMMAND
+FORMAT_DUMP_SUFFIX = "\n\\long\\def\\documentclass#1" + PAUSE_COMMAND + "{}\n\\dump\n"
+
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # seconds, for the timings of /metrics
+MAX_LOG_RECORDS = 50 # per kind of record in a LatexLogSummary, further ones are only counted
+LOG_BUFFER_MAX_LINES = 2000 # of a RunnerLog in memory. The complete log is in its spill file.
+LOG_BUFFER_MAX_BYTES = 256 * 1024
+LOG_TAIL_LINES = 20 # kept by a watcher for its abort message
+
 THIS_FILE_VERSION_TIME = Path(__file__).stat().st_mtime + 1
 #endregion
 
+#region Log parsing
+class LatexLogSummary:
+    """ Incremental parser of a LaTeX log. Keeps a compact, bounded index instead of the whole log:
+    errors (--file-line-error and "! ..." errors), overfull/underfull boxes, undefined references and citations,
+    other warnings and the page count. Feed it line by line. """
+    KINDS = ('error', 'box', 'reference', 'citation', 'warning')
+
+    def __init__(self) -> None:
+        self.records: Dict[str, List[Dict[str, object]]] = {kind: [] for kind in self.KINDS}
+        self.counts: Dict[str, int] = {kind: 0 for kind in self.KINDS}
+        self.pages: Optional[int] = None
+        self.rerunNeeded = False
+        self.listeners: List[Callable[[Dict[str, object]], None]] = [] # get every new record
+
+    def feed(self, line: str):
+        record = self.parse(line)
+        if record is None:
+            return
+        kind = str(record['kind'])
+        self.counts[kind] += 1
+        if len(self.records[kind]) < MAX_LOG_RECORDS:
+            self.records[kind].append(record)
+        for listener in self.listeners:
+            listener(record)
+
+    def parse(self, line: str) -> Optional[Dict[str, object]]:
+        match = fileLineErrorRegex.match(line)
+        if match:
+            return {'kind': 'error', 'file': match[1], 'line': int(match[2]), 'message': match[3]}
+        if line.startswith('! '):
+            return {'kind': 'error', 'file': None, 'line': None, 'message': line[2:]}
+        match = boxRegex.match(line)
+        if match:
+            return {'kind': 'box', 'file': None, 'line': int(match[3]) if match[3] else None, 'message': match[0]}
+        match = undefinedRegex.search(line)
+        if match:
+            return {'kind': match[1].lower(), 'file': None, 'line': int(match[3]) if match[3] else None, 'message': f"{match[1]} '{match[2]}' undefined"}
+        match = pagesRegex.search(line)
+        if match:
+            self.pages = int(match[1])
+            return None
+        if 'Rerun to get' in line or 'Please rerun LaTeX' in line:
+            self.rerunNeeded = True
+        if warningRegex.match(line):
+            return {'kind': 'warning', 'file': None, 'line': None, 'message': line}
+        return None
+
+    def toDict(self) -> Dict[str, object]:
+        return {'pages': self.pages, 'counts': self.counts, 'rerunNeeded': self.rerunNeeded, 'records': self.records}
+
+    def format(self) -> str:
+        """ A short text: one line with the counts, then the recorded errors and warnings """
+        counts = ", ".join(f"{self.counts[kind]} {name}" for kind, name in [
+            ('error', 'errors'), ('box', 'overfull/underfull boxes'), ('reference', 'undefined references'),
+            ('citation', 'undefined citations'), ('warning', 'other warnings')
+        ])
+        lines = [f"{self.pages if self.pages is not None else 'No'} pages, {counts}." + (" Rerun needed." if self.rerunNeeded else "")]
+        for kind in self.KINDS:
+            lines.extend(formatLogRecord(record) for record in self.records[kind])
+            if self.counts[kind] > len(self.records[kind]):
+                lines.append(f"... and {self.counts[kind] - len(self.records[kind])} more of kind {kind}")
+        return "\n".join(lines)
+
+def formatLogRecord(record: Dict[str, object]) -> str:
+    location = f"{record['file']}:{record['line']}: " if record['file'] else (f"line {record['line']}: " if record['line'] else "")
+    return f"[{record['kind']}] {location}{record['message']}"
+
+fileLineErrorRegex = re.compile(r'^(\S.*?\.\w+):(\d+): (.+)$')
+boxRegex = re.compile(r'^(Overfull|Underfull) \\[hv]box .*?(lines? (\d+)(?:--\d+)?)?$')
+undefinedRegex = re.compile(r"(Reference|Citation) [`']([^']*)' (?:on page \d+ )?undefined(?: on input line (\d+))?")
+pagesRegex = re.compile(r'Output written on .* \((\d+) pages?')
+warningRegex = re.compile(r'^(LaTeX|Package|Class)( \S+)? Warning: ')
+#endregion
+
 #region Watcher
 class RunnerStates(Enum):
     PREPARING = 0
@@ -80,10 +264,162 @@ class ErrorStates(Enum):
     NEVER_WAITED = 2
     ABORTED = 3
 
+class RunnerLog:
+    """ The output of a runner: the last lines in a ring buffer bounded by maxLines and maxBytes,
+    and (once spillTo was called) the complete log in a file on disk. """
+
+    def __init__(self, maxLines: int = LOG_BUFFER_MAX_LINES, maxBytes: int = LOG_BUFFER_MAX_BYTES) -> None:
+        self.buffer: 'deque[str]' = deque()
+        self.maxLines = maxLines
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.total = 0 # number of lines ever appended
+        self.spillFile: Optional[Path] = None
+        self.publishAs: Optional[Path] = None
+        self.keep = False # if set, the spill file is published instead of discarded
+        self._spill = None
+
+    def append(self, line: str):
+        self.buffer.append(line)
+        self.bytes += len(line) + 1
+        self.total += 1
+        while len(self.buffer) > self.maxLines or (self.bytes > self.maxBytes and len(self.buffer) > 1):
+            self.bytes -= len(self.buffer.popleft()) + 1
+        if self._spill is not None:
+            self._spill.write(line + "\n")
+
+    def __iter__(self):
+        return iter(self.buffer)
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def tail(self, count: int) -> List[str]:
+        return list(itertools.islice(self.buffer, max(len(self.buffer) - count, 0), None))
+
+    def since(self, index: int) -> List[str]:
+        """ The lines appended after the first index lines (as far as they are still buffered) """
+        return self.tail(self.total - index)
+
+    def spillTo(self, file: Path, publishAs: Path):
+        """ Write the complete log to file from now on (including the buffered lines). publish() moves it to publishAs. """
+        file.parent.mkdir(parents=True, exist_ok=True)
+        self._spill = open(file, 'w', encoding='utf-8')
+        self._spill.writelines(line + "\n" for line in self.buffer)
+        self.spillFile = file
+        self.publishAs = publishAs
+
+    def text(self) -> str:
+        """ The complete log, read from the spill file if there is one """
+        if self._spill is not None:
+            self._spill.flush()
+        if self.spillFile is not None and self.spillFile.exists():
+            return self.spillFile.read_text(encoding='utf-8', errors='replace')
+        return "\n".join(self.buffer)
+
+    def _close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def publish(self) -> Optional[Path]:
+        """ Close the spill file and move it to publishAs. Returns the path of the published log. """
+        self._close()
+        if self.spillFile is None or self.publishAs is None or not self.spillFile.exists():
+            return None
+        os.replace(self.spillFile, self.publishAs)
+        self.spillFile = self.publishAs
+        return self.publishAs
+
+    def discard(self):
+        """ Close and delete the spill file, unless the log is kept for publishing """
+        if self.keep:
+            return
+        self._close()
+        if self.spillFile is not None:
+            with contextlib.suppress(OSError):
+                self.spillFile.unlink()
+            self.spillFile = None
+
 class Runner(metaclass = ABCMeta):
+    """ One compilation, prepared up to PAUSE_COMMAND in advance. This is the interface the backends implement (see RunnerBackend):
+        - the runner starts PREPARING, switches to WAITING once it paused, to RUNNING in continueRun and to FINISHED when it ended,
+          always through _setState, which fires haltedEvent and exitedEvent,
+        - every line of its output goes through addLine, the start of every stage (see STAGE_LOG) into stageStarts,
+        - errorState tells how it ended: NEVER_WAITED if it ended while PREPARING, RETURN_CODE_NONZERO, or ABORTED if it was stopped.
+    continueRun waits for a PREPARING runner and returns False if the runner can't be continued (finished or outdated). stop ends it in any state. """
     def __init__(self) -> None:
-        self.lines: List[str] = []
+        self.lines = RunnerLog()
         self.errorState = ErrorStates.NONE
+        self._state: RunnerStates = RunnerStates.PREPARING
+        self._creationTime = time.time()
+        self.preambleTime: Optional[float] = None # seconds spent PREPARING, known once the runner is WAITING
+        self.continueTime: Optional[float] = None # when it switched to RUNNING
+        self.timedOut: Callable[[], bool] = lambda: False # whether the preamble this runner prepared is outdated
+        self.haltedEvent = asyncio.Event()  # set once the runner reached HALT_LOG, i.e. switched to WAITING
+        self.exitedEvent = asyncio.Event()  # set once the runner is FINISHED (for whatever reason)
+        self.stateListeners: List[Callable[[], None]] = []
+        self.lineListeners: List[Callable[[str], None]] = [] # get every new line of self.lines, e.g. to stream the log
+        self.logSummary = LatexLogSummary()
+        self.stageStarts: Dict[str, float] = {} # stage name (see STAGE_LOG) -> time it started
+        self.exitTime: Optional[float] = None
+        self.handOverInfo: Dict[str, object] = {} # what the watcher needs to adopt this runner after a reload, see newWatcher
+        self.strategy = 'pause' # how it skips the preamble: 'pause' at PAUSE_COMMAND or start from the 'format' of the preamble (see PreambleFormat)
+        self.formatFile: Optional[Path] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        """ The process ID to show in logs and to measure the memory of, None for runners without a process """
+        return None
+
+    def handOverState(self) -> Optional[Dict[str, object]]:
+        """ What a server that reloaded its code needs to take this WAITING runner over (see attachRunner), as JSON.
+        None if it can't be taken over, then it has to be stopped before the reload. """
+        return None
+
+    def _commonState(self) -> Dict[str, object]:
+        return {
+            'creationTime': self._creationTime, 'preambleTime': self.preambleTime, 'stageStarts': self.stageStarts, 'lines': list(self.lines),
+            'strategy': self.strategy, 'formatFile': str(self.formatFile) if self.formatFile is not None else None
+        }
+
+    def _restoreState(self, state: Dict[str, object]):
+        """ The counterpart of _commonState: the runner continues WAITING """
+        for line in state['lines']: # type: ignore[attr-defined]
+            self.addLine(line)
+        self.stageStarts.update(state['stageStarts']) # type: ignore[arg-type]
+        self._creationTime = float(state['creationTime']) # type: ignore[arg-type]
+        self.strategy = str(state.get('strategy', 'pause'))
+        self.formatFile = Path(str(state['formatFile'])) if state.get('formatFile') else None
+        self._setState(RunnerStates.WAITING)
+        self.preambleTime = state['preambleTime'] # type: ignore[assignment]
+
+    def stageDurations(self) -> Dict[str, float]:
+        """ Durations of the stages that are completed. A stage ends when the next one starts or the runner exits. """
+        starts = sorted(self.stageStarts.items(), key=lambda item: item[1])
+        ends = [start for _, start in starts[1:]]
+        if self.exitTime is not None:
+            ends.append(self.exitTime)
+        return {stage: end - start for (stage, start), end in zip(starts, ends)}
+
+    def _setState(self, state: RunnerStates):
+        """ Switch to state, fire the matching events and notify the listeners (e.g. the ProcessWatcher). """
+        self._state = state
+        if state == RunnerStates.WAITING:
+            self.preambleTime = time.time() - self._creationTime
+            self.haltedEvent.set()
+        elif state == RunnerStates.RUNNING:
+            self.continueTime = time.time()
+        elif state == RunnerStates.FINISHED:
+            self.exitedEvent.set()
+        for listener in list(self.stateListeners): # they may remove themselves
+            listener()
+
+    def addLine(self, line: str):
+        self.lines.append(line)
+        self.logSummary.feed(line)
+        for listener in self.lineListeners:
+            listener(line)
 
     @abstractmethod
     async def getState(self)->RunnerStates:
@@ -92,7 +428,7 @@ class Runner(metaclass = ABCMeta):
     async def continueRun(self) -> bool:
         pass
     @abstractmethod
-    async def updateLog(self, timeout: float = 0.05, log: bool = False) -> list:
+    async def updateLog(self, log: bool = False) -> list:
         pass
     @abstractmethod
     async def stop(self):
@@ -102,21 +438,128 @@ class Runner(metaclass = ABCMeta):
     async def newRunner(command: str, workingDirectory: 'PathOrString | None' = None, info: str = "", timeoutFunction: Callable[[float], bool] = lambda _: False) -> 'Runner':
         pass
 
-class ProcessWatcher:
-    minNumberAvailable = 2
+async def waitForAnyEvent(*events: asyncio.Event):
+    """ Wait until at least one of the events is set. """
+    waiters = [asyncio.ensure_future(event.wait()) for event in events]
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+class CompileRequest:
+    """ One compilation of a ProcessWatcher, shared by all requests that arrived before it started """
 
-    def __init__(self, newRunnerCallback: Callable[..., Awaitable[Runner]]) -> None:
+    def __init__(self) -> None:
+        self.listeners: 'List[tuple[Callable[[str], None], bool]]' = [] # (onLine, fullLog) of the callers
+        self.waitForCompletion = False
+        self.lastArrival = time.time()
+        self.done: 'asyncio.Future[Runner | None]' = asyncio.get_event_loop().create_future()
+        self.runner: Optional[Runner] = None
+        self.supersededBy: Optional['CompileRequest'] = None # set when cancelled in favour of a newer request
+        self.abortMessage = ""
+        self.cacheHit: Optional['CacheHit'] = None # set if the request was served from the build cache
+
+class ProcessWatcher:
+    minPoolSize = POOL_MIN_SIZE
+    maxPoolSize = POOL_MAX_SIZE
+    debounce = COMPILE_DEBOUNCE
+    cancelStale = False
+    maxPasses = MAX_COMPILE_PASSES
+    completionTimeout = WAIT_FOR_COMPLETION_TIMEOUT
+
+    def __init__(self, newRunnerCallback: Callable[..., Awaitable[Runner]], name: str = "", rerunDetector: 'RerunDetector | None' = None, prepareInputs: Optional[Callable[[], bool]] = None, buildCache: 'DocumentCache | None' = None, preambleFormat: 'PreambleFormat | None' = None) -> None:
         self.newRunner = newRunnerCallback
+        self.name = name
+        self.rerunDetector = rerunDetector # without one, every request is a single pass
+        self.prepareInputs = prepareInputs # runs before every compilation, returns whether it changed something
+        self.buildCache = buildCache # serves requests whose inputs match an earlier build without LaTeX
+        self.preambleFormat = preambleFormat # for the runners of the 'format' strategy, None if the backend can't use one
+        self.minNumberAvailable = POOL_DEFAULT_SIZE
+        self.preambleTimes: 'deque[float]' = deque(maxlen=POOL_STATS_WINDOW)
+        self.requestTimes: 'deque[float]' = deque(maxlen=POOL_STATS_WINDOW)
+        self.lastUsed = time.time()
 
         self.runners: List[Runner] = []
         self.runningRunners: List[Runner] = []
         self.watchTask: 'asyncio.Task | None' = None
-        self.finishResults = {errorState: 0 for errorState in [ErrorStates.NEVER_WAITED, ErrorStates.RETURN_CODE_NONZERO, ErrorStates.NONE, ErrorStates.ABORTED]}        
+        self.finishResults = {errorState: 0 for errorState in [ErrorStates.NEVER_WAITED, ErrorStates.RETURN_CODE_NONZERO, ErrorStates.NONE, ErrorStates.ABORTED]}
         self.exited = 0
         self.maxNeverWaitedErrors = MAX_NONSTOP_RUNS
-        self.lastLog = ""
+        self.lastLogTail = "" # last lines of the last log, for the abort message
+        self.lastLogFile: Optional[Path] = None # the complete last log
+        self.lastStatus: Dict[str, object] = {} # of the last execute call, see STATUS_LOG
+        self._stateChanged = asyncio.Event()
+        self._measuredRunners: 'set[Runner]' = set()
+        self._startingRunners = 0
+        self.sizeReason = "no measurements yet"
+        self._pendingCompile: Optional[CompileRequest] = None
+        self._currentCompile: Optional[CompileRequest] = None
+        self._compileTask: 'asyncio.Future | None' = None
+        self._lock = asyncio.Lock() # guards self.runners and self.runningRunners against concurrent refreshes
+        self._claimedRunners: 'set[Runner]' = set() # chosen by a compilation, but not RUNNING yet
+        self.servedBy = {RunnerStates.WAITING.name: 0, RunnerStates.PREPARING.name: 0, 'CACHE': 0} # state of the runners when they were chosen for a request, or the build cache
+
+    def resizePool(self):
+        """ Choose self.minNumberAvailable from the measured preamble time and request rate: enough warm runners to cover
+        the requests expected within one preamble time, within [minPoolSize, maxPoolSize] and the server-wide runner budget. """
+        size, reason = self.targetPoolSize()
+        if size != self.minNumberAvailable:
+            print(f"Pool size for {self.name or 'watcher'}: {self.minNumberAvailable} -> {size} ({reason})")
+        self.minNumberAvailable = size
+        self.sizeReason = reason
+
+    def targetPoolSize(self) -> 'tuple[int, str]':
+        if not self.preambleTimes or len(self.requestTimes) < 2:
+            size = POOL_DEFAULT_SIZE
+            reason = "no measurements yet"
+        else:
+            preambleTime = sum(self.preambleTimes) / len(self.preambleTimes)
+            # the time since the last request counts as an (unfinished) gap, so the rate decays while nobody compiles.
+            # It is at least as long as the last gap, right after a request it would be about 0.
+            gaps = [later - earlier for earlier, later in zip(self.requestTimes, itertools.islice(self.requestTimes, 1, None))]
+            gaps.append(max(time.time() - self.requestTimes[-1], gaps[-1]))
+            requestRate = len(gaps) / max(sum(gaps), 1e-3)
+            expectedRequests = requestRate * preambleTime
+            size = max(1, math.ceil(expectedRequests))
+            reason = f"{expectedRequests:.2f} requests expected within the preamble time of {preambleTime:.1f} s"
+        if size < self.minPoolSize:
+            size = self.minPoolSize
+            reason += f", raised to the minimum {self.minPoolSize}"
+        if size > self.maxPoolSize:
+            size = self.maxPoolSize
+            reason += f", capped at the maximum {self.maxPoolSize}"
+        budget = scheduler.capacity - len(self.runningRunners) # runners of less recently used watchers get evicted if necessary
+        if size > budget:
+            size = max(budget, 1)
+            reason += f", limited by the server-wide budget of {scheduler.capacity} runners"
+        return size, reason
+
+    @property
+    def isCompiling(self) -> bool:
+        return self._currentCompile is not None or self._pendingCompile is not None
+
+    @property
+    def liveRunners(self) -> int:
+        return len(self.runners) + len(self.runningRunners) + self._startingRunners
+
+    async def evictIdleRunner(self) -> bool:
+        """ Stop one of the available runners (the youngest) to free its slot for another watcher """
+        idleRunners = [runner for runner in self.runners if runner not in self._claimedRunners]
+        if not idleRunners:
+            return False
+        runner = idleRunners[-1]
+        self.runners.remove(runner)
+        print(f"Evicting an idle runner of {self.name or 'watcher'} for a more recently used document.")
+        await runner.stop()
+        self.finishResults[ErrorStates.ABORTED] += 1
+        return True
+
+    async def refreshState(self):
+        async with self._lock:
+            await self._refreshState()
 
-    async def refreshState(self):        
+    async def _refreshState(self):
         if self.exited:
             return
         if self.finishResults[ErrorStates.NEVER_WAITED] > self.maxNeverWaitedErrors:
@@ -129,59 +572,175 @@ class ProcessWatcher:
             state = await runner.getState()
             if state == RunnerStates.FINISHED:
                 self.finishResults[runner.errorState] += 1
-            elif state == RunnerStates.RUNNING:
+                if runner.lines.keep: # a timed out request finished after all
+                    runner.lines.publish()
+                else:
+                    runner.lines.discard()
+            elif state == RunnerStates.RUNNING or runner in self._claimedRunners:
                 runningRunners.append(runner)
+            elif runner.timedOut():
+                print("Stopping a runner with an outdated preamble.")
+                await runner.stop()
+                self.finishResults[ErrorStates.ABORTED] += 1 # it doesn't come back to this loop
             elif state == RunnerStates.WAITING or state == RunnerStates.PREPARING:
                 availableRunners.append(runner)
-        
+            if runner.preambleTime is not None and runner not in self._measuredRunners:
+                self._measuredRunners.add(runner)
+                self.preambleTimes.append(runner.preambleTime)
+                metrics.observe('preamble', runner.preambleTime, document=self.name)
+
         self.runners = availableRunners
         self.runningRunners = runningRunners
-        
+        self._measuredRunners.intersection_update(itertools.chain(self.runners, self.runningRunners))
+
+        self.resizePool()
+        while len(self.runners) > self.minNumberAvailable: # surplus runners: stop the youngest, they are the least likely to be WAITING already
+            await self.runners.pop().stop()
+            self.finishResults[ErrorStates.ABORTED] += 1
         for _ in range(len(self.runners), self.minNumberAvailable):
+            if not await scheduler.requestRunnerSlot(self):
+                print(f"Only {len(self.runners)}/{self.minNumberAvailable} runners available, but the server-wide budget of {scheduler.capacity} runners is used up.")
+                break
             print(f"Only {len(self.runners)}/{self.minNumberAvailable} runners available, starting a new runner ") #of type", self.T.__name__)
-            self.runners.append(await self.newRunner())
-        
+            await self.startRunner()
+
+    async def startRunner(self, handedOver: Optional[Dict[str, object]] = None):
+        """ Add a new runner, or with handedOver the runner with this handOverState from before a reload (see CodeReloader) """
+        self._startingRunners += 1 # counts as live already, so that concurrent slot requests see it
+        try:
+            runner = await self.newRunner() if handedOver is None else await self.newRunner(handedOver)
+        finally:
+            self._startingRunners -= 1
+        runner.stateListeners.append(self._stateChanged.set)
+        self.runners.append(runner)
+
+    async def warmUp(self):
+        """ Fill the pool without compiling, e.g. because a file of the document is being edited """
+        if self.exited:
+            return
+        self.lastUsed = time.time()
+        await self.refreshState()
+        await self.runWatcher()
+
     async def exit(self):
         print("ABORTING!")
         self.exited = time.time()
+        await self.close()
+
+    async def close(self):
+        """ Stop the watcher and all of its runners """
         await self.stopWatcher()
         for runner in itertools.chain(self.runners, self.runningRunners):
             await runner.stop()
-    
+
     def unexit(self):
         print("RESUMING!")
         self.exited = 0
         self.maxNeverWaitedErrors += MAX_NONSTOP_RUNS
-            
+
     async def watch(self):
+        """ Refresh the pool whenever one of the runners changes its state (instead of polling them). """
         print("WATCHER STARTED")
         while not self.exited:
+            self._stateChanged.clear()
             await self.refreshState()
-            await asyncio.sleep(STATE_WATCHER_SLEEP_TIME)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stateChanged.wait(), min(POOL_RESIZE_INTERVAL, DEPENDENCY_CHECK_INTERVAL))
 
     async def runWatcher(self):
         if self.watchTask is None:
             self.watchTask = asyncio.get_running_loop().create_task(self.watch())
             print("Watcher started.")
-    
+
     _watcherStopTimeout = 4
-    _watcherStopInterval = 0.1
     async def stopWatcher(self):
-        if self.watchTask is None:
+        if self.watchTask is None or self.watchTask is asyncio.current_task():
+            self.watchTask = None
             return
         print("Stopping the Watcher ...", end='', flush=True)
         self.watchTask.cancel()
-        i = 0
-        while not self.watchTask.cancelled() and i < self._watcherStopTimeout/self._watcherStopInterval:
-            await asyncio.sleep(0.1)
-            i += 1
-        if i >= self._watcherStopTimeout/self._watcherStopInterval:
+        try:
+            await asyncio.wait_for(self.watchTask, self._watcherStopTimeout)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
             print(f"WATCHER COULD NOT BE STOPPED IN {self._watcherStopTimeout} s!")
         print("WATCHER STOPPED")
         self.watchTask = None
 
-    async def execute(self, waitForCompletion: bool = False) -> str:
-        def abort() -> str:
+    async def execute(self, waitForCompletion: bool = False, onLine: Optional[Callable[[str], None]] = None, fullLog: bool = True) -> str:
+        """ Finish a compilation and return its log, or only the summary of its errors and warnings if not fullLog.
+        onLine gets every line of that as soon as it is there (for the summary: every error or warning).
+        If the rerunDetector asks for it, further passes follow with other runners of the pool, up to self.maxPasses in total.
+        Requests that arrive while a compilation is running share one pending compilation, which starts when the running one
+        has finished and no further request came for self.debounce seconds. With self.cancelStale, a new request stops the
+        running compilation instead, and its callers get the result of the pending one. """
+        request = self._pendingCompile
+        if request is None:
+            request = self._pendingCompile = CompileRequest()
+            self._compileTask = asyncio.ensure_future(self._runCompile(request, self._compileTask))
+        request.lastArrival = time.time()
+        request.waitForCompletion |= waitForCompletion
+        if onLine is not None:
+            request.listeners.append((onLine, fullLog))
+        if self.cancelStale and self._currentCompile is not None:
+            await self._cancelCompile(self._currentCompile, request)
+
+        while True:
+            runner = await asyncio.shield(request.done)
+            if request.supersededBy is None:
+                break
+            request = request.supersededBy
+        if runner is None:
+            return request.cacheHit.text(fullLog) if request.cacheHit is not None else request.abortMessage
+        return runner.lines.text() if fullLog else runner.logSummary.format()
+
+    async def _runCompile(self, request: 'CompileRequest', previous: 'asyncio.Future | None'):
+        if previous is not None:
+            await asyncio.wait([previous])
+        while request.lastArrival + self.debounce > time.time():
+            await asyncio.sleep(request.lastArrival + self.debounce - time.time())
+        self._pendingCompile = None
+        self._currentCompile = request
+        compileSlots = scheduler.compileSlots()
+        if compileSlots.locked():
+            print(f"All {scheduler.parallelCompiles} compilation slots are busy, {self.name or 'watcher'} has to wait.")
+        try:
+            async with compileSlots:
+                request.done.set_result(await self._compile(request))
+        except asyncio.CancelledError:
+            request.done.cancel()
+            raise
+        except Exception as error:
+            request.done.set_exception(error)
+        finally:
+            self._currentCompile = None
+
+    async def _cancelCompile(self, stale: 'CompileRequest', newer: 'CompileRequest'):
+        """ Stop the runner of the stale compilation and pass its callers on to the newer one """
+        if stale.runner is None or stale.supersededBy is not None:
+            return # still looking for a runner, that is no compilation to save
+        print("Cancelling the running compilation of", self.name or "watcher", "because of a newer request")
+        stale.supersededBy = newer
+        newer.listeners.extend(stale.listeners)
+        newer.waitForCompletion |= stale.waitForCompletion
+        stale.runner.addLine("CANCELLED BECAUSE OF A NEWER REQUEST")
+        stale.runner.lines.keep = False
+        await stale.runner.stop()
+
+    async def _compile(self, request: 'CompileRequest') -> Optional[Runner]:
+        """ Finish one compilation for all callers of request. Returns its runner, or None if the watcher gave up. """
+        startTime = time.time()
+        lineListeners = [onLine for onLine, fullLog in request.listeners if fullLog]
+        recordListeners = [onLine for onLine, fullLog in request.listeners if not fullLog]
+        def onLine(line: str):
+            for listener in lineListeners:
+                listener(line)
+        def onRecord(record: Dict[str, object]):
+            line = formatLogRecord(record)
+            for listener in recordListeners:
+                listener(line)
+        def abort() -> None:
             abort_message = (
                     "I already had {} successful compilations, {} nonzero return codes from runners, "
                     "{} aborted rund and {} runners that never waited. \nABORTING because that is too much! Last log:\n{}"
@@ -190,50 +749,136 @@ class ProcessWatcher:
                     self.finishResults[ErrorStates.RETURN_CODE_NONZERO],
                     self.finishResults[ErrorStates.ABORTED],
                     self.finishResults[ErrorStates.NEVER_WAITED],
-                    self.lastLog
+                    self.lastLogTail
                 )
             print(abort_message)
-            return abort_message
+            self.lastStatus = {'status': 'aborted', 'errorState': ErrorStates.ABORTED.name, 'seconds': time.time() - startTime}
+            for listener, _ in request.listeners:
+                listener(abort_message)
+            request.abortMessage = abort_message
         if self.exited:
-            if self.exited > time.time() - TOO_MANY_NONSTOP_RUNS_COOLDOWN: 
+            if self.exited > time.time() - TOO_MANY_NONSTOP_RUNS_COOLDOWN:
                 return abort()
             self.unexit()
-        else:            
-            await self.stopWatcher() # the watcher might currently access the stdout.readline() method. Python throws a RuntimeError when we then also access it.
-        
-        await self.refreshState() 
-        print("Will finish a compilation. I already had", self.finishResults[ErrorStates.NONE], "successful compilations", self.finishResults[ErrorStates.RETURN_CODE_NONZERO], "nonzero return codes from runners, and", self.finishResults[ErrorStates.NEVER_WAITED], "runners that never waited (I will abort after 3)" )
 
-        execute_runner = self.runners[0]
+        self.lastUsed = time.time()
+        self.requestTimes.append(self.lastUsed)
+        if self.prepareInputs is not None: # LaTeX reads the inputs only after the pause, so the runners stay valid
+            if await asyncio.get_running_loop().run_in_executor(None, self.prepareInputs):
+                print(f"Updated the inputs of {self.name or 'watcher'}.")
+        if self.buildCache is not None:
+            hit = await asyncio.get_running_loop().run_in_executor(None, self.buildCache.restore)
+            if hit is not None:
+                return self._serveCached(request, hit, startTime)
+        passes = 0
         while True:
-            if self.exited: #self.refreshState() above might have exited because of too many NEVER_WAITED runners
+            passes += 1
+            before = self.rerunDetector.snapshot() if self.rerunDetector is not None else {}
+            chosen = await self._continueRunner(startTime)
+            if chosen is None: # self.refreshState() might have exited because of too many NEVER_WAITED runners
                 return abort()
-            for runner in self.runners: # look for a waiting runner
-                if await runner.getState() == RunnerStates.WAITING:
-                    execute_runner = runner
+            execute_runner = chosen
+
+            request.runner = execute_runner
+            execute_runner.lines.keep = True
+            # no await since continueRun, so no line is missed
+            for line in execute_runner.lines:
+                onLine(line)
+            for records in execute_runner.logSummary.records.values():
+                for record in records:
+                    onRecord(record)
+            execute_runner.lineListeners.append(onLine)
+            execute_runner.logSummary.listeners.append(onRecord)
+            await self.runWatcher()
+            try:
+                if request.waitForCompletion:
+                    try:
+                        await asyncio.wait_for(execute_runner.exitedEvent.wait(), self.completionTimeout)
+                    except asyncio.TimeoutError:
+                        execute_runner.addLine(f"ABORTED AFTER {self.completionTimeout} SECONDS")
+                        for listener in recordListeners:
+                            listener(f"ABORTED AFTER {self.completionTimeout} SECONDS")
+                        print(f"ABORTED AFTER {self.completionTimeout} SECONDS. PID", execute_runner.pid)
+            finally:
+                execute_runner.lineListeners.remove(onLine)
+                execute_runner.logSummary.listeners.remove(onRecord)
+            print("Execution finished. PID:", execute_runner.pid)
+            if request.supersededBy is not None:
+                return execute_runner
+            if execute_runner.exitedEvent.is_set():
+                metrics.observeServedRunner(self.name, execute_runner)
+            if not execute_runner.exitedEvent.is_set() or passes >= self.maxPasses or self.rerunDetector is None:
                 break
-
-            if await execute_runner.continueRun():
+            reason = self.rerunDetector.reason(execute_runner, before)
+            if reason is None:
                 break
-            await self.refreshState() # there was an instance where this ran an infinite loop. A seemingly old runner (timedOut()) got selected as execute_runner and continueRun() returned False. In refreshState it should already be removed from self.runners !?
+            message = f"{PASS_LOG}{passes + 1}, because {reason}."
+            print(message)
+            for listener, _ in request.listeners:
+                listener(message)
+            execute_runner.lines.publish()
+
+        self.lastStatus = {
+            'status': 'finished' if execute_runner.exitedEvent.is_set() else 'timeout',
+            'errorState': execute_runner.errorState.name,
+            'seconds': time.time() - startTime,
+            'passes': passes,
+            'pages': execute_runner.logSummary.pages,
+            'counts': execute_runner.logSummary.counts,
+            'rerunNeeded': execute_runner.logSummary.rerunNeeded,
+            'strategy': execute_runner.strategy,
+        }
+        metrics.observe('request', float(self.lastStatus['seconds']), document=self.name, strategy=execute_runner.strategy) # type: ignore[arg-type]
+        self.lastLogTail = "\n".join(execute_runner.lines.tail(LOG_TAIL_LINES))
+        if execute_runner.exitedEvent.is_set():
+            self.lastLogFile = execute_runner.lines.publish()
+            if self.buildCache is not None and execute_runner.errorState == ErrorStates.NONE and not execute_runner.logSummary.rerunNeeded:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.buildCache.store, self.lastStatus, execute_runner.logSummary.format(), self.lastLogFile, startTime
+                )
+        return execute_runner
+
+    def _serveCached(self, request: 'CompileRequest', hit: 'CacheHit', startTime: float) -> None:
+        """ Finish request with a build from the build cache, whose files are already in the output directory """
+        print(hit.note)
+        self.servedBy['CACHE'] += 1
+        for listener, fullLog in request.listeners:
+            for line in hit.text(fullLog).splitlines():
+                listener(line)
+        self.lastStatus = {**hit.status, 'seconds': time.time() - startTime, 'passes': 0, 'cached': True, 'strategy': 'cache'} # no LaTeX pass ran
+        metrics.observe('request', time.time() - startTime, document=self.name, strategy='cache')
+        request.cacheHit = hit
+
+    async def _continueRunner(self, startTime: float) -> Optional[Runner]:
+        """ Continue a runner of the pool (preferably a WAITING one). Returns it, or None if the watcher gave up. """
+        await self.refreshState()
+        print("Will finish a compilation. I already had", self.finishResults[ErrorStates.NONE], "successful compilations", self.finishResults[ErrorStates.RETURN_CODE_NONZERO], "nonzero return codes from runners, and", self.finishResults[ErrorStates.NEVER_WAITED], "runners that never waited (I will abort after 3)" )
 
-        await self.runWatcher()
-        if waitForCompletion:
-            i = 0
-            while await execute_runner.getState() != RunnerStates.FINISHED and i < WAIT_FOR_COMPLETION_TIMEOUT/WAIT_FOR_COMPLETION_SLEEP_TIME: # let the watcher do the state checking
-                await asyncio.sleep(WAIT_FOR_COMPLETION_SLEEP_TIME)
-                # await execute_runner.updateLog()
-                i += 1
-
-            if i >= WAIT_FOR_COMPLETION_TIMEOUT/WAIT_FOR_COMPLETION_SLEEP_TIME:
-                execute_runner.lines.insert(0, f"ABORTED AFTER {WAIT_FOR_COMPLETION_TIMEOUT} SECONDS")
-                print(f"ABORTED AFTER {WAIT_FOR_COMPLETION_TIMEOUT} SECONDS.")
-                if isinstance(execute_runner, LatexRunner):
-                    print("PID", execute_runner.process.pid)
-        await execute_runner.updateLog(log = VERBOSE)
-        print("Execution finished. PID:", execute_runner.process.pid if isinstance(execute_runner, LatexRunner) else "unknown")
-        self.lastLog = "\n".join(execute_runner.lines)
-        return self.lastLog
+        while True:
+            if self.exited:
+                return None
+            async with self._lock:
+                if not self.runners: # a request always gets its runner, even if that exceeds the server-wide budget
+                    await self.startRunner()
+                execute_runner = self.runners[0]
+                for runner in self.runners: # look for a waiting runner
+                    if await runner.getState() == RunnerStates.WAITING:
+                        execute_runner = runner
+                        break
+                chosenState = await execute_runner.getState()
+                self._claimedRunners.add(execute_runner)
+
+            try:
+                continued = await execute_runner.continueRun()
+            finally:
+                self._claimedRunners.discard(execute_runner)
+            if continued:
+                break
+            await self.refreshState()
+        if chosenState.name in self.servedBy:
+            self.servedBy[chosenState.name] += 1
+        metrics.observe('continue', time.time() - startTime, document=self.name)
+        return execute_runner
 
 #endregion
 
@@ -243,156 +888,553 @@ class LatexRunner(Runner):
     def __init__(self, info: str, timeoutFunction: Callable[[float], bool]) -> None:
         """ Call the async static method newRunner instead """
         super().__init__()
-        self.process: Process = None # type: ignore
-        self._state: RunnerStates = None # type: ignore
+        self.process: asyncio.subprocess.Process = None # type: ignore # the lualatex process, or the process of the current step for a NativeLatexRunner
         self.info = info
-        self._creationTime = time.time()
         self._lastLogTime = self._creationTime
+        self._readLines = 0 # lines already returned by updateLog
+        self._readerTask: 'asyncio.Task | None' = None
+        self.stopped = False # set by stop before it kills the process: whatever the process leaves behind must not be published
+        self._continuedEvent = asyncio.Event() # set when continueRun switches it to RUNNING, which starts the silence timeout again
         self.timedOut = lambda: timeoutFunction(self._creationTime)
 
     @staticmethod
     async def newRunner(command: str, workingDirectory: 'PathOrString | None' = None, info: str = "", timeoutFunction: Callable[[float], bool] = lambda x: False) -> Runner:
         self = LatexRunner(info=info, timeoutFunction=timeoutFunction)
-        self.process = await asyncio.create_subprocess_shell(command, stdin=PIPE, stdout=PIPE, cwd=workingDirectory)
-        self._state = RunnerStates.PREPARING
-        self.lines.append(f"I am a LaTeX runner with PID {self.process.pid} (process ID as seen in the task manager) and command\n\t{command}.")
+        self.process = await asyncio.create_subprocess_shell(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=workingDirectory)
+        self.addLine(f"I am a LaTeX runner with PID {self.process.pid} (process ID as seen in the task manager) and command\n\t{command}.")
         print(f"Created new LaTeX runner with PID {self.process.pid} (process ID as seen in the task manager) and command\n\t{command}.")
+        self._readerTask = asyncio.get_running_loop().create_task(self._run())
         return self
 
-    async def checkIfProcessTerminated(self):
-        with contextlib.suppress(asyncio.TimeoutError):
-            await asyncio.wait_for(self.process.wait(), 1e-6)
-        return self.process.returncode is not None
-    
-    async def checkIfWaiting(self):
-        for line in await self.updateLog(log=VERBOSE):
-            if HALT_LOG in line:
-                print("This runner has switched to the waiting state! PID:", self.process.pid)
-                return True
-        return False
+    @staticmethod
+    async def attach(state: Dict[str, object], timeoutFunction: Callable[[float], bool]) -> Runner:
+        """ Take over a runner that the server handed over before it reloaded its code (see handOverState) """
+        self = LatexRunner(info=str(state['info']), timeoutFunction=timeoutFunction)
+        self._restoreState(state)
+        self.process = await AttachedProcess.attach(state['pid'], state['stdin'], state['stdout']) # type: ignore[assignment,arg-type]
+        self._readerTask = asyncio.get_running_loop().create_task(self._run())
+        return self
 
-    async def getState(self) -> RunnerStates:
-        terminated = await self.checkIfProcessTerminated()
-        if not terminated:
-            startedWaiting = await self.checkIfWaiting() # updates the log and _lastLogTime
-            if self._state == RunnerStates.PREPARING and startedWaiting:
-                self._state = RunnerStates.WAITING
-            # if it starts waiting again after being out of preparing mode -- this is not intended -- so, we just kill it after PROCESS_TIMEOUT seconds below .
-            if self._state != RunnerStates.WAITING and \
-                    self._lastLogTime < time.time() - PROCESS_TIMEOUT:
-                print("-" * 20)
-                try:
-                    self.process.kill()
-                except Exception as e:
-                    print("TRIED TO KILL (",e,")", end=' ')
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process is not None else None
+
+    def handOverState(self) -> Optional[Dict[str, object]]:
+        if self._state != RunnerStates.WAITING or self.process is None or self.process.returncode is not None:
+            return None
+        pipes = processPipes(self.process)
+        if pipes is None:
+            return None
+        for descriptor in pipes:
+            os.set_inheritable(descriptor, True) # survives the exec
+        return {**self._commonState(), 'kind': 'shell', 'info': self.info, 'pid': self.process.pid, 'stdin': pipes[0], 'stdout': pipes[1]}
+
+    async def _run(self):
+        try:
+            await self._readOutput()
+        finally:
+            self._finish()
+
+    async def _readOutput(self) -> bool:
+        """ The only reader of the process output: appends every line to self.lines and fires the events.
+        While not waiting, the process gets killed after it didn't output anything for PROCESS_TIMEOUT seconds.
+        Returns whether the process ended by itself. """
+        assert self.process.stdout is not None
+        readline: 'asyncio.Future[bytes] | None' = None
+        try:
+            while True:
+                if readline is None:
+                    readline = asyncio.ensure_future(self.process.stdout.readline())
+                if self._state == RunnerStates.WAITING: # paused, this can take forever. The same readline is timed once it is continued.
+                    continued = asyncio.ensure_future(self._continuedEvent.wait())
+                    await asyncio.wait([readline, continued], return_when=asyncio.FIRST_COMPLETED)
+                    continued.cancel()
                 else:
-                    print("KILLED", end = ' ')
-                print("RUNNER WITH PID", self.process.pid, "after it didn't output anything for", time.time() -self._lastLogTime, "seconds.")
-                print('The last lines of its output are:', *self.lines[-10:] , sep='\n\t')
-                print("-" * 20)
-                terminated = True
-
-        if self._state != RunnerStates.FINISHED and terminated:
-            print(f"A runner has finished with returncode {self.process.returncode}! PID: {self.process.pid}. {self.info}")
-            if self._state == RunnerStates.PREPARING:
-                self.errorState = ErrorStates.NEVER_WAITED
-                print("BUT IT NEVER WAITED! IF THIS HAPPENS TO OFTEN I'LL ABORT. PUT \\pauseExecution SOMEWHERE IN YOUR DOCUMENT.")
-            elif self.process.returncode != 0:
-                self.errorState = ErrorStates.RETURN_CODE_NONZERO
-            self._state = RunnerStates.FINISHED
+                    await asyncio.wait([readline], timeout=PROCESS_TIMEOUT)
+                    if not readline.done():
+                        self._killSilent()
+                        return False
+                if readline.done():
+                    rawLine = readline.result()
+                    readline = None
+                    if not await self._handleLine(rawLine):
+                        return True
+        finally:
+            if readline is not None:
+                readline.cancel()
+
+    async def _handleLine(self, rawLine: bytes) -> bool:
+        """ Record a line of the output. Returns False at the end of the output, after the process exited. """
+        if rawLine == b"":
+            await self.process.wait()
+            return False
+        line = rawLine.decode("utf-8", errors='replace').strip()
+        self._lastLogTime = time.time()
+        if line.startswith(STAGE_LOG):
+            self.stageStarts[line[len(STAGE_LOG):]] = self._lastLogTime
+        self.addLine(line)
+        if VERBOSE:
+            print('\t\t', line)
+        if self._state == RunnerStates.PREPARING and HALT_LOG in line:
+            print("This runner has switched to the waiting state! PID:", self.process.pid)
+            self._setState(RunnerStates.WAITING)
+        return True
+
+    def _killSilent(self):
+        print("-" * 20)
+        try:
+            self.process.kill()
+        except Exception as e:
+            print("TRIED TO KILL (",e,")", end=' ')
+        else:
+            print("KILLED", end = ' ')
+        print("RUNNER WITH PID", self.process.pid, "after it didn't output anything for", time.time() -self._lastLogTime, "seconds.")
+        print('The last lines of its output are:', *self.lines.tail(10) , sep='\n\t')
+        print("-" * 20)
+
+    def _finish(self):
+        if self._state == RunnerStates.FINISHED:
+            return
+        returncode = self.process.returncode if self.process is not None else None
+        print(f"A runner has finished with returncode {returncode}! PID: {self.pid}. {self.info}")
+        if self._state == RunnerStates.PREPARING and not self.stopped:
+            self.errorState = ErrorStates.NEVER_WAITED
+            print("BUT IT NEVER WAITED! IF THIS HAPPENS TO OFTEN I'LL ABORT. PUT \\pauseExecution SOMEWHERE IN YOUR DOCUMENT.")
+        elif returncode != 0 and self.errorState == ErrorStates.NONE:
+            self.errorState = ErrorStates.RETURN_CODE_NONZERO
+        self.exitTime = time.time()
+        self._setState(RunnerStates.FINISHED)
 
+    async def getState(self) -> RunnerStates:
         return self._state
-    
+
     async def continueRun(self) -> bool:
         if self._state == RunnerStates.FINISHED:
             return False
 
-        if self.timedOut(): 
+        if self.timedOut():
             print("Killed an old runner.")
             await self.stop()
             return False
 
-        state = await self.getState() # updates log
-        if state == RunnerStates.PREPARING:
-            
+        if self._state == RunnerStates.PREPARING:
             print("-----------------------------------------")
-            print("Continuing a runner that is still preparing. PID:", self.process.pid)
+            print("Continuing a runner that is still preparing. PID:", self.pid)
             print("-----------------------------------------")
-            
-        while state == RunnerStates.PREPARING: 
-            await asyncio.sleep(WAIT_WHILE_PREPARING_SLEEP_TIME) 
-            state = await self.getState() # updates log
+            await waitForAnyEvent(self.haltedEvent, self.exitedEvent)
 
-        if state == RunnerStates.WAITING:
-            print("-----------------------------------------")
-            print("Continuing a waiting runner. PID:", self.process.pid)
-            print("-----------------------------------------")
-            # await readlines_alreadyWritten(self.process)
-            assert self.process.stdin is not None
-            self.process.stdin.write(b"\r\n") ### THIS WRITES TO THE PROCESS STDIN TO CONTINUE IT
-            self._state = RunnerStates.RUNNING
-            self._lastLogTime = time.time()
-            # actually wait for new output
-            # await readlines_alreadyWritten(self.process, timeout=1, log=True) # doesn't stop when process is done...
-        # await self.getState()
+        if self._state != RunnerStates.WAITING:
+            return False
+        print("-----------------------------------------")
+        print("Continuing a waiting runner. PID:", self.pid)
+        print("-----------------------------------------")
+        await self._beforeResume()
+        self._resume()
+        self._lastLogTime = time.time()
+        self._setState(RunnerStates.RUNNING)
+        self._continuedEvent.set()
         return True
 
+    async def _beforeResume(self):
+        pass
+
+    def _resume(self):
+        assert self.process.stdin is not None
+        self.process.stdin.write(b"\r\n") ### THIS WRITES TO THE PROCESS STDIN TO CONTINUE IT
+
     async def stop(self):
-        if not await self.checkIfProcessTerminated():
+        self.stopped = True
+        if self.process is not None and self.process.returncode is None:
             try:
-                self.process.kill() 
+                self.process.kill()
                 self.errorState = ErrorStates.ABORTED
             except ProcessLookupError:
                 pass
-        self._state = RunnerStates.FINISHED
-
-    async def updateLog(self, timeout: float = 0.05, log: bool = False) -> list:
-        """ Loads the latest log messages from the process into self.lines and returns them. Don't call this during execution but call self.getState() because else the program might miss that it switched to the waiting state. """
-        lines: List[str] = []
-        i = 0
-        emptyLines = 0
-        while self.process.returncode is None:
-            try:
-                assert self.process.stdout is not None
-                line = (
-                    await asyncio.wait_for(
-                        self.process.stdout.readline(),
-                        timeout = timeout
-                    )
-                ).decode("utf-8", errors='replace').strip()
-                if line == "":
-                    emptyLines += 1
-                    if emptyLines == 100:
-                        print(f"Aborted updating the log after it read {emptyLines} empty lines.")
-                        break
-                if log:
-                    print('\t\t', line)
-                lines.append(line)
-            except asyncio.TimeoutError:
-                # print("Buffered latex log output exceeded! PID:", process.pid)
-                break
-            except RuntimeError:
-                i += 1
-                if i < EMPTY_UPDATE_LOG_MAX_TRIES:
-                    await asyncio.sleep(WAIT_FOR_COMPLETION_SLEEP_TIME)
-                    continue
-                self.process.kill()
-                self.errorState = ErrorStates.ABORTED
-                print("ABORTED RUNNER WITH PID", self.process.pid, "because there were too many empty log reads.")
-                break
+            else:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.process.wait(), 1) # reap it while the event loop still runs
+        self.lines.discard()
+        if self._state == RunnerStates.FINISHED:
+            return
+        if self._readerTask is not None and self._readerTask is not asyncio.current_task():
+            self._readerTask.cancel()
+            await asyncio.wait([self._readerTask]) # FINISHED only after its last step, then its temp directory gets released
+        if self._state != RunnerStates.FINISHED:
+            self.exitTime = time.time()
+            self._setState(RunnerStates.FINISHED)
+
+    async def updateLog(self, log: bool = False) -> list:
+        """ Returns the lines the process printed since the last call. The reading itself is done continuously by the reader task. """
+        lines = self.lines.since(self._readLines)
+        self._readLines = self.lines.total
+        if log:
+            for line in lines:
+                print('\t\t', line)
+        return lines
+
+class NativeLatexRunner(LatexRunner):
+    """ Runs the steps of a LatexPipeline itself: copying in Python, the tools and the engine with asyncio.create_subprocess_exec.
+    This saves the startup time and memory of a pwsh process per runner. self.process is the process of the current step.
+    An engine that can't pause (see PAUSING_ENGINES) is only started when the runner is continued. """
+
+    def __init__(self, info: str, timeoutFunction: Callable[[float], bool]) -> None:
+        """ Call the async static method newRunner instead """
+        super().__init__(info=info, timeoutFunction=timeoutFunction)
+        self.pipeline: LatexPipeline = None # type: ignore
+        self.workingDirectory: 'PathOrString | None' = None
+        self._continued = asyncio.Event() # for engines that can't pause
+
+    @staticmethod
+    async def newRunner(command: 'LatexPipeline', workingDirectory: 'PathOrString | None' = None, info: str = "", timeoutFunction: Callable[[float], bool] = lambda x: False) -> Runner: # type: ignore[override]
+        self = NativeLatexRunner(info=info, timeoutFunction=timeoutFunction)
+        self.pipeline = command
+        self.workingDirectory = workingDirectory
+        steps = "\n\t".join(command.commandLines())
+        self.addLine(f"I am a native LaTeX runner with the steps\n\t{steps}")
+        print(f"Created new native LaTeX runner with the steps\n\t{steps}")
+        self._readerTask = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    @staticmethod
+    async def attach(state: Dict[str, object], timeoutFunction: Callable[[float], bool]) -> Runner:
+        """ Take over a runner that the server handed over before it reloaded its code (see handOverState) """
+        self = NativeLatexRunner(info=str(state['info']), timeoutFunction=timeoutFunction)
+        pipeline: Dict[str, object] = state['pipeline'] # type: ignore[assignment]
+        self.pipeline = LatexPipeline(
+            pipeline['tempOutputDirectory'], pipeline['outputDirectory'], pipeline['texFile'], pipeline['tools'], engine=pipeline['engine'], formatFile=pipeline.get('formatFile') # type: ignore[arg-type]
+        )
+        self.workingDirectory = state['workingDirectory'] # type: ignore[assignment]
+        self._restoreState(state)
+        if self.pipeline.pauses:
+            self.process = await AttachedProcess.attach(state['pid'], state['stdin'], state['stdout']) # type: ignore[assignment,arg-type]
+        self._readerTask = asyncio.get_running_loop().create_task(self._run(attached=True))
+        return self
+
+    def handOverState(self) -> Optional[Dict[str, object]]:
+        if self._state != RunnerStates.WAITING:
+            return None
+        if self.pipeline.pauses: # the engine waits for its stdin
+            state = super().handOverState()
+            if state is None:
+                return None
+        else: # nothing runs until the runner is continued
+            state = self._commonState()
+        pipeline = {
+            'tempOutputDirectory': str(self.pipeline.tempOutputDirectory), 'outputDirectory': str(self.pipeline.outputDirectory),
+            'texFile': str(self.pipeline.texFile), 'tools': self.pipeline.tools, 'engine': self.pipeline.engine,
+            'formatFile': str(self.pipeline.formatFile) if self.pipeline.formatFile is not None else None
+        }
+        return {**state, 'kind': 'native', 'info': self.info, 'pipeline': pipeline, 'workingDirectory': str(self.workingDirectory)}
+
+    def _startStage(self, stage: str):
+        self.stageStarts[stage] = time.time()
+        self.addLine(STAGE_LOG + stage)
+
+    def _log(self, message: str):
+        self.addLine(message)
+        print(message, f"PID: {self.pid}" if self.pid is not None else f"Temp directory: {self.pipeline.tempOutputDirectory}") # no process yet while preparing
+
+    async def _beforeResume(self):
+        """ Stage what was published since this runner was prepared, e.g. the .aux file of the previous pass """
+        message = await asyncio.get_running_loop().run_in_executor(None, self.pipeline.restage)
+        if message:
+            self._log(message)
+
+    def _resume(self):
+        if self.pipeline.pauses:
+            super()._resume()
         else:
+            self._continued.set()
+
+    async def _execute(self, arguments: List[str], **kwargs) -> bool:
+        """ Run one step and read its output. Returns whether it ended by itself, raises OSError if it couldn't be started. """
+        self.process = await asyncio.create_subprocess_exec(
+            *arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.workingDirectory, env=self.pipeline.environment(), **kwargs
+        )
+        return await self._readOutput()
+
+    async def _run(self, attached: bool = False):
+        """ The steps of the pipeline. A runner that was attached (see attach) is already WAITING, and its pausing engine is running. """
+        loop = asyncio.get_running_loop()
+        try:
+            if not attached:
+                self._startStage('prepare')
+                self._log(await loop.run_in_executor(None, self.pipeline.prepare))
+                for tool in self.pipeline.tools:
+                    self._startStage(tool)
+                    try:
+                        if not await self._execute(self.pipeline.toolCommand(tool)) or self.stopped:
+                            return
+                    except OSError as e: # like in the shell: a missing tool doesn't stop the compilation
+                        self.addLine(f"ERROR: Could not run {tool}: {e}")
+            if not self.pipeline.pauses:
+                if not attached:
+                    self.addLine(HALT_LOG)
+                    print(f"This runner has prepared everything for {self.pipeline.engine} and switched to the waiting state!")
+                    self._setState(RunnerStates.WAITING)
+                await self._continued.wait()
+            if attached and self.pipeline.pauses:
+                endedByItself = await self._readOutput()
+            else:
+                self._startStage(self.pipeline.engine)
+                try:
+                    endedByItself = await self._execute(self.pipeline.latexCommand(), stdin=subprocess.PIPE if self.pipeline.pauses else subprocess.DEVNULL)
+                except OSError as e:
+                    self.addLine(f"ERROR: Could not run {self.pipeline.engine}: {e}")
+                    return
+            if endedByItself and self.process.returncode is not None and not self.stopped: # not killed by stop, e.g. an evicted runner
+                self._startStage('copy')
+                self._log(await loop.run_in_executor(None, self.pipeline.publish))
+        finally:
+            self._finish()
+
+class AttachedProcess:
+    """ A child process that the server started before it reloaded its code with exec (see CodeReloader), with the parts of
+    asyncio.subprocess.Process that the runners use. Its pipes are inherited file descriptors, and as asyncio doesn't know
+    the process, wait polls for its exit. """
+
+    def __init__(self, pid: int, stdinDescriptor: int, stdoutDescriptor: int) -> None:
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.descriptors = (stdinDescriptor, stdoutDescriptor)
+        self.stdin = os.fdopen(stdinDescriptor, 'wb', buffering=0)
+        self.stdout = asyncio.StreamReader()
+
+    @staticmethod
+    async def attach(pid: int, stdinDescriptor: int, stdoutDescriptor: int) -> 'AttachedProcess':
+        self = AttachedProcess(pid, stdinDescriptor, stdoutDescriptor)
+        os.set_inheritable(stdinDescriptor, False)
+        os.set_inheritable(stdoutDescriptor, False)
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.stdout), os.fdopen(stdoutDescriptor, 'rb', buffering=0))
+        return self
+
+    async def wait(self) -> int:
+        while self.returncode is None:
             try:
-                assert self.process.stdout is not None
-                linesText = await self.process.stdout.read()
-                lines = linesText.decode('utf-8', errors='replace').splitlines()
-            except RuntimeError as e:
-                print("Tried to read the process output, but it was already closed. PID:", self.process.pid)
-                lines = ["ERROR: When trying to read the process output of the closed runner process, the following error occurred: " + str(e)]
-        if len(lines) > 0:
-            self._lastLogTime = time.time()
-            print("\tRead", len(lines), "lines from process", self.process.pid)
-            self.lines.extend(lines)
-        return lines
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError: # reaped by someone else
+                self.returncode = -1
+                break
+            if pid != 0:
+                self.returncode = os.waitstatus_to_exitcode(status)
+            else:
+                await asyncio.sleep(ATTACHED_PROCESS_POLL_INTERVAL)
+        return self.returncode
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+def processPipes(process: 'asyncio.subprocess.Process | AttachedProcess') -> 'tuple[int, int] | None':
+    """ The file descriptors of our ends of the stdin and stdout pipes of process, None if it doesn't have both """
+    if isinstance(process, AttachedProcess):
+        return process.descriptors
+    descriptors = []
+    for number in (0, 1):
+        transport = process._transport.get_pipe_transport(number) # type: ignore[attr-defined] # asyncio has no public accessor
+        pipe = transport.get_extra_info('pipe') if transport is not None else None
+        if pipe is None:
+            return None
+        descriptors.append(pipe.fileno())
+    return descriptors[0], descriptors[1]
+
+async def attachRunner(state: Dict[str, object], timeoutFunction: Callable[[float], bool]) -> Runner:
+    """ The runner of a handOverState """
+    attach = {'shell': LatexRunner.attach, 'native': NativeLatexRunner.attach}[str(state['kind'])]
+    return await attach(state, timeoutFunction)
+
+MOCK_OUTCOMES = ('ok', 'error', 'never-waited', 'silent')
+
+class MockScript:
+    """ What the MockRunners of the 'mock' backend do: they take preambleTime and bodyTime seconds (each +- jitter),
+    and the n-th runner ends with outcomes[n % len(outcomes)] out of MOCK_OUTCOMES:
+        ok: prints a page count and exits with returncode 0,
+        error: prints a LaTeX error and exits with returncode 1,
+        never-waited: exits with returncode 1 before it reached the pause,
+        silent: stops printing after being continued and gets killed after silentTimeout seconds (like PROCESS_TIMEOUT). """
+
+    def __init__(self, preambleTime: float = 0.0, bodyTime: float = 0.0, outcomes: Iterable[str] = ('ok',), jitter: float = 0.0, silentTimeout: float = PROCESS_TIMEOUT, seed: Optional[int] = None) -> None:
+        self.preambleTime = preambleTime
+        self.bodyTime = bodyTime
+        self.outcomes = list(outcomes)
+        unknown = set(self.outcomes) - set(MOCK_OUTCOMES)
+        if unknown or not self.outcomes:
+            raise ValueError(f"Unknown outcomes {unknown}, choose from {MOCK_OUTCOMES}")
+        self.jitter = jitter
+        self.silentTimeout = silentTimeout
+        self.random = random.Random(seed)
+        self.started = 0 # runners
+
+    def nextOutcome(self) -> str:
+        outcome = self.outcomes[self.started % len(self.outcomes)]
+        self.started += 1
+        return outcome
+
+    def duration(self, seconds: float) -> float:
+        return max(seconds + self.random.uniform(-self.jitter, self.jitter), 0.0)
+
+class MockRunner(Runner):
+    """ A runner that follows a MockScript in-process instead of running LaTeX, to test the pool, eviction and timeouts
+    without a TeX installation and with thousands of compilations per second. """
+
+    def __init__(self, script: MockScript, info: str, timeoutFunction: Callable[[float], bool]) -> None:
+        """ Call the async static method newRunner instead """
+        super().__init__()
+        self.script = script
+        self.outcome = script.nextOutcome()
+        self.info = info
+        self.returncode: Optional[int] = None
+        self._continued = asyncio.Event()
+        self._task: 'asyncio.Task | None' = None
+        self.timedOut = lambda: timeoutFunction(self._creationTime)
+
+    @staticmethod
+    async def newRunner(command: MockScript, workingDirectory: 'PathOrString | None' = None, info: str = "", timeoutFunction: Callable[[float], bool] = lambda x: False) -> Runner: # type: ignore[override]
+        self = MockRunner(command, info=info, timeoutFunction=timeoutFunction)
+        self.addLine(f"I am a mock runner that will end with '{self.outcome}'.")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def _run(self):
+        try:
+            self.stageStarts['preamble'] = time.time()
+            await asyncio.sleep(self.script.duration(self.script.preambleTime))
+            if self.outcome == 'never-waited':
+                self.returncode = 1
+                return
+            self.addLine(HALT_LOG)
+            self._setState(RunnerStates.WAITING)
+            await self._continued.wait()
+            self.stageStarts['body'] = time.time()
+            if self.outcome == 'silent':
+                await asyncio.sleep(self.script.silentTimeout)
+                self.addLine(f"KILLED AFTER {self.script.silentTimeout} SECONDS WITHOUT OUTPUT")
+                self.returncode = -9
+                return
+            await asyncio.sleep(self.script.duration(self.script.bodyTime))
+            if self.outcome == 'error':
+                self.addLine("./mock.tex:1: Undefined control sequence.")
+                self.returncode = 1
+                return
+            self.addLine("Output written on mock.pdf (1 page, 1000 bytes).")
+            self.returncode = 0
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self._state == RunnerStates.FINISHED:
+            return
+        if self._state == RunnerStates.PREPARING:
+            self.errorState = ErrorStates.NEVER_WAITED
+        elif self.returncode != 0 and self.errorState == ErrorStates.NONE:
+            self.errorState = ErrorStates.RETURN_CODE_NONZERO
+        self.exitTime = time.time()
+        self._setState(RunnerStates.FINISHED)
+
+    async def getState(self) -> RunnerStates:
+        return self._state
+
+    async def continueRun(self) -> bool:
+        if self._state == RunnerStates.FINISHED:
+            return False
+        if self.timedOut():
+            await self.stop()
+            return False
+        if self._state == RunnerStates.PREPARING:
+            await waitForAnyEvent(self.haltedEvent, self.exitedEvent)
+        if self._state != RunnerStates.WAITING:
+            return False
+        self._continued.set()
+        self._setState(RunnerStates.RUNNING)
+        return True
+
+    async def updateLog(self, log: bool = False) -> list:
+        return list(self.lines)
+
+    async def stop(self):
+        self.lines.discard()
+        if self._state == RunnerStates.FINISHED:
+            return
+        self.errorState = ErrorStates.ABORTED
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self.exitTime = time.time()
+        self._setState(RunnerStates.FINISHED)
+#endregion
+
+#region Runner backends
+class RunnerSpec:
+    """ Everything a backend needs to start a runner for the next compilation of texFile """
+    def __init__(self, texFile: Path, outputDirectory: Path, tempOutputDirectory: Path, tools: List[str], timeoutFunction: Callable[[float], bool], formatFile: Optional[Path] = None) -> None:
+        self.texFile = texFile
+        self.outputDirectory = outputDirectory
+        self.tempOutputDirectory = tempOutputDirectory
+        self.tools = tools # the preprocessing tools to run, see PreprocessingTracker
+        self.timeoutFunction = timeoutFunction # whether the preamble of a runner created at the given time is outdated
+        self.formatFile = formatFile # start the engine from this format of the preamble instead of pausing it (see PreambleFormat)
+
+    @property
+    def info(self) -> str:
+        return f"outputDirectory={self.outputDirectory}, tempOutputDirectory={self.tempOutputDirectory}"
+
+class RunnerBackend(metaclass = ABCMeta):
+    """ A way to run the LaTeX pipeline, chosen with --backend. Implementations return a Runner (see there for its contract)
+    and are registered with registerBackend. """
+    description = ""
+
+    @abstractmethod
+    async def newRunner(self, spec: RunnerSpec) -> Runner:
+        pass
+
+    def commandLines(self, spec: RunnerSpec) -> List[str]:
+        """ The equivalent shell commands, for --print-command """
+        return []
+
+runnerBackends: Dict[str, RunnerBackend] = {}
+
+def registerBackend(name: str, backend: RunnerBackend):
+    runnerBackends[name] = backend
+
+class NativeBackend(RunnerBackend):
+    def __init__(self, engine: str) -> None:
+        self.engine = engine
+        self.description = f"runs the steps and {engine} directly from Python" + ("" if engine in PAUSING_ENGINES else ", starting it on request")
+
+    def pipeline(self, spec: RunnerSpec) -> 'LatexPipeline':
+        return LatexPipeline(spec.tempOutputDirectory, spec.outputDirectory, spec.texFile, spec.tools, engine=self.engine, formatFile=spec.formatFile)
+
+    async def newRunner(self, spec: RunnerSpec) -> Runner:
+        return await NativeLatexRunner.newRunner(command=self.pipeline(spec), workingDirectory=spec.texFile.parent, info=spec.info, timeoutFunction=spec.timeoutFunction)
+
+    def commandLines(self, spec: RunnerSpec) -> List[str]:
+        return self.pipeline(spec).commandLines()
+
+class PowershellBackend(RunnerBackend):
+    description = "runs the steps in a PowerShell process"
+
+    async def newRunner(self, spec: RunnerSpec) -> Runner:
+        return await LatexRunner.newRunner(
+            command=getCMDorBashCommand(spec.tempOutputDirectory, spec.outputDirectory, spec.texFile, spec.tools),
+            workingDirectory=spec.texFile.parent, info=spec.info, timeoutFunction=spec.timeoutFunction
+        )
+
+    def commandLines(self, spec: RunnerSpec) -> List[str]:
+        return [getPowershellCommand(spec.tempOutputDirectory, spec.outputDirectory, spec.texFile, spec.tools)]
+
+class MockBackend(RunnerBackend):
+    description = "simulates compilations in-process (see MockScript), for testing"
+
+    def __init__(self, script: Optional[MockScript] = None) -> None:
+        self.script = script or MockScript(preambleTime=1.0, bodyTime=0.2)
+
+    async def newRunner(self, spec: RunnerSpec) -> Runner:
+        return await MockRunner.newRunner(self.script, info=spec.info, timeoutFunction=spec.timeoutFunction)
+
+registerBackend('native', NativeBackend('lualatex'))
+registerBackend('pwsh', PowershellBackend())
+for engine in LATEX_ENGINE_COMMANDS:
+    if engine != 'lualatex':
+        registerBackend(engine, NativeBackend(engine))
+registerBackend('mock', MockBackend())
 #endregion
 
 #region Controlling Watchers and Runners
@@ -407,53 +1449,445 @@ def newWatcher(texFile: 'PathOrString | None', output_dir: 'PathOrString | None'
     if output_dir is None:
         output_dir = "out"
     outputDirectory = texFile.parent / output_dir
+    outputDirectory.mkdir(parents=True, exist_ok=True)
+    preambleTracker = PreambleTracker(texFile, outputDirectory)
+    preprocessingTracker = PreprocessingTracker(preambleTracker)
+    backend = runnerBackends[BACKEND]
+    preambleFormat = None
+    if isinstance(backend, NativeBackend) and backend.engine in FORMAT_ENGINES:
+        preambleFormat = PreambleFormat(texFile, preambleTracker, formatDirectory())
+
+    async def newRunner(handedOver: Optional[Dict[str, object]] = None):
+        if handedOver is None:
+            tempOutputDirectory = tempDirectories.create(outputDirectory)
+            formatFile = preambleFormat.current() if preambleFormat is not None else None
+            # engines that start only when the runner is continued open the main file then
+            snapshot = preambleTracker.snapshot(keepsMainFileOpen=formatFile is None and not (isinstance(backend, NativeBackend) and backend.engine not in PAUSING_ENGINES))
+            inputHashes = preprocessingTracker.inputHashes()
+            tools = preprocessingTracker.toolsToRun(inputHashes)
+            runner = await backend.newRunner(RunnerSpec(
+                texFile, outputDirectory, tempOutputDirectory, tools,
+                timeoutFunction=lambda _: preambleTracker.isOutdated(snapshot) or (formatFile is not None and not formatFile.is_file()),
+                formatFile=formatFile
+            ))
+            if formatFile is not None:
+                runner.strategy, runner.formatFile = 'format', formatFile
+        else: # from before a reload of the server code, see CodeReloader
+            tempOutputDirectory = tempDirectories.adopt(Path(str(handedOver['tempOutputDirectory'])))
+            snapshot = PreambleSnapshot.fromDict(handedOver['snapshot']) # type: ignore[arg-type]
+            inputHashes, tools = handedOver['inputHashes'], handedOver['tools'] # type: ignore[assignment]
+            formatFile = Path(str(handedOver['formatFile'])) if handedOver.get('formatFile') else None
+            runner = await attachRunner(handedOver, timeoutFunction=lambda _: preambleTracker.isOutdated(snapshot) or (formatFile is not None and not formatFile.is_file()))
+        runner.handOverInfo = {
+            'texFile': str(texFile), 'outputDir': str(output_dir), 'tempOutputDirectory': str(tempOutputDirectory),
+            'snapshot': snapshot.toDict(), 'inputHashes': inputHashes, 'tools': tools,
+            'formatFile': str(formatFile) if formatFile is not None else None
+        }
+
+        runner.lines.spillTo(
+            outputDirectory / f"processPool-{texFile.stem}-{tempOutputDirectory.name}.log",
+            publishAs=outputDirectory / f"processPool-{texFile.stem}.log" # doesn't start with the file name, so it isn't staged
+        )
 
-    async def newRunner():
-        tempOutputDirectory = getTempOutputDirectory(outputDirectory)
-                
-        clearOldTempDirectories(tempOutputDirectory.parent)
+        async def learnDependencies():
+            await waitForAnyEvent(runner.haltedEvent, runner.exitedEvent)
+            if runner.haltedEvent.is_set() and runner.strategy == 'pause': # a runner with a format doesn't read the preamble files
+                preambleTracker.learnDependencies(runner.lines)
+        asyncio.get_running_loop().create_task(learnDependencies())
+
+        skipped = [tool for tool in PREPROCESSING_TOOLS if tool not in tools]
+        if skipped and handedOver is None:
+            message = f"Skipped {' and '.join(skipped)} because the inputs didn't change, saving about {preprocessingTracker.savedTime(skipped):.1f} s."
+            runner.addLine(message)
+            print(message)
+
+        def recordFinishedRun():
+            """ A state listener, so the temp directory is released before runner.stop returns """
+            if not runner.exitedEvent.is_set():
+                return
+            runner.stateListeners.remove(recordFinishedRun)
+            tempDirectories.release(tempOutputDirectory)
+            preprocessingTracker.recordRun(runner, inputHashes, tools)
+            if preambleFormat is not None:
+                preambleFormat.checkRun(runner)
+        runner.stateListeners.append(recordFinishedRun)
+        recordFinishedRun() # in case it finished already
+        return runner
+
+    generator = automate.generatorForMainFile(texFile) if GENERATE_INPUTS else None
+    return ProcessWatcher(
+        newRunner, name=str(texFile), rerunDetector=RerunDetector(preambleTracker, preprocessingTracker, preambleFormat),
+        prepareInputs=generator.update if generator is not None else None,
+        buildCache=DocumentCache(buildCache, texFile, outputDirectory) if buildCache is not None else None,
+        preambleFormat=preambleFormat
+    )
+
+class PreambleSnapshot:
+    def __init__(self, preambleHash: str, generatedInputsHash: str, dependencies: Dict[Path, 'tuple[int, int] | None'], mainFileIdentity: 'tuple[int, int] | None' = None) -> None:
+        self.creationTime = time.time()
+        self.preambleHash = preambleHash
+        self.generatedInputsHash = generatedInputsHash
+        self.dependencies = dependencies
+        self.mainFileIdentity = mainFileIdentity # see fileIdentity, None if the runner doesn't keep the main file open
+
+    def toDict(self) -> Dict[str, object]:
+        dependencies = {str(file): signature for file, signature in self.dependencies.items()}
+        return {
+            'creationTime': self.creationTime, 'preambleHash': self.preambleHash, 'generatedInputsHash': self.generatedInputsHash,
+            'dependencies': dependencies, 'mainFileIdentity': self.mainFileIdentity
+        }
 
-        return await LatexRunner.newRunner(
-            command = getCMDorBashCommand(tempOutputDirectory, outputDirectory,  texFile),
-            workingDirectory=texFile.parent,
-            info=f"outputDirectory={outputDirectory}, tempOutputDirectory={tempOutputDirectory}",
-            timeoutFunction=lambda runnerCreationTime: Path(texFile).stat().st_mtime > runnerCreationTime
+    @staticmethod
+    def fromDict(data: Dict[str, object]) -> 'PreambleSnapshot':
+        dependencies = {Path(file): tuple(signature) if signature is not None else None for file, signature in data['dependencies'].items()} # type: ignore[attr-defined]
+        identity = data.get('mainFileIdentity')
+        snapshot = PreambleSnapshot(str(data['preambleHash']), str(data['generatedInputsHash']), dependencies, tuple(identity) if identity is not None else None) # type: ignore[arg-type]
+        snapshot.creationTime = float(data['creationTime']) # type: ignore[arg-type]
+        return snapshot
+
+class PreambleTracker:
+    """ Decides whether a runner still has an up-to-date preamble. A runner is outdated if
+        - the main file changed up to PAUSE_COMMAND (content hash, so edits of the body don't matter),
+        - the .bib files or the .idx/.bcf files that xindex and biber read at its start changed (content hash), or
+        - one of the files read in the preamble changed (size and mtime, many of them are large font files), or
+        - the main file was replaced by another file (e.g. an editor that saves by renaming a new file). A paused engine has
+          the old file open and would read the old body after the pause.
+    The preamble dependencies are the INPUT files of the last completed run's .fls file that were opened before HALT_LOG,
+    i.e. which appear in a runner's output before it paused. """
+
+    def __init__(self, texFile: Path, outputDirectory: Path) -> None:
+        self.texFile = texFile
+        self.outputDirectory = outputDirectory
+        self.dependencies: 'set[Path]' = set()
+        self._preambleCache: 'tuple[tuple[int, int] | None, str]' = (None, "")
+        self._hashCache: Dict[Path, 'tuple[tuple[int, int], str]'] = {}
+
+    def snapshot(self, keepsMainFileOpen: bool = True) -> PreambleSnapshot:
+        """ keepsMainFileOpen: the runner opens the main file now and reads the body from it after the pause """
+        return PreambleSnapshot(
+            self.preambleHash(), self.generatedInputsHash(), {dependency: fileSignature(dependency) for dependency in self.dependencies},
+            fileIdentity(self.texFile) if keepsMainFileOpen else None
         )
 
-    return ProcessWatcher(newRunner)
-
-def clearOldTempDirectories(directory: Path):
-    for dir in directory.iterdir():
-        if dir.is_dir() and tempFolderRegex.match(dir.name):
-            now = datetime.now()
-            currentMod = now.hour * 60 + now.minute
-            mod = int(dir.name[:2]) * 60 + int(dir.name[3:5])
-            if (
-                mod > currentMod 
-                and
-                mod - 24 * 60 < currentMod - OLD_TEMP_DIR_TIMEOUT_MIN      
-            ) or (
-                mod < currentMod - OLD_TEMP_DIR_TIMEOUT_MIN
-            ):
-                try:
-                    shutil.rmtree(dir)
-                except Exception as e:
-                    (dir / 'del_error.log').write_text(str(e))
+    def isOutdated(self, snapshot: PreambleSnapshot) -> bool:
+        if self.preambleHash() != snapshot.preambleHash or self.generatedInputsHash() != snapshot.generatedInputsHash:
+            return True
+        if snapshot.mainFileIdentity is not None and fileIdentity(self.texFile) != snapshot.mainFileIdentity:
+            return True
+        for dependency in self.dependencies:
+            if dependency in snapshot.dependencies:
+                if fileSignature(dependency) != snapshot.dependencies[dependency]:
+                    return True
+            else: # learned after the runner was created
+                signature = fileSignature(dependency)
+                if signature is None or signature[1] / 1e9 > snapshot.creationTime:
+                    return True
+        return False
+
+    def preambleHash(self) -> str:
+        """ Hash of the main file up to and including the PAUSE_COMMAND that pauses it (see pauseCommandEnd, the whole file if it doesn't pause) """
+        signature = fileSignature(self.texFile)
+        if signature is None:
+            return ""
+        if signature != self._preambleCache[0]:
+            content = self.texFile.read_bytes().decode('utf-8', errors='surrogateescape') # encodes back to the same bytes
+            pauseEnd = pauseCommandEnd(content)
+            if pauseEnd >= 0:
+                content = content[:pauseEnd]
+            self._preambleCache = (signature, hashlib.sha256(content.encode('utf-8', errors='surrogateescape')).hexdigest())
+        return self._preambleCache[1]
+
+    def generatedInputsHash(self) -> str:
+        """ Hash of the inputs of xindex and biber, which run before the preamble """
+        digest = hashlib.sha256()
+        for file in [self.outputDirectory / (self.texFile.stem + '.idx'), self.outputDirectory / (self.texFile.stem + '.bcf'), *self.bibFiles()]:
+            digest.update(f"{file}:{self.contentHash(file)};".encode())
+        return digest.hexdigest()
+
+    def contentHash(self, file: Path) -> str:
+        """ sha256 of the file content ("" if it doesn't exist), only recomputed when size or mtime changed """
+        signature = fileSignature(file)
+        if signature is None:
+            self._hashCache.pop(file, None)
+            return ""
+        cached = self._hashCache.get(file)
+        if cached is None or cached[0] != signature:
+            try:
+                cached = (signature, hashlib.sha256(file.read_bytes()).hexdigest())
+            except OSError:
+                return ""
+            self._hashCache[file] = cached
+        return cached[1]
+
+    def bibFiles(self) -> List[Path]:
+        try:
+            bcf = (self.outputDirectory / (self.texFile.stem + '.bcf')).read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            return []
+        return [self.texFile.parent / name.strip() for name in bibDatasourceRegex.findall(bcf)]
+
+    def learnDependencies(self, preambleLog: Iterable[str]):
+        """ Record the INPUT files of the last .fls file that were opened before the runner paused """
+        log = "".join(preambleLog) # undo the line wrapping of the terminal output
+        self.dependencies = {
+            file for name, file in recordedInputs(self.outputDirectory / (self.texFile.stem + '.fls'))
+            if file != self.texFile.resolve() and (name in log or file.name in log)
+            and self.outputDirectory.resolve() not in file.parents
+            and 'luatex-cache' not in file.parts
+        }
+
+class PreprocessingTracker:
+    """ Remembers the input hashes of the last xindex and biber runs whose results were copied back to the output directory.
+    A new runner skips a tool if its inputs are unchanged and its output (.ind / .bbl) is still there. """
+
+    def __init__(self, preambleTracker: PreambleTracker) -> None:
+        self.preambleTracker = preambleTracker
+        self.publishedHashes: Dict[str, str] = {}
+        self.durations: Dict[str, float] = {} # last measured duration of every tool
+
+    def inputFiles(self, tool: str) -> List[Path]:
+        stem = self.preambleTracker.texFile.stem
+        outputDirectory = self.preambleTracker.outputDirectory
+        if tool == 'xindex':
+            return [outputDirectory / (stem + '.idx')]
+        return [outputDirectory / (stem + '.bcf'), *self.preambleTracker.bibFiles()]
+
+    def outputFile(self, tool: str) -> Path:
+        return self.preambleTracker.outputDirectory / (self.preambleTracker.texFile.stem + ('.ind' if tool == 'xindex' else '.bbl'))
+
+    def inputHashes(self) -> Dict[str, str]:
+        return {
+            tool: hashlib.sha256("".join(f"{file}:{self.preambleTracker.contentHash(file)};" for file in self.inputFiles(tool)).encode()).hexdigest()
+            for tool in PREPROCESSING_TOOLS
+        }
+
+    def toolsToRun(self, inputHashes: Dict[str, str]) -> List[str]:
+        return [
+            tool for tool in PREPROCESSING_TOOLS
+            if self.publishedHashes.get(tool) != inputHashes[tool] or not self.outputFile(tool).exists()
+        ]
+
+    def savedTime(self, skipped: Iterable[str]) -> float:
+        return sum(self.durations.get(tool, 0) for tool in skipped)
+
+    def recordRun(self, runner: 'LatexRunner', inputHashes: Dict[str, str], tools: Iterable[str]):
+        durations = runner.stageDurations()
+        for tool in tools:
+            if tool in durations:
+                self.durations[tool] = durations[tool]
+        if 'copy' not in durations: # the results never made it to the output directory
+            return
+        for tool in tools:
+            self.publishedHashes[tool] = inputHashes[tool]
+
+class RerunDetector:
+    """ Decides after a pass whether the document needs another one, like latexmk: LaTeX asked for a rerun
+    ("Rerun to get cross-references right", "Please rerun LaTeX"), or the pass changed the .aux file
+    or the inputs of xindex (.idx) or biber (.bcf). The next runner then runs those tools first.
+    A pass that broke because its preamble format doesn't work (see PreambleFormat.checkRun) is repeated with a paused runner. """
+    NAMES = {'aux': 'the .aux file', 'xindex': 'the index (.idx)', 'biber': 'the bibliography (.bcf)'}
+
+    def __init__(self, preambleTracker: PreambleTracker, preprocessingTracker: PreprocessingTracker, preambleFormat: 'PreambleFormat | None' = None) -> None:
+        self.preambleTracker = preambleTracker
+        self.preprocessingTracker = preprocessingTracker
+        self.preambleFormat = preambleFormat
+
+    def snapshot(self) -> Dict[str, str]:
+        auxFile = self.preambleTracker.outputDirectory / (self.preambleTracker.texFile.stem + '.aux')
+        return {'aux': self.preambleTracker.contentHash(auxFile), **self.preprocessingTracker.inputHashes()}
+
+    def reason(self, runner: Runner, before: Dict[str, str]) -> Optional[str]:
+        """ Why another pass is needed after runner finished the pass that started with the snapshot before, None if it isn't """
+        if self.preambleFormat is not None and self.preambleFormat.checkRun(runner):
+            return "the preamble format broke the compilation, the next pass pauses in the preamble instead"
+        if runner.errorState != ErrorStates.NONE:
+            return None # another pass wouldn't fix the errors
+        if runner.logSummary.rerunNeeded:
+            return "LaTeX asked for a rerun"
+        after = self.snapshot()
+        changed = [self.NAMES[name] for name, value in after.items() if before.get(name) != value]
+        return f"the pass changed {' and '.join(changed)}" if changed else None
+
+pauseCommandRegex = re.compile(re.escape(PAUSE_COMMAND) + r"(?![A-Za-z@])")
+
+def pauseCommandEnd(content: str) -> int:
+    """ The end of the PAUSE_COMMAND that pauses the main file: the last one before \\begin{document} that isn't commented out,
+    earlier ones can be its \\def or \\newcommand. -1 if there is none. """
+    uncommented = commentRegex.sub(lambda match: " " * len(match.group()), content) # keeps the positions
+    beginDocument = uncommented.find("\\begin{document}")
+    matches = list(pauseCommandRegex.finditer(uncommented, 0, beginDocument if beginDocument >= 0 else len(uncommented)))
+    return matches[-1].end() if matches else -1
+
+bibDatasourceRegex = re.compile(r'<bcf:datasource[^>]*type="file"[^>]*>([^<]*)</bcf:datasource>')
+
+def recordedInputs(flsFile: Path) -> 'List[tuple[str, Path]]':
+    """ The INPUT entries of a --recorder .fls file, as written and as resolved path """
+    try:
+        lines = flsFile.read_text(encoding='utf-8', errors='replace').splitlines()
+    except OSError:
+        return []
+    workingDirectory = flsFile.parent
+    inputs: 'List[tuple[str, Path]]' = []
+    seen: 'set[Path]' = set()
+    for line in lines:
+        if line.startswith('PWD '):
+            workingDirectory = Path(line[4:])
+        elif line.startswith('INPUT '):
+            name = line[6:]
+            file = (workingDirectory / name).resolve()
+            if file not in seen:
+                seen.add(file)
+                inputs.append((name, file))
+    return inputs
+
+def fileSignature(file: Path) -> 'tuple[int, int] | None':
+    try:
+        stat = file.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def fileIdentity(file: Path) -> 'tuple[int, int] | None':
+    """ Device and inode: an open file keeps them, even if another file is renamed to its name """
+    try:
+        stat = file.stat()
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+tempNameRegex = re.compile(r"^\d\d-\d\d-\d\d\((?:(\d+)-)?\d+\)_*$") # HH-MM-SS(pid-n), from older versions HH-MM-SS(random)
+spillLogRegex = re.compile(r"^processPool-.*-(\d\d-\d\d-\d\d\((?:\d+-)?\d+\)_*)\.log$") # see RunnerLog.spillTo in newWatcher
+tempNumbers = itertools.count()
 
-tempFolderRegex = re.compile("^[0-9][0-9]-[0-9][0-9]-[0-9][0-9]")
 def getTempOutputDirectory(outputDirectory: Path):
-    tempOutputDirectory = outputDirectory / (datetime.now().strftime("%H-%M-%S") + f"({random.randint(1000,9999)})")
+    """ A new name for a temp directory in outputDirectory, containing the process ID of this server (see TempDirectoryRegistry) """
+    tempOutputDirectory = outputDirectory / (datetime.now().strftime("%H-%M-%S") + f"({os.getpid()}-{next(tempNumbers)})")
     while tempOutputDirectory.exists():
         tempOutputDirectory = tempOutputDirectory.with_name(tempOutputDirectory.name + "_")
     return tempOutputDirectory
 
+def processIsAlive(pid: int) -> bool:
+    """ Whether a process with this ID exists. Always True on Windows, where os.kill would terminate it. """
+    if pid == os.getpid() or sys.platform.lower().startswith("win"):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # exists, but belongs to someone else
+        return True
+    return True
+
+def isStaleTempName(name: str, modificationTime: float) -> bool:
+    """ Whether a temp directory (or the spill log of its runner) was left behind by a server that is gone. If the server process
+    can't be checked (older versions didn't put it into the name, Windows), after STALE_TEMP_DIR_TIMEOUT seconds. """
+    match = tempNameRegex.match(name)
+    if match is None:
+        return False
+    pid = int(match[1]) if match[1] else None
+    if pid == os.getpid():
+        return False # released by the runners themselves
+    if pid is not None and not processIsAlive(pid):
+        return True
+    return time.time() - modificationTime > STALE_TEMP_DIR_TIMEOUT
+
+class TempDirectoryRegistry:
+    """ The temp output directories of the runners of this server. A directory belongs to its runner from create until release
+    (by newWatcher, which created it, when the runner FINISHED after its last step), then a background task deletes it. The first time an output directory is used,
+    the same task deletes what crashed or restarted servers left there (see isStaleTempName). So no runner has to scan directories. """
+
+    def __init__(self) -> None:
+        self.owned: 'set[Path]' = set()
+        self.swept: 'set[Path]' = set() # output directories
+        self._jobs: 'deque[Callable[[], None]]' = deque()
+        self._task: 'asyncio.Task | None' = None
+
+    def create(self, outputDirectory: Path) -> Path:
+        """ Reserve a new temp directory in outputDirectory. The runner creates it. """
+        self.sweep(outputDirectory)
+        tempOutputDirectory = getTempOutputDirectory(outputDirectory)
+        self.owned.add(tempOutputDirectory)
+        return tempOutputDirectory
+
+    def adopt(self, tempOutputDirectory: Path) -> Path:
+        """ A temp directory of a runner from before a reload of the server code (see CodeReloader) """
+        self.owned.add(tempOutputDirectory)
+        return tempOutputDirectory
+
+    def release(self, tempOutputDirectory: Path):
+        """ The runner is done with tempOutputDirectory: delete it in the background """
+        self.owned.discard(tempOutputDirectory)
+        self._schedule(lambda: shutil.rmtree(tempOutputDirectory, ignore_errors=True))
+
+    def sweep(self, outputDirectory: Path):
+        if outputDirectory in self.swept:
+            return
+        self.swept.add(outputDirectory)
+        self._schedule(lambda: self.removeStale(outputDirectory))
+
+    @staticmethod
+    def removeStale(outputDirectory: Path):
+        removed = 0
+        try:
+            entries = list(os.scandir(outputDirectory))
+        except OSError:
+            return
+        for entry in entries:
+            match = spillLogRegex.match(entry.name) if entry.is_file() else None
+            name = match[1] if match is not None else entry.name
+            if (entry.is_dir() or match is not None) and isStaleTempName(name, entry.stat().st_mtime):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    with contextlib.suppress(OSError):
+                        os.unlink(entry.path)
+                removed += 1
+        if removed:
+            print(f"Removed {removed} temp directories and logs that other servers left in {outputDirectory}.")
+
+    def _schedule(self, job: Callable[[], None]):
+        self._jobs.append(job)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # not in the server
+            self.runJobs()
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._runInBackground())
+
+    async def _runInBackground(self):
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            await loop.run_in_executor(None, self._jobs.popleft())
+
+    async def drain(self):
+        """ Wait until the pending jobs are done, e.g. before the event loop ends """
+        while self._task is not None and not self._task.done():
+            await asyncio.wait([self._task])
+
+    def runJobs(self):
+        while self._jobs:
+            self._jobs.popleft()()
+
+    def removeAll(self, keep: Iterable[Path] = ()):
+        """ When the server stops: delete the temp directories of all runners (except those in keep) and finish the pending jobs """
+        keep = set(keep)
+        for tempOutputDirectory in list(self.owned):
+            if tempOutputDirectory in keep:
+                continue
+            self.owned.discard(tempOutputDirectory)
+            shutil.rmtree(tempOutputDirectory, ignore_errors=True)
+        self.runJobs()
+
+tempDirectories = TempDirectoryRegistry()
 
 def getPowershellCommand(
         tempOutputDirectory: Optional[PathOrString],
         outputDirectory: PathOrString,
-        texFile: PathOrString
+        texFile: PathOrString,
+        tools: Iterable[str] = PREPROCESSING_TOOLS
     ):
-    """This command has to be run in the working directory {texFile.parent}"""
+    """This command has to be run in the working directory {texFile.parent}. tools are the preprocessing tools to run before lualatex."""
     outputDirectory = Path(outputDirectory)
     texFile = Path(texFile)
     if tempOutputDirectory is not None:
@@ -463,6 +1897,8 @@ def getPowershellCommand(
 
     return BASE_POWERSHELL_COMMAND \
         .strip() \
+        .replace('{preprocessing}', '\n'.join(PREPROCESSING_POWERSHELL_COMMANDS[tool] for tool in tools)) \
+        .replace('{STAGE_LOG}', STAGE_LOG) \
         .replace('{outputDirectory}', str(outputDirectory.relative_to( texFile.parent ))) \
         .replace('{tempOutputDirectory}', str(tempOutputDirectory.relative_to( texFile.parent ))) \
         .replace('{fileName}',  texFile.stem) \
@@ -471,47 +1907,1196 @@ def getPowershellCommand(
 def getCMDorBashCommand(
         tempOutputDirectory: Optional[PathOrString],
         outputDirectory: PathOrString,
-        texFile: PathOrString
+        texFile: PathOrString,
+        tools: Iterable[str] = PREPROCESSING_TOOLS
     ):
     # it is run in cmd or bash, so we need the pwsh -c "{...}" (powershell -c only on windows)
-    return 'pwsh -c "' + getPowershellCommand(tempOutputDirectory, outputDirectory, texFile).replace('"', '\\"')  + '"'
+    return 'pwsh -c "' + getPowershellCommand(tempOutputDirectory, outputDirectory, texFile, tools).replace('"', '\\"')  + '"'
+
+def stageFile(source: Path, destination: Path) -> str:
+    """ Reflink (copy-on-write clone) source to destination if the file system supports it, copy it otherwise.
+    No hardlinks: lualatex, biber and xindex truncate and rewrite their files in place, which would change the source, too. """
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as sourceFile, open(destination, 'wb') as destinationFile:
+                fcntl.ioctl(destinationFile.fileno(), FICLONE, sourceFile.fileno())
+            shutil.copystat(source, destination)
+            return 'reflinked'
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+    return 'copied'
+
+def publishFile(source: Path, destination: Path) -> str:
+    """ Atomically replace destination by source, so that e.g. PDF viewers never see a half-written file.
+    The temp directory is inside the output directory, so this is a rename. If that fails (e.g. because a viewer locks the
+    file on Windows), copy to a temporary name next to the destination and replace with that. """
+    try:
+        os.replace(source, destination)
+        return 'moved'
+    except OSError:
+        temporary = destination.with_name(destination.name + '.processPool-tmp')
+        shutil.copy2(source, temporary)
+        os.replace(temporary, destination)
+        return 'copied'
+
+def formatSizes(sizes: Dict[str, int]) -> str:
+    return ", ".join(f"{size / 1e6:.2f} MB {kind}" for kind, size in sizes.items())
+
+class LatexPipeline:
+    """ The steps of BASE_POWERSHELL_COMMAND for the native backend (NativeLatexRunner). The commands have to be run in the working directory {texFile.parent}. """
+
+    def __init__(
+            self,
+            tempOutputDirectory: Optional[PathOrString],
+            outputDirectory: PathOrString,
+            texFile: PathOrString,
+            tools: Iterable[str] = PREPROCESSING_TOOLS,
+            engine: str = 'lualatex',
+            formatFile: 'PathOrString | None' = None
+        ) -> None:
+        self.outputDirectory = Path(outputDirectory)
+        self.texFile = Path(texFile)
+        self.tempOutputDirectory = Path(tempOutputDirectory) if tempOutputDirectory is not None else getTempOutputDirectory(self.outputDirectory)
+        self.tools = list(tools)
+        self.engine = engine # see LATEX_ENGINE_COMMANDS
+        self.formatFile = Path(formatFile) if formatFile is not None else None # the engine starts from this format of the preamble
+
+    @property
+    def pauses(self) -> bool:
+        """ Whether the engine pauses at PAUSE_COMMAND by itself. With a format it skips the preamble instead. """
+        return self.engine in PAUSING_ENGINES and self.formatFile is None
+
+    def _format(self, argument: str) -> str:
+        return argument \
+            .replace('{tempOutputDirectory}', str(self.tempOutputDirectory.relative_to( self.texFile.parent ))) \
+            .replace('{fileName}', self.texFile.stem)
+
+    def toolCommand(self, tool: str) -> List[str]:
+        return [self._format(argument) for argument in NATIVE_PREPROCESSING_COMMANDS[tool]]
+
+    def latexCommand(self) -> List[str]:
+        command = [self._format(argument) for argument in LATEX_ENGINE_COMMANDS[self.engine]]
+        if self.formatFile is not None:
+            command.insert(1, f"--fmt={self.formatFile}")
+        return command
+
+    def environment(self) -> Dict[str, str]:
+        if not self.pauses: # e.g. the lualatex passes of latexmk must not pause
+            return {key: value for key, value in os.environ.items() if key != 'LATEX_ALLOW_PAUSE_EXECUTION'}
+        return {**os.environ, 'LATEX_ALLOW_PAUSE_EXECUTION': 'true'}
+
+    def _ownFiles(self, directory: Path) -> List[Path]:
+        return [file for file in directory.glob(glob.escape(self.texFile.stem) + '*') if file.is_file()]
+
+    def prepare(self) -> str:
+        """ mkdir tempOutputDirectory and stage the files of the last run that the pipeline reads. Returns a summary. """
+        startTime = time.time()
+        self.tempOutputDirectory.mkdir(parents=True)
+        sizes = {'reflinked': 0, 'copied': 0, 'skipped': 0}
+        for file in self._ownFiles(self.outputDirectory):
+            if file.name.endswith(PURE_OUTPUT_SUFFIXES):
+                sizes['skipped'] += file.stat().st_size
+                continue
+            sizes[stageFile(file, self.tempOutputDirectory / file.name)] += file.stat().st_size
+        return f"Staged the files of the last run in {time.time() - startTime:.3f} s ({formatSizes(sizes)})."
+
+    def restage(self) -> str:
+        """ Stage the files with RESTAGED_SUFFIXES again that changed in the outputDirectory since prepare(). They are only read
+        after the pause, so this is possible until the runner is continued. Returns a summary, "" if nothing changed. """
+        staged = []
+        for file in self._ownFiles(self.outputDirectory):
+            if not file.name.endswith(RESTAGED_SUFFIXES):
+                continue
+            destination = self.tempOutputDirectory / file.name
+            signature, stagedSignature = fileSignature(file), fileSignature(destination)
+            if signature is not None and (stagedSignature is None or signature[1] > stagedSignature[1]):
+                stageFile(file, destination)
+                staged.append(file.name)
+        return f"Staged the newer {', '.join(staged)} of the last compilation." if staged else ""
+
+    def publish(self) -> str:
+        """ Move the results to the outputDirectory, replacing every file atomically. Returns a summary. """
+        startTime = time.time()
+        sizes = {'moved': 0, 'copied': 0}
+        for file in self._ownFiles(self.tempOutputDirectory):
+            size = file.stat().st_size
+            sizes[publishFile(file, self.outputDirectory / file.name)] += size
+        return f"Published the results in {time.time() - startTime:.3f} s ({formatSizes(sizes)})."
+
+    def commandLines(self) -> List[str]:
+        """ The equivalent (POSIX) shell commands """
+        temp = str(self.tempOutputDirectory.relative_to( self.texFile.parent ))
+        output = str(self.outputDirectory.relative_to( self.texFile.parent ))
+        stem = glob.escape(self.texFile.stem)
+        return [
+            f"mkdir -p {shlex.quote(temp)}",
+            f"cp {shlex.quote(output)}/{stem}* {shlex.quote(temp)}",
+            *(shlex.join(self.toolCommand(tool)) for tool in self.tools),
+            ("LATEX_ALLOW_PAUSE_EXECUTION=true " if self.pauses else "") + shlex.join(self.latexCommand()),
+            f"cp {shlex.quote(temp)}/{stem}* {shlex.quote(output)}",
+            f"rm -r {shlex.quote(temp)}",
+        ]
+
+
+class RunnerScheduler:
+    """ Owns the watchers of all documents. Caps the number of live runners of all watchers together: when the cap is hit,
+    idle runners of the least recently used documents are evicted. Watchers without requests for idleTimeout seconds are torn down. """
+    memoryBudgetMB = POOL_MEMORY_BUDGET_MB
+    maxTotalRunners = MAX_TOTAL_RUNNERS
+    idleTimeout = WATCHER_IDLE_TIMEOUT
+    maxParallelCompiles = MAX_PARALLEL_COMPILES
+
+    def __init__(self) -> None:
+        self.watchers: 'OrderedDict[str, ProcessWatcher]' = OrderedDict() # least recently used first
+        self.sweepTask: 'asyncio.Task | None' = None
+        self._compileSlots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def parallelCompiles(self) -> int:
+        return self.maxParallelCompiles if self.maxParallelCompiles > 0 else (os.cpu_count() or 1)
+
+    def compileSlots(self) -> asyncio.Semaphore:
+        """ Limits the compilations of all watchers that run at the same time. Compilations of one document run one after another anyway. """
+        if self._compileSlots is None:
+            self._compileSlots = asyncio.Semaphore(self.parallelCompiles)
+        return self._compileSlots
+
+    @property
+    def capacity(self) -> int:
+        capacity = self.memoryBudgetMB // RUNNER_MEMORY_ESTIMATE_MB
+        if self.maxTotalRunners > 0:
+            capacity = min(capacity, self.maxTotalRunners)
+        return max(capacity, 1)
+
+    def liveRunners(self) -> int:
+        return sum(watcher.liveRunners for watcher in self.watchers.values())
+
+    def get(self, key: str) -> Optional[ProcessWatcher]:
+        """ Returns the watcher for key (if any) and marks it as most recently used """
+        watcher = self.watchers.get(key)
+        if watcher is not None:
+            self.watchers.move_to_end(key)
+        return watcher
+
+    def add(self, key: str, watcher: ProcessWatcher):
+        self.watchers[key] = watcher
+        self.watchers.move_to_end(key)
+        if self.sweepTask is None:
+            self.sweepTask = asyncio.get_running_loop().create_task(self.sweep())
+
+    async def requestRunnerSlot(self, requester: ProcessWatcher) -> bool:
+        """ Returns whether requester may start another runner, after evicting idle runners of less recently used watchers if necessary """
+        liveRunners = self.liveRunners()
+        capacity = self.capacity
+        if requester not in self.watchers.values():
+            liveRunners += requester.liveRunners
+        for watcher in list(self.watchers.values()):
+            if liveRunners < capacity:
+                break
+            if watcher is requester: # all remaining watchers are more recently used than the requester
+                break
+            while liveRunners >= capacity and await watcher.evictIdleRunner():
+                liveRunners -= 1
+        return liveRunners < capacity
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(SCHEDULER_SWEEP_INTERVAL)
+            for key, watcher in list(self.watchers.items()):
+                if watcher.runningRunners or watcher.lastUsed > time.time() - self.idleTimeout:
+                    continue
+                print(f"Tearing down the watcher of {key} after {self.idleTimeout} s without requests.")
+                del self.watchers[key]
+                await watcher.close()
 
+scheduler = RunnerScheduler()
+buildCache: Optional['BuildCache'] = None # see BUILD_CACHE_MAX_MB
 
-watchers: Dict[str, ProcessWatcher] = {}
+def watcherKey(texFile: PathOrString) -> str:
+    """ The same for every spelling of a main file (relative, without .tex, resolved by ProjectWatcher), so that a document has one watcher """
+    return str(Path(texFile).with_suffix('.tex').resolve())
 
-async def do_execute(texFile: PathOrString, output_dir: 'PathOrString | None' = None) -> str:
+def getWatcher(texFile: PathOrString, output_dir: 'PathOrString | None' = None) -> 'ProcessWatcher | str':
+    """ Returns the watcher for texFile (creating it if necessary) or an error message """
     if texFile is None or texFile == '':
         print("No file path provided!")
         return "No file path provided!"
-    global watchers
-    key = str(texFile)
-    if key not in watchers:
-        watcher = newWatcher(texFile=texFile, output_dir=output_dir)
+    key = watcherKey(texFile)
+    watcher = scheduler.get(key)
+    if watcher is None:
+        watcher = newWatcher(texFile=key, output_dir=output_dir)
         if watcher is None:
             print("Potential Error when creating watcher.")
             return "Potential Error when creating watcher."
-        watchers[key] = watcher
-    else:
-        watcher = watchers[key]
-    return await watcher.execute(waitForCompletion=True)
+        scheduler.add(key, watcher)
+    return watcher
+
+async def do_execute(texFile: PathOrString, output_dir: 'PathOrString | None' = None, fullLog: bool = True) -> str:
+    watcher = getWatcher(texFile, output_dir)
+    if isinstance(watcher, str):
+        return watcher
+    return await watcher.execute(waitForCompletion=True, fullLog=fullLog)
+
+async def do_execute_streaming(texFile: PathOrString, output_dir: 'PathOrString | None', onLine: Callable[[str], None], fullLog: bool = True) -> Dict[str, object]:
+    """ Like do_execute, but passes the log (or the errors and warnings) line by line to onLine as it is produced. Returns the status record. """
+    watcher = getWatcher(texFile, output_dir)
+    if isinstance(watcher, str):
+        onLine(watcher)
+        return {'status': 'error', 'errorState': None, 'seconds': 0}
+    await watcher.execute(waitForCompletion=True, onLine=onLine, fullLog=fullLog)
+    return watcher.lastStatus
+#endregion
+
+#region Metrics
+class Histogram:
+    """ Cumulative histogram in the sense of Prometheus """
+
+    def __init__(self, buckets: 'tuple[float, ...]' = HISTOGRAM_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets) # observations <= bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+    def toDict(self) -> Dict[str, object]:
+        return {'count': self.count, 'sum': self.sum, 'buckets': dict(zip(map(str, self.buckets), self.counts))}
+
+class Metrics:
+    """ Timings of all watchers, for the /metrics and /status routes of the server. Histograms (in seconds):
+        preamble: from the start of a runner until it paused,
+        continue: from a request until its runner continues,
+        body: from continuing a runner until it exited,
+        stage: duration of the stages (see STAGE_LOG) of the runners that served a request, except the LaTeX engine (see preamble and body),
+               and of the builds of preamble formats (stage 'format'),
+        request: from a request until its compilation finished, by strategy ('pause', 'format' or 'cache'), to compare them per document. """
+    NAMES = ('preamble', 'continue', 'body', 'stage', 'request')
+
+    def __init__(self) -> None:
+        self.histograms: Dict['tuple[str, tuple[tuple[str, str], ...]]', Histogram] = {} # (name, labels)
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def observeServedRunner(self, document: str, runner: 'Runner'):
+        if runner.continueTime is not None and runner.exitTime is not None:
+            self.observe('body', runner.exitTime - runner.continueTime, document=document)
+            for stage, duration in runner.stageDurations().items():
+                if stage not in LATEX_ENGINE_COMMANDS:
+                    self.observe('stage', duration, document=document, stage=stage)
+
+metrics = Metrics()
+
+def processTreeRSS(pid: Optional[int]) -> Optional[int]:
+    """ Resident memory in bytes of the process pid and all of its descendants (Linux only, else None) """
+    if pid is None or not os.path.exists(f"/proc/{pid}/status"):
+        return None
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            status = Path(f"/proc/{current}/status").read_text()
+            children = Path(f"/proc/{current}/task/{current}/children").read_text().split()
+        except OSError: # exited in the meantime
+            continue
+        match = re.search(r"^VmRSS:\s*(\d+) kB", status, re.MULTILINE)
+        if match is not None:
+            total += int(match.group(1)) * 1024
+        pending += map(int, children)
+    return total
+
+async def collectStatus() -> Dict[str, object]:
+    """ The state of the server: runners by RunnerStates, finishResults, pool sizes and hit rates and the memory of every runner per document, and the histograms """
+    documents = {}
+    for name, watcher in scheduler.watchers.items():
+        runners: Dict[str, int] = {state.name: 0 for state in RunnerStates}
+        memory = []
+        for runner in itertools.chain(watcher.runners, watcher.runningRunners):
+            state = await runner.getState()
+            runners[state.name] += 1
+            memory.append({'pid': runner.pid, 'state': state.name, 'rssBytes': processTreeRSS(runner.pid)})
+        served = watcher.servedBy['WAITING'] + watcher.servedBy['PREPARING']
+        documents[name] = {
+            'runners': runners,
+            'finishResults': {errorState.name: count for errorState, count in watcher.finishResults.items()},
+            'poolSize': watcher.minNumberAvailable,
+            'poolSizeReason': watcher.sizeReason,
+            'servedBy': dict(watcher.servedBy),
+            'poolHitRate': watcher.servedBy['WAITING'] / served if served else None,
+            'memory': memory,
+            'lastStatus': watcher.lastStatus,
+            'warmStart': watcher.preambleFormat.status() if watcher.preambleFormat is not None else {'strategy': 'pause'},
+        }
+    return {
+        'documents': documents,
+        'liveRunners': scheduler.liveRunners(),
+        'capacity': scheduler.capacity,
+        'parallelCompiles': scheduler.parallelCompiles,
+        'histograms': [
+            {'name': name, 'labels': dict(labels), **histogram.toDict()}
+            for (name, labels), histogram in metrics.histograms.items()
+        ],
+    }
+
+def prometheusText(status: Dict[str, object]) -> str:
+    """ status (see collectStatus) in the text format of Prometheus """
+    def labelText(**labels) -> str:
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+    families: Dict[str, 'tuple[str, List[str]]'] = { # name -> (type, samples). The samples of a family must be consecutive.
+        name: (kind, []) for name, kind in [
+            ('processpool_runners', 'gauge'), ('processpool_runner_finish_total', 'counter'), ('processpool_requests_total', 'counter'),
+            ('processpool_pool_size', 'gauge'), ('processpool_runner_rss_bytes', 'gauge'),
+            ('processpool_live_runners', 'gauge'), ('processpool_runner_capacity', 'gauge'),
+            *((f'processpool_{name}_seconds', 'histogram') for name in Metrics.NAMES)
+        ]
+    }
+    for document, info in status['documents'].items(): # type: ignore[union-attr]
+        for state, count in info['runners'].items():
+            families['processpool_runners'][1].append(f"processpool_runners{labelText(document=document, state=state)} {count}")
+        for errorState, count in info['finishResults'].items():
+            families['processpool_runner_finish_total'][1].append(f"processpool_runner_finish_total{labelText(document=document, error_state=errorState)} {count}")
+        for servedBy, count in info['servedBy'].items():
+            families['processpool_requests_total'][1].append(f"processpool_requests_total{labelText(document=document, served_by=servedBy)} {count}")
+        families['processpool_pool_size'][1].append(f"processpool_pool_size{labelText(document=document)} {info['poolSize']}")
+        for runner in info['memory']:
+            if runner['rssBytes'] is not None:
+                families['processpool_runner_rss_bytes'][1].append(f"processpool_runner_rss_bytes{labelText(document=document, pid=runner['pid'], state=runner['state'])} {runner['rssBytes']}")
+    families['processpool_live_runners'][1].append(f"processpool_live_runners {status['liveRunners']}")
+    families['processpool_runner_capacity'][1].append(f"processpool_runner_capacity {status['capacity']}")
+    for histogram in status['histograms']: # type: ignore[union-attr]
+        name = f"processpool_{histogram['name']}_seconds"
+        samples = families[name][1]
+        for bucket, count in [*histogram['buckets'].items(), ('+Inf', histogram['count'])]:
+            samples.append(f"{name}_bucket{labelText(**histogram['labels'], le=bucket)} {count}")
+        samples.append(f"{name}_sum{labelText(**histogram['labels'])} {histogram['sum']}")
+        samples.append(f"{name}_count{labelText(**histogram['labels'])} {histogram['count']}")
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines += [f"# TYPE {name} {kind}", *samples]
+    return "\n".join(lines) + "\n"
+#endregion
+
+#region Project watching
+class InotifyChanges:
+    """ Reports the changed files below root with inotify (Linux only, called through ctypes) """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    eventHeader = struct.Struct('iIII') # wd, mask, cookie, len
+
+    def __init__(self, root: Path, ignore: Callable[[Path], bool]) -> None:
+        self.root = root
+        self.ignore = ignore
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, Path] = {}
+        self.addDirectory(root)
+
+    def addDirectory(self, directory: Path):
+        for path, subdirectories, _ in os.walk(directory):
+            subdirectories[:] = [name for name in subdirectories if not self.ignore(Path(path) / name)]
+            watch = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+            if watch < 0:
+                print(f"Cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.directories[watch] = Path(path)
+
+    def start(self, onChange: Callable[[Path], None]):
+        asyncio.get_running_loop().add_reader(self.fd, self._read, onChange)
+
+    def _read(self, onChange: Callable[[Path], None]):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            watch, mask, _, length = self.eventHeader.unpack_from(data, offset)
+            name = data[offset + self.eventHeader.size : offset + self.eventHeader.size + length].rstrip(b'\0')
+            offset += self.eventHeader.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                onChange(self.root) # events were lost
+                continue
+            directory = self.directories.get(watch)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if self.ignore(path):
+                continue
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.addDirectory(path)
+                continue
+            onChange(path)
+
+    def stop(self):
+        with contextlib.suppress(RuntimeError):
+            asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+class PollingChanges:
+    """ Reports the changed files below root by comparing size and mtime of all files every interval seconds """
+
+    def __init__(self, root: Path, ignore: Callable[[Path], bool], interval: float = PROJECT_POLL_INTERVAL) -> None:
+        self.root = root
+        self.ignore = ignore
+        self.interval = interval
+        self.task: 'asyncio.Task | None' = None
+
+    def scan(self) -> Dict[Path, 'tuple[int, int] | None']:
+        signatures = {}
+        for path, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = [name for name in subdirectories if not self.ignore(Path(path) / name)]
+            for name in files:
+                file = Path(path) / name
+                if not self.ignore(file):
+                    signatures[file] = fileSignature(file)
+        return signatures
+
+    def start(self, onChange: Callable[[Path], None]):
+        async def poll():
+            loop = asyncio.get_running_loop()
+            signatures = await loop.run_in_executor(None, self.scan)
+            while True:
+                await asyncio.sleep(self.interval)
+                newSignatures = await loop.run_in_executor(None, self.scan)
+                for file in signatures.keys() | newSignatures.keys():
+                    if signatures.get(file) != newSignatures.get(file):
+                        onChange(file)
+                signatures = newSignatures
+        self.task = asyncio.get_running_loop().create_task(poll())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+def fileChangeSource(root: Path, ignore: Callable[[Path], bool], polling: bool = False) -> 'InotifyChanges | PollingChanges':
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyChanges(root, ignore)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), polling for changes instead.")
+    return PollingChanges(root, ignore)
+
+def projectMainFile(root: Path, path: Path) -> Optional[Path]:
+    """ The main file of the project that path belongs to. Like in automate.ps1, every folder directly below root
+    (except those starting with . or _) is a project, with the main file <name>/<name>.tex or (old style) <name>.tex """
+    try:
+        parts = path.relative_to(root).parts
+    except ValueError:
+        return None
+    if not parts or parts[0].startswith(('.', '_')):
+        return None
+    name = parts[0]
+    if len(parts) == 1:
+        if not name.endswith('.tex'):
+            return None
+        name = name[:-len('.tex')]
+    for mainFile in (root / name / f"{name}.tex", root / f"{name}.tex"):
+        if mainFile.is_file():
+            return mainFile
+    return None
+
+class ProjectWatcher:
+    """ Watches a root directory of projects (the base directory of automate.ps1). When a file of a project is saved,
+    the runners of its main file are started (or replaced, if the change outdated their preamble) right away,
+    instead of on the next request. With compileOnSave, the project is compiled as well. """
+
+    def __init__(self, root: PathOrString, outputDir: PathOrString = "out", compileOnSave: bool = False, polling: bool = False) -> None:
+        self.root = Path(root).resolve()
+        self.outputDir = outputDir
+        self.compileOnSave = compileOnSave
+        self.source = fileChangeSource(self.root, self.isIgnored, polling)
+        self._changed: 'set[Path]' = set()
+        self._flushHandle: 'asyncio.TimerHandle | None' = None
+
+    def isIgnored(self, path: Path) -> bool:
+        """ Output directories, our temp directories and logs, and hidden files don't concern the runners """
+        return (
+            path.name.startswith('.') or path.name == Path(self.outputDir).name
+            or tempNameRegex.match(path.name) is not None or path.name.startswith('processPool-')
+        )
+
+    def start(self):
+        self.source.start(self.onChange)
+        print(f"Watching {self.root} for changes ({type(self.source).__name__}).")
+
+    def stop(self):
+        self.source.stop()
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+
+    def onChange(self, path: Path):
+        """ Collect the changes of PROJECT_WATCH_DEBOUNCE seconds, an editor often writes a file in several steps """
+        self._changed.add(path)
+        if self._flushHandle is None:
+            self._flushHandle = asyncio.get_running_loop().call_later(PROJECT_WATCH_DEBOUNCE, self._flush)
+
+    def _flush(self):
+        self._flushHandle = None
+        changed, self._changed = self._changed, set()
+        asyncio.ensure_future(self.handleChanges(changed))
+
+    async def handleChanges(self, changed: 'set[Path]'):
+        for watcher in list(scheduler.watchers.values()): # replace the runners whose preamble is outdated now
+            await watcher.refreshState()
+        documents = {mainFile for mainFile in (projectMainFile(self.root, path) for path in changed) if mainFile is not None}
+        compilations = []
+        for texFile in documents:
+            watcher = getWatcher(texFile, self.outputDir)
+            if isinstance(watcher, str):
+                continue
+            if self.compileOnSave:
+                print(f"Compiling {texFile} because it was saved.")
+                compilations.append(watcher.execute(waitForCompletion=True, fullLog=False))
+            else:
+                await watcher.warmUp()
+        for summary in await asyncio.gather(*compilations):
+            print(summary)
+#endregion
+
+#region Build cache
+class ContentHashes:
+    """ Content hashes of files, computed again only if size or mtime changed """
+
+    def __init__(self) -> None:
+        self._hashes: Dict[Path, 'tuple[tuple[int, int], str]'] = {}
+
+    def get(self, file: Path) -> str:
+        """ "" if the file doesn't exist """
+        signature = fileSignature(file)
+        if signature is None:
+            return ""
+        known = self._hashes.get(file)
+        if known is not None and known[0] == signature:
+            return known[1]
+        try:
+            value = hashlib.sha256(file.read_bytes()).hexdigest()
+        except OSError:
+            return ""
+        self._hashes[file] = (signature, value)
+        return value
+
+contentHashes = ContentHashes()
+
+def inputFingerprint(file: Path, documentDirectory: Path) -> str:
+    """ The content hash of files in the folder of the document, size and mtime of the others (TeX distribution, fonts) """
+    if documentDirectory in file.parents:
+        return contentHashes.get(file)
+    return str(fileSignature(file))
+
+def recordedInputFingerprints(texFile: Path, outputDirectory: Path) -> Optional[Dict[str, str]]:
+    """ inputFingerprint of every input in the .fls file of the last build and of the .bib files in its .bcf file (biber reads them,
+    so they are not in the .fls file). Files of the output directory are results, not inputs. None if there is no .fls file. """
+    inputs = [file for _, file in recordedInputs(outputDirectory / (texFile.stem + '.fls'))]
+    if not inputs:
+        return None
+    documentDirectory = texFile.parent.resolve()
+    inputs += [file.resolve() for file in PreambleTracker(texFile, outputDirectory).bibFiles()]
+    outputDirectory = outputDirectory.resolve()
+    return {
+        str(file): inputFingerprint(file, documentDirectory)
+        for file in sorted(inputs, key=str)
+        if outputDirectory not in file.parents and 'luatex-cache' not in file.parts
+    }
+
+def recordedInputsHash(texFile: Path, outputDirectory: Path) -> Optional[str]:
+    fingerprints = recordedInputFingerprints(texFile, outputDirectory)
+    if fingerprints is None:
+        return None
+    return hashlib.sha256(json.dumps(fingerprints, sort_keys=True).encode()).hexdigest()
+
+class CacheHit:
+    """ A build of the build cache whose inputs all match: its status record, the summary of its errors and warnings and its log """
+    def __init__(self, entry: Path, manifest: Dict[str, object]) -> None:
+        self.entry = entry
+        self.status: Dict[str, object] = manifest['status'] # type: ignore[assignment]
+        self.summary = str(manifest['summary'])
+        self.buildTime = float(manifest['time']) # type: ignore[arg-type]
+        try:
+            self.log = (entry / BUILD_CACHE_LOG).read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            self.log = self.summary
+        self.note = f"{CACHE_LOG}The inputs are the same as for the build of {datetime.fromtimestamp(self.buildTime):%Y-%m-%d %H:%M:%S}, its files were restored from the build cache without running LaTeX."
+
+    def text(self, fullLog: bool) -> str:
+        return (self.log if fullLog else self.summary).rstrip('\n') + "\n" + self.note
+
+class BuildCache:
+    """ The results of successful builds on disk, so that they survive restarts of the server:
+    directory/<document key>/<input key>/ contains a manifest (every input of the .fls file and every .bib file with its inputFingerprint,
+    the generatedInputsHash of the .idx/.bcf files, the status record and the summary of the log), the runner log and the output
+    files (see BUILD_CACHE_SUFFIXES).
+    A request whose inputs all match a manifest gets these files copied to its output directory without running LaTeX.
+    When the files take more than maxBytes, the least recently used builds are deleted. """
+
+    def __init__(self, directory: Path, maxBytes: int) -> None:
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def documentDirectory(self, texFile: Path, outputDirectory: Path) -> Path:
+        key = hashlib.sha256(f"{texFile.resolve()}|{outputDirectory.resolve()}".encode()).hexdigest()[:16]
+        return self.directory / key
+
+    def lookup(self, texFile: Path, outputDirectory: Path) -> Optional[CacheHit]:
+        """ The most recently used build of texFile whose inputs all match, None if there is none """
+        documentDirectory = texFile.parent.resolve()
+        generatedInputs = PreambleTracker(texFile, outputDirectory).generatedInputsHash()
+        try:
+            entries = sorted(self.documentDirectory(texFile, outputDirectory).iterdir(), key=lambda entry: fileSignature(entry / BUILD_CACHE_MANIFEST) or (0, 0), reverse=True)
+        except OSError:
+            return None
+        for entry in entries:
+            try:
+                manifest = json.loads((entry / BUILD_CACHE_MANIFEST).read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            if manifest.get('generatedInputs') == generatedInputs and all(inputFingerprint(Path(file), documentDirectory) == fingerprint for file, fingerprint in manifest['inputs'].items()):
+                os.utime(entry / BUILD_CACHE_MANIFEST) # least recently used is the oldest manifest
+                return CacheHit(entry, manifest)
+        return None
+
+    def restore(self, hit: CacheHit, texFile: Path, outputDirectory: Path):
+        """ Copy the output files of hit to outputDirectory, each one replaced at once so that PDF viewers never see half a file """
+        outputDirectory.mkdir(parents=True, exist_ok=True)
+        for file in hit.entry.iterdir():
+            if file.name.startswith(texFile.stem + '.'):
+                temporary = outputDirectory / (file.name + '.processPool-cache')
+                shutil.copyfile(file, temporary)
+                os.replace(temporary, outputDirectory / file.name)
+
+    def store(self, texFile: Path, outputDirectory: Path, status: Dict[str, object], summary: str, logFile: Optional[Path], since: float) -> bool:
+        """ Add the build in outputDirectory. Not if an input changed after since (the start of the build), then the files
+        may be from the old content. Returns whether the build was added. """
+        fingerprints = recordedInputFingerprints(texFile, outputDirectory)
+        if fingerprints is None:
+            return False
+        if any((fileSignature(Path(file)) or (0, 0))[1] / 1e9 >= since for file in fingerprints):
+            print("Not adding the build to the build cache, an input changed during the compilation.")
+            return False
+        generatedInputs = PreambleTracker(texFile, outputDirectory).generatedInputsHash()
+        key = hashlib.sha256(json.dumps([fingerprints, generatedInputs], sort_keys=True).encode()).hexdigest()[:16]
+        entry = self.documentDirectory(texFile, outputDirectory) / key
+        temporary = entry.with_name(key + f".{os.getpid()}.tmp")
+        shutil.rmtree(temporary, ignore_errors=True)
+        temporary.mkdir(parents=True)
+        for suffix in BUILD_CACHE_SUFFIXES:
+            file = outputDirectory / (texFile.stem + suffix)
+            if file.is_file():
+                shutil.copyfile(file, temporary / file.name)
+        if logFile is not None and logFile.is_file():
+            shutil.copyfile(logFile, temporary / BUILD_CACHE_LOG)
+        manifest = {'texFile': str(texFile), 'time': time.time(), 'inputs': fingerprints, 'generatedInputs': generatedInputs, 'status': status, 'summary': summary}
+        (temporary / BUILD_CACHE_MANIFEST).write_text(json.dumps(manifest), encoding='utf-8') # written last: entries without one are incomplete
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(temporary, entry)
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Delete the least recently used builds until the rest takes at most self.maxBytes """
+        entries = []
+        for entry in self.directory.glob('*/*'):
+            try:
+                size = sum(file.stat().st_size for file in entry.iterdir())
+                lastUsed = (entry / BUILD_CACHE_MANIFEST).stat().st_mtime
+            except OSError: # incomplete, or deleted by another server
+                continue
+            entries.append((lastUsed, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+class DocumentCache:
+    """ The view of a ProcessWatcher on the build cache: the builds of one document """
+    def __init__(self, cache: BuildCache, texFile: Path, outputDirectory: Path) -> None:
+        self.cache = cache
+        self.texFile = texFile
+        self.outputDirectory = outputDirectory
+
+    def restore(self) -> Optional[CacheHit]:
+        """ If there is a build with the current inputs, copy its files to the output directory and return it """
+        hit = self.cache.lookup(self.texFile, self.outputDirectory)
+        if hit is not None:
+            self.cache.restore(hit, self.texFile, self.outputDirectory)
+        return hit
+
+    def store(self, status: Dict[str, object], summary: str, logFile: Optional[Path], since: float) -> bool:
+        return self.cache.store(self.texFile, self.outputDirectory, status, summary, logFile, since)
+
+def defaultBuildCacheDirectory() -> Path:
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'processPool'
+#endregion
+
+#region Preamble formats
+warmStartCommentRegex = re.compile(r"^%\s*!processPool\s+warm-start\s*=\s*(\w+)", re.MULTILINE | re.IGNORECASE)
+# what a format can't keep: the Lua state (fonts loaded by luaotfload, Lua functions) and open output files
+undumpableRegex = re.compile(
+    r"\\(?:usepackage|RequirePackage)(?:\[[^\]]*\])?\{[^}]*\b(fontspec|unicode-math|polyglossia|luacode|luaotfload)\b"
+    r"|\\(setmainfont|setsansfont|setmonofont|newfontfamily|makeindex|makeglossaries)\b"
+)
+formatBreakageRegex = re.compile(r"attempt to (?:call|index) a nil value|luaotfload.*error|Font \\\S+ .* not loadable")
+commentRegex = re.compile(r"(?<!\\)%.*$", re.MULTILINE)
+
+class PreambleFormat:
+    """ The 'format' warm-start strategy of a document: instead of runners that pause at PAUSE_COMMAND, the engine starts from
+    a format (.fmt) with the preamble already loaded, dumped once with FORMAT_BUILD_COMMAND. The formats are kept in directory,
+    keyed by the hash of the preamble and the signatures of the files it reads, so a server restart can use them again.
+    A compilation with the format gobbles the preamble of the main file, because the format redefines \\documentclass.
+    The strategy is WARM_START or, per document, a line "% !processPool warm-start = format" (or pause) in the main file.
+    Preambles that can't be dumped fall back to the paused runners: those with fontspec and other Lua state (undumpableRegex),
+    those whose format couldn't be built and those whose compilations broke with the format (see checkRun). """
+    PAUSE_REQUESTED = "the strategy of the document is 'pause'"
+
+    def __init__(self, texFile: Path, preambleTracker: PreambleTracker, directory: Path) -> None:
+        self.texFile = texFile
+        self.preambleTracker = preambleTracker
+        self.directory = directory
+        self.unusable: Dict[str, str] = {} # format key -> why the preamble can't use a format
+        self.reason = self.PAUSE_REQUESTED # why the current preamble doesn't use a format, "" if it does
+        self._building: 'asyncio.Task | None' = None
+        self.buildTime: Optional[float] = None # seconds of the last format build
+
+    def requestedStrategy(self) -> str:
+        try:
+            with self.texFile.open(encoding='utf-8', errors='replace') as file:
+                head = file.read(4096)
+        except OSError:
+            return WARM_START
+        match = warmStartCommentRegex.search(head)
+        return match.group(1).lower() if match is not None and match.group(1).lower() in WARM_START_STRATEGIES else WARM_START
+
+    def preamble(self) -> Optional[str]:
+        """ The main file up to the PAUSE_COMMAND that pauses it (see pauseCommandEnd), None if it doesn't pause """
+        try:
+            content = self.texFile.read_text(encoding='utf-8', errors='replace')
+        except OSError:
+            return None
+        pauseEnd = pauseCommandEnd(content)
+        return content[:pauseEnd - len(PAUSE_COMMAND)] if pauseEnd >= 0 else None
+
+    def key(self, preamble: str) -> str:
+        digest = hashlib.sha256(f"{self.texFile.parent.resolve()}|{preamble}".encode())
+        for dependency in sorted(self.preambleTracker.dependencies):
+            digest.update(f"{dependency}:{fileSignature(dependency)};".encode())
+        return f"{self.texFile.stem}-{digest.hexdigest()[:16]}"
+
+    def current(self) -> Optional[Path]:
+        """ The format of the current preamble, None if the runner has to pause instead. Starts building a missing format
+        in the background, the runners pause until it is there. """
+        formatFile, reason = self._current()
+        if reason != self.reason:
+            print(f"{self.texFile.name} warm-starts with " + (f"the preamble format {formatFile}." if formatFile is not None else f"paused runners: {reason}."))
+            self.reason = reason
+        return formatFile
+
+    async def ready(self) -> Optional[Path]:
+        """ Like current, but waits for the build of a missing format """
+        formatFile = self.current()
+        if formatFile is None and self._building is not None:
+            await asyncio.shield(self._building)
+            formatFile = self.current()
+        return formatFile
+
+    def _current(self) -> 'tuple[Optional[Path], str]':
+        if self.requestedStrategy() != 'format':
+            return None, self.PAUSE_REQUESTED
+        preamble = self.preamble()
+        if preamble is None:
+            return None, f"the main file has no {PAUSE_COMMAND}"
+        key = self.key(preamble)
+        if key not in self.unusable:
+            uncommented = commentRegex.sub("", preamble)
+            match = undumpableRegex.search(uncommented)
+            if match is not None:
+                self.unusable[key] = f"the preamble uses {match.group(1) or match.group(2)}, whose state can't be dumped"
+            elif pauseCommandRegex.search(uncommented): # FORMAT_DUMP_SUFFIX would skip only up to this one
+                self.unusable[key] = f"the preamble mentions {PAUSE_COMMAND} before the pause, e.g. in its definition"
+        if key in self.unusable:
+            return None, self.unusable[key]
+        formatFile = self.directory / f"{key}.fmt"
+        if formatFile.is_file():
+            with contextlib.suppress(OSError):
+                os.utime(formatFile) # least recently used is the oldest
+            return formatFile, ""
+        if self._building is None:
+            self._building = asyncio.get_running_loop().create_task(self.build(key, preamble))
+        return None, "the preamble format is being built"
+
+    async def build(self, key: str, preamble: str):
+        """ Dump preamble into directory/key.fmt. Marks key as unusable if that fails. """
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            formatName = f"{key}-{os.getpid()}" # renamed when complete, other servers may use the same directory
+            dumpFile = self.directory / f"{formatName}.tex"
+            dumpFile.write_text(preamble + FORMAT_DUMP_SUFFIX, encoding='utf-8')
+            command = [
+                argument.replace('{formatName}', formatName).replace('{formatDirectory}', str(self.directory)).replace('{dumpFile}', str(dumpFile))
+                for argument in FORMAT_BUILD_COMMAND
+            ]
+            environment = {name: value for name, value in os.environ.items() if name != 'LATEX_ALLOW_PAUSE_EXECUTION'}
+            print(f"Building the preamble format of {self.texFile.name}:", shlex.join(command))
+            startTime = time.time()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.texFile.parent, env=environment
+                )
+                output, _ = await asyncio.wait_for(process.communicate(), FORMAT_BUILD_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                self.unusable[key] = f"dumping the format took more than {FORMAT_BUILD_TIMEOUT} s"
+                return
+            except OSError as e:
+                self.unusable[key] = f"{FORMAT_BUILD_COMMAND[0]} could not be started: {e}"
+                return
+            builtFile = self.directory / f"{formatName}.fmt"
+            if process.returncode != 0 or not builtFile.is_file():
+                errors = [line for line in output.decode('utf-8', errors='replace').splitlines() if line.startswith('!')]
+                self.unusable[key] = f"dumping the format failed ({errors[0] if errors else f'return code {process.returncode}'})"
+                return
+            os.replace(builtFile, self.directory / f"{key}.fmt")
+            self.buildTime = time.time() - startTime
+            metrics.observe('stage', self.buildTime, document=str(self.texFile), stage='format')
+            print(f"Built the preamble format of {self.texFile.name} in {self.buildTime:.2f} s.")
+            self.evict()
+        finally:
+            for file in self.directory.glob(glob.escape(f"{key}-{os.getpid()}") + '.*'):
+                with contextlib.suppress(OSError):
+                    file.unlink()
+            self._building = None
+
+    def evict(self):
+        """ Keep the MAX_CACHED_FORMATS most recently used formats of the directory """
+        formats = sorted(self.directory.glob('*.fmt'), key=lambda file: (fileSignature(file) or (0, 0))[1], reverse=True)
+        for file in formats[MAX_CACHED_FORMATS:]:
+            with contextlib.suppress(OSError):
+                file.unlink()
+
+    def checkRun(self, runner: Runner) -> bool:
+        """ Whether the finished runner broke because of its format. Then its format is deleted and marked as unusable,
+        so that the runners of this preamble pause again. """
+        if runner.formatFile is None or not runner.exitedEvent.is_set():
+            return False
+        key = runner.formatFile.stem
+        if key in self.unusable:
+            return True
+        match = next((formatBreakageRegex.search(line) for line in runner.lines if formatBreakageRegex.search(line)), None)
+        if match is None:
+            return False
+        self.unusable[key] = f"a compilation with the format failed ({match.group(0)})"
+        print(f"The preamble format of {self.texFile.name} doesn't work, going back to paused runners: {match.group(0)}")
+        with contextlib.suppress(OSError):
+            runner.formatFile.unlink()
+        return True
+
+    def status(self) -> Dict[str, object]:
+        """ For /status: the requested strategy, and why the runners pause if it is 'format' """
+        return {'strategy': self.requestedStrategy(), 'fallbackReason': self.reason or None, 'formatBuildSeconds': self.buildTime}
+
+def formatDirectory() -> Path:
+    return (Path(BUILD_CACHE_DIRECTORY) if BUILD_CACHE_DIRECTORY else defaultBuildCacheDirectory()) / 'formats'
+#endregion
+
+#region Batch builds
+def readBatchState(outputDirectory: Path) -> Dict[str, Dict[str, object]]:
+    try:
+        return json.loads((outputDirectory / BATCH_STATE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def batchMainFiles(root: Path) -> List[Path]:
+    """ The main files of all projects in root (see projectMainFile) """
+    mainFiles = []
+    for projectDirectory in automate.projectDirectories(root):
+        mainFile = projectMainFile(root, projectDirectory / projectDirectory.name)
+        if mainFile is not None:
+            mainFiles.append(mainFile)
+    return mainFiles
+
+async def batchBuild(root: Path, output_dir: str, force: bool = False) -> List[Dict[str, object]]:
+    """ Compile the main files of all projects in root, as many at the same time as the CPU cores and the memory budget allow.
+    A document is skipped if its recorded inputs (see recordedInputsHash) are the same as at its last successful batch build
+    and its PDF is still there. Returns one result per document. """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max(1, min(scheduler.parallelCompiles, scheduler.capacity)))
+
+    async def build(texFile: Path) -> Dict[str, object]:
+        outputDirectory = texFile.parent / output_dir
+        result: Dict[str, object] = {'document': str(texFile), 'status': 'skipped', 'seconds': 0.0}
+        async with slots:
+            if GENERATE_INPUTS:
+                generator = automate.generatorForMainFile(texFile)
+                if generator is not None:
+                    await loop.run_in_executor(None, generator.update)
+            inputsHash = await loop.run_in_executor(None, recordedInputsHash, texFile, outputDirectory)
+            last = readBatchState(outputDirectory).get(texFile.stem, {})
+            if not force and inputsHash is not None and last.get('inputsHash') == inputsHash and (outputDirectory / (texFile.stem + '.pdf')).exists():
+                print(f"Skipping {texFile}, its inputs didn't change since its last build.")
+                return result
+            startTime = time.time()
+            watcher = getWatcher(texFile, output_dir)
+            if isinstance(watcher, str):
+                result.update(status='failed', message=watcher)
+                return result
+            watcher.completionTimeout = BATCH_COMPILE_TIMEOUT
+            watcher.minPoolSize = watcher.maxPoolSize = 0 # no spare runners, every pass starts the one it uses
+            try:
+                await watcher.execute(waitForCompletion=True, fullLog=False)
+            finally:
+                scheduler.watchers.pop(watcherKey(texFile), None)
+                await watcher.close()
+            status = watcher.lastStatus
+            succeeded = status.get('status') == 'finished' and status.get('errorState') == ErrorStates.NONE.name
+            result.update(
+                status='built' if succeeded else 'failed', seconds=time.time() - startTime, errorState=status.get('errorState'),
+                passes=status.get('passes'), pages=status.get('pages'), counts=status.get('counts'), cached=status.get('cached', False), log=watcher.lastLogFile and str(watcher.lastLogFile),
+            )
+            if succeeded:
+                state = readBatchState(outputDirectory)
+                state[texFile.stem] = {'inputsHash': await loop.run_in_executor(None, recordedInputsHash, texFile, outputDirectory), 'time': time.time(), 'seconds': result['seconds']}
+                (outputDirectory / BATCH_STATE).write_text(json.dumps(state, indent=2), encoding='utf-8')
+            return result
+
+    async def buildSafely(texFile: Path) -> Dict[str, object]:
+        try:
+            return await build(texFile)
+        except Exception as error: # one broken project must not stop the others
+            return {'document': str(texFile), 'status': 'failed', 'seconds': 0.0, 'message': repr(error)}
+
+    try:
+        return list(await asyncio.gather(*map(buildSafely, batchMainFiles(root))))
+    finally:
+        if scheduler.sweepTask is not None:
+            scheduler.sweepTask.cancel()
+        await tempDirectories.drain() # asyncio.run shuts the executor down before cancelled tasks could finish the jobs
+
+def formatBatchReport(results: List[Dict[str, object]], seconds: float) -> str:
+    lines = [f"{'document':60} {'status':8} {'seconds':>8} {'passes':>6} {'errors':>6}"]
+    for result in sorted(results, key=lambda result: (result['status'] != 'failed', str(result['document']))):
+        counts = result.get('counts') or {}
+        errors = counts.get('error', '') if isinstance(counts, dict) else ''
+        lines.append(f"{str(result['document'])[-60:]:60} {result['status']:8} {result['seconds']:8.1f} {result.get('passes') or '':>6} {errors:>6}")
+        if result.get('message'):
+            lines.append(f"\t{result['message']}")
+    byStatus = {status: sum(1 for result in results if result['status'] == status) for status in ('built', 'skipped', 'failed')}
+    lines.append(", ".join(f"{count} {status}" for status, count in byStatus.items()) + f" in {seconds:.1f} s.")
+    return "\n".join(lines)
 #endregion
 
 #region Server setup
-def runServer(port, host: str = DEFAULT_HOST, texFile: PathOrString = '', output_dir: PathOrString = ''):
-    """ Run the server. This never returns, but raises KeyboardInterrupt to kill itself on GET request to f"http://{host}:{port}/stopServer{ROUTE_OBFUSCATION}" """
+def handOverPath(port: int) -> Path:
+    return Path(os.environ.get('XDG_RUNTIME_DIR') or '/tmp') / f"processPool-{port}-handover.json"
+
+class CodeReloader:
+    """ Reloads the server when processPool.py changed. The request that noticed the change is still served by the old code,
+    the reload happens as soon as no request is being served and no compilation is running.
+    On POSIX systems, the server replaces itself with exec: it keeps its process ID, so the WAITING runners (see Runner.handOverState)
+    stay its child processes with their pipes, and the new code adopts them (--adopt, see adoptRunners). The other runners are stopped.
+    Elsewhere, a new server is started in the background (which starts all runners from scratch). """
+
+    def __init__(self, port: int, host: str, stopServer: Callable[[], Awaitable[None]]) -> None:
+        self.port = port
+        self.host = host
+        self.stopServer = stopServer
+        self.activeRequests = 0
+        self.reloading = False
+
+    @staticmethod
+    def codeChanged() -> bool:
+        return Path(__file__).stat().st_mtime > THIS_FILE_VERSION_TIME
+
+    @contextlib.contextmanager
+    def serving(self):
+        """ Around every request """
+        self.activeRequests += 1
+        try:
+            yield
+        finally:
+            self.activeRequests -= 1
+            if not self.reloading and self.codeChanged():
+                self.reloading = True
+                asyncio.get_running_loop().create_task(self.reload())
+
+    def isIdle(self) -> bool:
+        return self.activeRequests == 0 and not any(watcher.isCompiling for watcher in scheduler.watchers.values())
+
+    async def reload(self):
+        while True:
+            while not self.isIdle():
+                await asyncio.sleep(RELOAD_IDLE_POLL_INTERVAL)
+            preparing = []
+            for watcher in scheduler.watchers.values():
+                await watcher.stopWatcher() # no new runners, a request starts the watcher again
+                preparing += [runner for runner in watcher.runners if await runner.getState() == RunnerStates.PREPARING]
+            if preparing: # they are worth handing over once they paused
+                await asyncio.wait([asyncio.ensure_future(waitForAnyEvent(runner.haltedEvent, runner.exitedEvent)) for runner in preparing], timeout=RELOAD_PREPARING_TIMEOUT)
+            if self.isIdle():
+                break
+        arguments = ['--port', str(self.port), '--host', str(self.host), '--server', *serverArguments()]
+        if sys.platform.lower().startswith("win"): # exec would start a new process, without our children
+            pid = start_myself_in_background([*arguments, '--wait', '10'])
+            print(f"The server code changed, restarting myself with PID {pid}.")
+            await self.stopServer()
+            return
+        runners = []
+        for watcher in scheduler.watchers.values():
+            for runner in itertools.chain(watcher.runners, watcher.runningRunners):
+                state = runner.handOverState() if runner.handOverInfo else None
+                if state is None:
+                    await runner.stop()
+                else:
+                    runners.append({**runner.handOverInfo, **state})
+        tempDirectories.removeAll(keep=[Path(str(runner['tempOutputDirectory'])) for runner in runners])
+        handOverFile = handOverPath(self.port)
+        handOverFile.write_text(json.dumps({'runners': runners, 'tempNumber': next(tempNumbers)}), encoding='utf-8')
+        print(f"The server code changed, reloading it and handing over {len(runners)} waiting runners.", flush=True)
+        sys.stderr.flush()
+        os.execv(sys.executable, [sys.executable, __file__, *arguments, '--adopt', str(handOverFile)])
+
+async def adoptRunners(handOverFile: Path):
+    """ Take over the runners that the server handed over before it reloaded its code (see CodeReloader) """
+    global tempNumbers
+    try:
+        handOver = json.loads(handOverFile.read_text(encoding='utf-8'))
+        handOverFile.unlink()
+    except (OSError, ValueError) as e:
+        print("Could not read the runners from before the reload:", e)
+        return
+    tempNumbers = itertools.count(handOver['tempNumber']) # the temp directories of the adopted runners keep their names
+    adopted = 0
+    for state in handOver['runners']:
+        watcher = getWatcher(state['texFile'], state['outputDir'])
+        try:
+            if isinstance(watcher, str):
+                raise OSError(watcher)
+            await watcher.startRunner(state)
+            adopted += 1
+        except (OSError, KeyError) as e:
+            print(f"Could not adopt the runner with PID {state.get('pid')}: {e}")
+            if state.get('pid') is not None:
+                with contextlib.suppress(OSError):
+                    os.kill(state['pid'], signal.SIGKILL)
+                    os.waitpid(state['pid'], 0)
+            with contextlib.suppress(OSError):
+                shutil.rmtree(state['tempOutputDirectory'], ignore_errors=True)
+    for watcher in scheduler.watchers.values():
+        await watcher.runWatcher()
+    print(f"Adopted {adopted} waiting runners from before the reload.")
+
+def runServer(port, host: str = DEFAULT_HOST, texFile: PathOrString = '', output_dir: PathOrString = '', watchRoot: PathOrString = '', compileOnSave: bool = False, watchPolling: bool = False, adopt: PathOrString = ''):
+    """ Run the server. This never returns, but raises KeyboardInterrupt to kill itself on GET request to f"http://{host}:{port}/stopServer{ROUTE_OBFUSCATION}".
+    adopt is the file with the runners of the server before a reload of its code (see CodeReloader). """
     from aiohttp import web
     from aiohttp.web_runner import GracefulExit 
 
+    def parseRequest(body: str, contentType: str, query) -> 'tuple[str, str, bool]':
+        """ JSON of the form {"texFile": ..., "outputDir": ..., "fullLog": ...} (see processPoolClient.py),
+        or from older clients text of the form 'texFile,outdir' with ?log=full for the whole log """
+        if contentType == 'application/json':
+            data = json.loads(body)
+            return str(data['texFile']), str(data.get('outputDir') or 'out'), bool(data.get('fullLog', False))
+        tex_file, outdir = body.split(',')
+        return tex_file, outdir, query.get('log') == 'full'
+
     async def handle(request):
-        """ the request must come as text of the form 'texFile,outdir' """
-        tex_file, outdir = (await request.text()).split(',')
-        if Path(__file__).stat().st_mtime > THIS_FILE_VERSION_TIME:
-            pid = start_myself_in_background( ['--port', str(port), '--host', str(host), '--o', str(outdir), '--server', '--f', str(tex_file), '--wait', '10' ] )
-            print(f"Restarting myself with PID {pid}.")
-            asyncio.create_task( handleStopServer(request) )
-            return web.Response(text="Restarting server because of changed server code")
-            
-        return web.Response(text=await do_execute(tex_file, outdir)) 
+        """ Returns the summary of errors and warnings, or the whole log if requested (see parseRequest) """
+        tex_file, outdir, fullLog = parseRequest(await request.text(), request.content_type, request.query)
+        with reloader.serving():
+            response = await compileAndRespond(tex_file, outdir, fullLog)
+            await response.prepare(request) # sent completely before the server may reload
+            await response.write_eof()
+            return response
+
+    async def compileAndRespond(tex_file: str, outdir: str, fullLog: bool):
+        if not fullLog:
+            return web.Response(text=await do_execute(tex_file, outdir, fullLog=False))
+
+        watcher = getWatcher(tex_file, outdir)
+        if isinstance(watcher, str):
+            return web.Response(text=watcher)
+        log = await watcher.execute(waitForCompletion=True, fullLog=False)
+        if watcher.lastLogFile is not None and watcher.lastLogFile.exists():
+            return web.FileResponse(watcher.lastLogFile, headers={'Content-Type': 'text/plain; charset=utf-8'}) # the complete log from disk
+        return web.Response(text=log)
+
+    async def handleStream(request):
+        """ Like handle, but streams the errors and warnings (or the whole log) line by line (chunked) as they are found.
+        The last line is STATUS_LOG followed by a JSON status record. """
+        tex_file, outdir, fullLog = parseRequest(await request.text(), request.content_type, request.query)
+        response = web.StreamResponse(headers={'Content-Type': 'text/plain; charset=utf-8'})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        with reloader.serving():
+            await streamCompilation(response, tex_file, outdir, fullLog)
+            await response.write_eof()
+        return response
+
+    async def streamCompilation(response, tex_file: str, outdir: str, fullLog: bool):
+        lines: 'asyncio.Queue[str]' = asyncio.Queue()
+        compilation = asyncio.ensure_future(do_execute_streaming(tex_file, outdir, lines.put_nowait, fullLog=fullLog))
+        nextLine = asyncio.ensure_future(lines.get())
+        try:
+            while True:
+                await asyncio.wait([compilation, nextLine], return_when=asyncio.FIRST_COMPLETED)
+                if nextLine.done():
+                    await response.write((nextLine.result() + "\n").encode('utf8'))
+                    nextLine = asyncio.ensure_future(lines.get())
+                elif compilation.done():
+                    break
+            while not lines.empty():
+                await response.write((lines.get_nowait() + "\n").encode('utf8'))
+            await response.write((STATUS_LOG + json.dumps(compilation.result()) + "\n").encode('utf8'))
+        finally:
+            nextLine.cancel()
+
+    async def handleSocket(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Requests on the Unix domain socket: one JSON line per request, answered like by handleStream """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tex_file, outdir, fullLog = parseRequest(line.decode('utf8'), 'application/json', {})
+                with reloader.serving():
+                    status = await do_execute_streaming(tex_file, outdir, lambda text: writer.write((text + "\n").encode('utf8')), fullLog=fullLog)
+                    writer.write((STATUS_LOG + json.dumps(status) + "\n").encode('utf8'))
+                    await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            print("Bad request or closed connection on the socket:", e)
+        finally:
+            writer.close()
+
+    async def handleMetrics(request):
+        """ Runner counts, finish results, pool hit rates, memory and timing histograms in the text format of Prometheus """
+        return web.Response(text=prometheusText(await collectStatus()), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handleStatus(request):
+        """ The same as /metrics, as JSON """
+        return web.json_response(await collectStatus())
 
     async def handleStopServer(request): 
         try:
@@ -522,16 +3107,38 @@ def runServer(port, host: str = DEFAULT_HOST, texFile: PathOrString = '', output
             print("Closed by call to \\stopServer---")
             exit()
 
+    reloader = CodeReloader(port, host, stopServer=lambda: handleStopServer(None))
+
     async def startup():
+        if adopt != '':
+            await adoptRunners(Path(adopt))
         if texFile != '':
             asyncio.get_event_loop().create_task(
                 do_execute(texFile=texFile, output_dir=output_dir) # wrapped in this startup stuff because we only have async from web.run_app
             )
+        if watchRoot != '':
+            ProjectWatcher(watchRoot, output_dir or "out", compileOnSave=compileOnSave, polling=watchPolling).start()
             
         app = web.Application()
+        path = socketPath(port)
+        if path is not None:
+            socketServer = await asyncio.start_unix_server(handleSocket, path=path)
+            os.chmod(path, 0o600)
+            print("Listening on", path)
+            async def closeSocket(app):
+                socketServer.close()
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+            app.on_cleanup.append(closeSocket)
+        async def removeTempDirectories(app):
+            tempDirectories.removeAll()
+        app.on_cleanup.append(removeTempDirectories)
         app.add_routes([
             web.post(f'/{ROUTE_OBFUSCATION}', handle),
-            web.get(f'/stopServer{ROUTE_OBFUSCATION}', handleStopServer)
+            web.post(f'/stream{ROUTE_OBFUSCATION}', handleStream),
+            web.get(f'/stopServer{ROUTE_OBFUSCATION}', handleStopServer),
+            web.get('/metrics', handleMetrics),
+            web.get('/status', handleStatus),
         ])
         return app
 
@@ -542,6 +3149,23 @@ def portIsFree(port, host: str = DEFAULT_HOST):
         return testSocket.connect_ex((host, port)) != 0
 #endregion
 
+def serverArguments() -> List[str]:
+    """ The pool and backend options of this instance, to be passed on to a server started in the background """
+    return [
+        '--backend', BACKEND,
+        '--min-runners', str(ProcessWatcher.minPoolSize), '--max-runners', str(ProcessWatcher.maxPoolSize),
+        '--memory-budget', str(RunnerScheduler.memoryBudgetMB), '--max-total-runners', str(RunnerScheduler.maxTotalRunners),
+        '--watcher-idle-timeout', str(RunnerScheduler.idleTimeout),
+        '--max-parallel-compiles', str(RunnerScheduler.maxParallelCompiles),
+        *(['--watch-root', WATCH_ROOT, '--compile-on-save' if COMPILE_ON_SAVE else '--no-compile-on-save'] if WATCH_ROOT else []),
+        *(['--watch-polling'] if WATCH_POLLING else []),
+        *(['--generate-inputs'] if GENERATE_INPUTS else []),
+        '--warm-start', WARM_START,
+        '--build-cache-size', str(BUILD_CACHE_MAX_MB), *(['--build-cache-dir', BUILD_CACHE_DIRECTORY] if BUILD_CACHE_DIRECTORY else []),
+        '--debounce', str(ProcessWatcher.debounce), '--cancel-stale' if ProcessWatcher.cancelStale else '--no-cancel-stale',
+        '--max-passes', str(ProcessWatcher.maxPasses)
+    ]
+
 def start_myself_in_background(args: List[str]) -> int:
     # does not work, as the program still ends when this instance ends (which it does immediately)
     """ Argument "names" should begin with double dash: single dash arguments are interpreted as options to python (sys.executable) """
@@ -563,15 +3187,69 @@ def start_myself_in_background(args: List[str]) -> int:
 @click.option("--start-server-on-demand/--no-server", "--s,--c", "-s/-c", default=True, help="Start a server in a background process if the port is still free. Enabled by default.")
 @click.option("--server", is_flag=True, help="Run the server right here. This script will not end by itself.")
 @click.option("--stop-server", is_flag=True, help="Stop the already running server by sending a request. Continue as normal after 1 s.")
-@click.option("--print-command", "-c", "--c", "--command", "--pc", "-pc", is_flag=True, help="Only show the powershell command and quit.")
+@click.option("--print-command", "-c", "--c", "--command", "--pc", "-pc", is_flag=True, help="Only show the command (line) of the selected backend and quit.")
+@click.option("--backend", type=click.Choice(list(runnerBackends)), default=BACKEND, help="How runners execute the LaTeX pipeline: " + ", ".join(f"'{name}' {backend.description}" for name, backend in runnerBackends.items()) + f". Default = {BACKEND}.")
 @click.option("--verbose", "-v", "--v", is_flag=True, help="Show the complete output of the child processes.")
+@click.option("--full-log", "-l", is_flag=True, help="Print the complete LaTeX log instead of only the errors and warnings.")
 @click.option("--wait", "-w", "--w", default = 0, help="Wait for the specified amount of seconds before starting.")
-def main(tex_file, output_dir, port, host, start_server_on_demand, server, stop_server, print_command, verbose, wait):
+@click.option("--min-runners", default=POOL_MIN_SIZE, help=f"Minimum number of warm runners per document, default = {POOL_MIN_SIZE}. The pool size adapts to the preamble time and the request rate.")
+@click.option("--max-runners", default=POOL_MAX_SIZE, help=f"Maximum number of warm runners per document, default = {POOL_MAX_SIZE}.")
+@click.option("--memory-budget", default=POOL_MEMORY_BUDGET_MB, help=f"Memory in MB for the runners of all documents together (estimated with {RUNNER_MEMORY_ESTIMATE_MB} MB per runner), default = {POOL_MEMORY_BUDGET_MB}.")
+@click.option("--max-total-runners", default=MAX_TOTAL_RUNNERS, help="Maximum number of live runners of all documents together. When it is reached, idle runners of the least recently used documents are stopped. Default = 0 (only limited by --memory-budget).")
+@click.option("--watcher-idle-timeout", default=WATCHER_IDLE_TIMEOUT, help=f"Seconds without a request after which all runners of a document are stopped, default = {WATCHER_IDLE_TIMEOUT}.")
+@click.option("--max-parallel-compiles", default=MAX_PARALLEL_COMPILES, help="Maximum number of compilations (of different documents) that run at the same time. Default = 0 (one per CPU core).")
+@click.option("--watch-root", "--root", "-b", default="", help="Watch this directory of projects (the base directory of automate.ps1) and warm up the runners of a project as soon as one of its files changes.")
+@click.option("--compile-on-save/--no-compile-on-save", default=False, help="With --watch-root: also compile a project when one of its files is saved, without a request from the editor.")
+@click.option("--watch-polling", is_flag=True, help="With --watch-root: poll for changes instead of using inotify.")
+@click.option("--debounce", default=COMPILE_DEBOUNCE, help="Seconds to wait for further requests before a queued compilation starts. Requests for a document that arrive during a compilation share one queued compilation. Default = 0.")
+@click.option("--cancel-stale/--no-cancel-stale", default=False, help="Stop a running compilation when a newer request for the same document arrives. Disabled by default.")
+@click.option("--batch", default="", help="Compile the main files of all projects in this directory (the base directory of automate.ps1) in parallel and exit. Documents whose inputs didn't change since their last --batch build are skipped.")
+@click.option("--force", is_flag=True, help="With --batch: also compile the documents whose inputs didn't change.")
+@click.option("--report", default="", help="With --batch: write the results as JSON to this file, default = <directory>/processPool-batch-report.json.")
+@click.option("--generate-inputs", is_flag=True, help="Update <project>_generated.tex (like automate.ps1, see automate.py) before every compilation of a project's main file.")
+@click.option("--build-cache-size", default=BUILD_CACHE_MAX_MB, help=f"Size in MB of the build cache on disk, which keeps the output files of successful builds and serves a request whose inputs (content of the files in the folder of the document, size and mtime of the others) match an earlier build without running LaTeX. The least recently used builds are deleted first. 0 = no build cache. Default = {BUILD_CACHE_MAX_MB}, e.g. 1000 switches it on.")
+@click.option("--build-cache-dir", default=BUILD_CACHE_DIRECTORY, help="Directory of the build cache. Default: processPool in the cache directory of the user (%LOCALAPPDATA%, $XDG_CACHE_HOME or ~/.cache).")
+@click.option("--warm-start", type=click.Choice(WARM_START_STRATEGIES), default=WARM_START, help="How the runners skip the preamble: 'pause' LaTeX at \\pauseExecution, or 'format': dump the preamble once into a format (.fmt, kept next to the build cache) and start lualatex from it. Preambles that can't be dumped (fontspec, ...) pause anyway. A line '% !processPool warm-start = format' (or pause) in the main file overrides this per document. /status and /metrics show the latency of both. Default = " + WARM_START + ".")
+@click.option("--adopt", default="", hidden=True, help="Internal: take over the runners in this file, which the server wrote before it reloaded its code.")
+@click.option("--max-passes", default=MAX_COMPILE_PASSES, help=f"Maximum number of LaTeX passes per request. Further passes run (with warm runners) while LaTeX asks for a rerun or the .aux, .idx or .bcf file changed. Default = {MAX_COMPILE_PASSES}, 1 = a single pass.")
+def main(tex_file, output_dir, port, host, start_server_on_demand, server, stop_server, print_command, backend, verbose, full_log, wait, min_runners, max_runners, memory_budget, max_total_runners, watcher_idle_timeout, max_parallel_compiles, watch_root, compile_on_save, watch_polling, debounce, cancel_stale, batch, force, report, generate_inputs, build_cache_size, build_cache_dir, warm_start, adopt, max_passes):
+    global VERBOSE, BACKEND, WATCH_ROOT, COMPILE_ON_SAVE, WATCH_POLLING, GENERATE_INPUTS, BUILD_CACHE_DIRECTORY, BUILD_CACHE_MAX_MB, WARM_START, buildCache
+    BACKEND = backend
+    WARM_START = warm_start
+    GENERATE_INPUTS = generate_inputs
+    BUILD_CACHE_DIRECTORY, BUILD_CACHE_MAX_MB = str(Path(build_cache_dir).resolve()) if build_cache_dir else "", build_cache_size
+    buildCache = BuildCache(Path(BUILD_CACHE_DIRECTORY) if BUILD_CACHE_DIRECTORY else defaultBuildCacheDirectory(), BUILD_CACHE_MAX_MB * 1024 * 1024) if BUILD_CACHE_MAX_MB > 0 else None
+    WATCH_ROOT, COMPILE_ON_SAVE, WATCH_POLLING = str(Path(watch_root).resolve()) if watch_root else "", compile_on_save, watch_polling
     if print_command:
-        print(getPowershellCommand(None, output_dir, tex_file))
+        texFile = Path(tex_file).with_suffix('.tex')
+        outputDirectory = texFile.parent / output_dir
+        spec = RunnerSpec(texFile, outputDirectory, getTempOutputDirectory(outputDirectory), list(PREPROCESSING_TOOLS), timeoutFunction=lambda _: False)
+        print(*runnerBackends[BACKEND].commandLines(spec), sep='\n')
         return
-    global VERBOSE
     VERBOSE = verbose
+    ProcessWatcher.minPoolSize = min_runners
+    ProcessWatcher.maxPoolSize = max_runners
+    ProcessWatcher.debounce = debounce
+    ProcessWatcher.cancelStale = cancel_stale
+    ProcessWatcher.maxPasses = max_passes
+    RunnerScheduler.memoryBudgetMB = memory_budget
+    RunnerScheduler.maxTotalRunners = max_total_runners
+    RunnerScheduler.idleTimeout = watcher_idle_timeout
+    RunnerScheduler.maxParallelCompiles = max_parallel_compiles
+    if batch:
+        root = Path(batch).resolve()
+        startTime = time.time()
+        try:
+            results = asyncio.run(batchBuild(root, output_dir, force))
+        finally:
+            tempDirectories.removeAll()
+        print(formatBatchReport(results, time.time() - startTime))
+        reportFile = Path(report) if report else root / "processPool-batch-report.json"
+        reportFile.write_text(json.dumps({'root': str(root), 'time': time.time(), 'seconds': time.time() - startTime, 'documents': results}, indent=2), encoding='utf-8')
+        print("Report written to", reportFile)
+        if any(result['status'] == 'failed' for result in results):
+            sys.exit(1)
+        return
     time.sleep(wait)
     portFree = portIsFree(port, host)
     if stop_server and not portFree:
@@ -592,7 +3270,7 @@ def main(tex_file, output_dir, port, host, start_server_on_demand, server, stop_
 
     if server:
         if portFree:
-            runServer(port=port, host=host, texFile=tex_file, output_dir=output_dir)
+            runServer(port=port, host=host, texFile=tex_file, output_dir=output_dir, watchRoot=watch_root, compileOnSave=compile_on_save, watchPolling=watch_polling, adopt=adopt)
         else:
             print("COULDN'T START THE SERVER, BECAUSE THE PORT IS NOT FREE. IS THERE ANOTHER SERVER RUNNING? KILL IT BY RUNNING THIS AGAIN WITH THE --stop-server FLAG.")
         return
@@ -600,28 +3278,31 @@ def main(tex_file, output_dir, port, host, start_server_on_demand, server, stop_
     if tex_file != '' and start_server_on_demand and portFree:
         # command_args = [sys.executable, '"'+__file__+'"', f'--p {port}', f'--o {output_dir}', '--server', f'--f {tex_file}' ]
         # pid = os.spawnl(os.P_NOWAIT, *command_args)
-        command_args = [ '--port', str(port), '--host', str(host), '--o', str(output_dir), '--server', '--f', str(tex_file) ]
+        command_args = [ '--port', str(port), '--host', str(host), '--o', str(output_dir), '--server', '--f', str(tex_file), *serverArguments() ]
         pid = start_myself_in_background(command_args)
         print("STARTED SERVER (BACKGROUND WORKER) WITH PID", pid, "using command ", *command_args)
         print("STOP IT BY CALLING THIS AGAIN WITH THE --stop-server FLAG.")
         print("Your compilation will be done, but you won't see the logs here.")
     if tex_file != '' and not portFree:
         print("Sending request to server (background worker)")
-        sendData = (str(tex_file) + ',' + str(output_dir) ).encode('utf8')
-        
         try:
-            requestResult = requests.post(f"http://{host}:{port}/{ROUTE_OBFUSCATION}", data=sendData, timeout=SIMPLE_BACKGROUND_CALL_TIMEOUT)
-        except requests.exceptions.Timeout:
+            try:
+                status = compileRemotely(tex_file, output_dir, port, host, full_log, onLine=lambda line: print(line, flush=True))
+            except UnexpectedAnswer: # an older server without the JSON requests, which will restart itself on this request
+                query = {'log': 'full'} if full_log else {}
+                sendData = (str(tex_file) + ',' + str(output_dir) ).encode('utf8')
+                requestResult = requests.post(f"http://{host}:{port}/{ROUTE_OBFUSCATION}", params=query, data=sendData, timeout=SIMPLE_BACKGROUND_CALL_TIMEOUT)
+                print(requestResult.content.decode('utf8'))
+                print("Server finished.")
+                return
+            if status is not None:
+                printStatus(status)
+        except (socket.timeout, requests.exceptions.Timeout):
             print(f"The server did not respond within {SIMPLE_BACKGROUND_CALL_TIMEOUT} seconds timeout.")
             return
-        except ConnectionResetError:
+        except (OSError, requests.exceptions.ConnectionError):
             print("The server closed the connection unexpectedly (possibly because it was restarted).")
             return
-        else:
-            content = requestResult.content
-            text = content.decode('utf8')
-            print(text)
-            print("Server finished.")
 
 
 
@@ -0,0 +1,428 @@
+""" Benchmarks for processPool.py. They use the server internals in-process (no HTTP), so they measure the pool and not the network.
+Run python processPoolBenchmark.py --help for the available benchmarks. With --fake, fakeLualatex.py stands in for lualatex, xindex and biber. """
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+
+import processPool
+
+WARM_UP_TIMEOUT = 120 # seconds to wait for the runners of all documents to reach \pauseExecution
+SERVER_START_TIMEOUT = 30
+serverSecondsRegex = re.compile(r"Server finished: .* after ([0-9.]+) s\.")
+SYNTHETIC_PACKAGES = (
+    'amsmath', 'amssymb', 'graphicx', 'xcolor', 'geometry', 'hyperref', 'booktabs', 'microtype',
+    'mathtools', 'enumitem', 'caption', 'siunitx', 'tikz', 'listings', 'csquotes', 'cleveref'
+)
+SYNTHETIC_FONTS = ('TeX Gyre Pagella', 'TeX Gyre Heros', 'TeX Gyre Cursor', 'Latin Modern Roman', 'TeX Gyre Termes')
+DOCUMENT_VARIANTS = { # name -> (packages, fonts, paragraphs)
+    'light': (2, 0, 10),
+    'medium': (8, 1, 100),
+    'heavy': (16, 3, 400),
+}
+# \pauseExecution for lualatex, without spelling out its name before the actual pause: a format skips the preamble only up to the first one (see FORMAT_DUMP_SUFFIX)
+PAUSE_DEFINITION = r"""\directlua{
+  function processPoolPause()
+    if os.getenv("LATEX_ALLOW_PAUSE_EXECUTION") == "true" then
+      print("PAUSED EXECUTION!") io.stdout:flush() io.read()
+    end
+  end}
+\expandafter\def\csname pauseExecution\endcsname{\directlua{processPoolPause()}}
+"""
+PARAGRAPH = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. "
+    "Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. "
+    "Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur $e^{i\\pi} + 1 = 0$.\n\n"
+)
+importTimeRegex = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \| (\s*)(\S+)$")
+
+async def waitUntilWarm(timeout: float = WARM_UP_TIMEOUT):
+    """ Wait until every available runner of every watcher has paused in its preamble (or finished) """
+    deadline = time.time() + timeout
+    for watcher in processPool.scheduler.watchers.values():
+        for runner in list(watcher.runners):
+            try:
+                await asyncio.wait_for(processPool.waitForAnyEvent(runner.haltedEvent, runner.exitedEvent), max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                print("Runners did not get warm in time, measuring anyway.")
+                return
+
+async def compileAll(texFiles: List[Path], outputDir: str) -> List[float]:
+    """ Compile all documents at the same time. Returns the latency of every document. """
+    async def compileOne(texFile: Path) -> float:
+        start = time.time()
+        await processPool.do_execute(texFile, outputDir, fullLog=False)
+        return time.time() - start
+    return list(await asyncio.gather(*(compileOne(texFile) for texFile in texFiles)))
+
+def copyDocument(texFile: Path, outputDir: str, count: int, target: Path) -> List[Path]:
+    """ count copies of the directory of texFile (without its output directory) below target """
+    ignore = shutil.ignore_patterns(Path(outputDir).name)
+    copies = []
+    for i in range(count):
+        directory = target / f"document{i}"
+        shutil.copytree(texFile.parent, directory, ignore=ignore)
+        copies.append(directory / texFile.name)
+    return copies
+
+async def parallelRun(texFiles: List[Path], outputDir: str, rounds: int, parallelCompiles: int) -> Dict[str, float]:
+    processPool.RunnerScheduler.maxParallelCompiles = parallelCompiles
+    processPool.scheduler = processPool.RunnerScheduler()
+    try:
+        await compileAll(texFiles, outputDir) # cold: starts the watchers and their runners
+        await waitUntilWarm()
+        latencies: List[float] = []
+        wallTime = 0.0
+        for _ in range(rounds):
+            start = time.time()
+            latencies += await compileAll(texFiles, outputDir)
+            wallTime += time.time() - start
+            await waitUntilWarm()
+    finally:
+        for watcher in processPool.scheduler.watchers.values():
+            await watcher.close()
+        if processPool.scheduler.sweepTask is not None:
+            processPool.scheduler.sweepTask.cancel()
+    return {
+        'documents': len(texFiles),
+        'parallelCompiles': processPool.scheduler.parallelCompiles,
+        'throughput': len(latencies) / wallTime,
+        'meanLatency': sum(latencies) / len(latencies),
+        'maxLatency': max(latencies),
+    }
+
+def syntheticDocument(directory: Path, packages: int, fonts: int, paragraphs: int) -> Path:
+    """ Write directory/main.tex with the given preamble weight and body size """
+    directory.mkdir(parents=True, exist_ok=True)
+    lines = ["\\documentclass{article}", *(f"\\usepackage{{{package}}}" for package in SYNTHETIC_PACKAGES[:packages])]
+    if fonts:
+        lines.append("\\usepackage{fontspec}")
+        commands = ["\\setmainfont", "\\setsansfont", "\\setmonofont"] + [f"\\newfontfamily\\fontNumber{chr(ord('A') + i)}" for i in range(len(SYNTHETIC_FONTS))]
+        lines += [f"{command}{{{SYNTHETIC_FONTS[i % len(SYNTHETIC_FONTS)]}}}" for i, command in zip(range(fonts), commands)]
+    lines += [PAUSE_DEFINITION, "\\pauseExecution", "\\begin{document}"]
+    for i in range(paragraphs):
+        if i % 5 == 0:
+            lines.append(f"\\section{{Section {i // 5 + 1}}}")
+        lines.append(PARAGRAPH)
+    lines.append("\\end{document}")
+    texFile = directory / 'main.tex'
+    texFile.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return texFile
+
+def useFakeLualatex(binDirectory: Path):
+    """ Put wrappers of fakeLualatex.py named lualatex, xindex and biber first on the PATH (of this process and its children) """
+    script = Path(__file__).resolve().parent / 'fakeLualatex.py'
+    binDirectory.mkdir(parents=True, exist_ok=True)
+    for name, arguments in (('lualatex', ''), ('xindex', '--tool xindex '), ('biber', '--tool biber ')):
+        if sys.platform.lower().startswith("win"):
+            (binDirectory / f"{name}.cmd").write_text(f'@"{sys.executable}" "{script}" {arguments}%*\r\n')
+        else:
+            wrapper = binDirectory / name
+            wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {arguments}"$@"\n')
+            wrapper.chmod(0o755)
+    os.environ['PATH'] = str(binDirectory) + os.pathsep + os.environ['PATH']
+
+@click.group()
+@click.option("--fake", is_flag=True, help="Use fakeLualatex.py instead of lualatex, xindex and biber.")
+def cli(fake):
+    if fake:
+        useFakeLualatex(Path(tempfile.mkdtemp(prefix="processPoolFakeBin")))
+
+@cli.command()
+@click.option("--tex-file", "--file", "-f", required=True, help="The document to compile. Its directory is copied once per simulated document.")
+@click.option("--output-dir", "-o", default="out", help="Path for LaTeX output, relative to the tex file.")
+@click.option("--documents", "-n", default="1,2,4,8", help="Comma separated numbers of documents that are compiled at the same time, default = 1,2,4,8.")
+@click.option("--rounds", "-r", default=3, help="Warm compilations of every document per measurement, default = 3.")
+@click.option("--limits", default="1,0", help="Comma separated values of --max-parallel-compiles to compare, default = 1,0 (one at a time vs. one per CPU core).")
+def parallel(tex_file, output_dir, documents, rounds, limits):
+    """ Throughput of warm compilations when N documents are saved at the same time """
+    texFile = Path(tex_file).with_suffix('.tex').resolve()
+    with tempfile.TemporaryDirectory(prefix="processPoolBenchmark") as target:
+        results = []
+        for count in (int(n) for n in documents.split(',')):
+            texFiles = copyDocument(texFile, output_dir, count, Path(target) / str(count))
+            for limit in (int(l) for l in limits.split(',')):
+                result = asyncio.run(parallelRun(texFiles, output_dir, rounds, limit))
+                results.append(result)
+                print(f"{result['documents']} documents, {result['parallelCompiles']} parallel: {result['throughput']:.2f} documents/s, "
+                      f"latency {result['meanLatency']:.2f} s mean, {result['maxLatency']:.2f} s max")
+    print("documents | parallel | documents/s | mean latency | max latency")
+    for result in results:
+        print(f"{result['documents']:9} | {result['parallelCompiles']:8} | {result['throughput']:11.2f} | {result['meanLatency']:12.2f} | {result['maxLatency']:11.2f}")
+
+def clientOverhead(command: List[str], repetitions: int) -> List[float]:
+    """ Wall time of the client process minus the compile time reported by the server, for every repetition after a warm-up call """
+    overheads = []
+    for _ in range(repetitions + 1):
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        wallTime = time.perf_counter() - start
+        match = serverSecondsRegex.search(result.stdout)
+        if match is None:
+            raise click.ClickException(f"No status in the output of {' '.join(command)}:\n{result.stdout}{result.stderr}")
+        overheads.append(wallTime - float(match.group(1)))
+    return overheads[1:]
+
+@cli.command()
+@click.option("--tex-file", "--file", "-f", required=True, help="The document to compile.")
+@click.option("--output-dir", "-o", default="out", help="Path for LaTeX output, relative to the tex file.")
+@click.option("--port", "-p", default=processPool.DEFAULT_PORT + 1, help="Port for the server started by this benchmark.")
+@click.option("--repetitions", "-r", default=5, help="Requests per client, default = 5.")
+def client(tex_file, output_dir, port, repetitions):
+    """ Client-side overhead of a request (including the Python startup) of processPoolClient.py and of processPool.py """
+    here = Path(__file__).resolve().parent
+    server = subprocess.Popen([sys.executable, str(here / 'processPool.py'), '--server', '--port', str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while processPool.portIsFree(port):
+            if time.time() > deadline or server.poll() is not None:
+                raise click.ClickException("The server did not start.")
+            time.sleep(0.1)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        print(f"{'python -c pass':22}: {1000 * (time.perf_counter() - start):6.1f} ms")
+        for script in ('processPoolClient.py', 'processPool.py'):
+            overheads = clientOverhead([sys.executable, str(here / script), '-f', tex_file, '-o', output_dir, '-p', str(port)], repetitions)
+            print(f"{script:22}: {1000 * sum(overheads) / len(overheads):6.1f} ms mean, {1000 * min(overheads):6.1f} ms min")
+    finally:
+        server.terminate()
+        server.wait()
+
+def importTimes(module: str, directory: Path) -> 'tuple[int, List[tuple[int, str]]]':
+    """ Cumulative import time of module in microseconds, and the self time of every module it imported (python -X importtime) """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=directory, capture_output=True, text=True)
+    times: List[tuple[int, str]] = []
+    for line in result.stderr.splitlines():
+        match = importTimeRegex.match(line)
+        if match is None:
+            continue
+        selfTime, cumulative, indentation, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        if not indentation and name != module: # imported by the interpreter (site), not by module
+            times = []
+            continue
+        times.append((selfTime, name))
+        if name == module and not indentation:
+            return cumulative, times
+    raise click.ClickException(f"Cannot import {module}:\n{result.stderr}")
+
+@cli.command()
+@click.option("--repetitions", "-r", default=5, help="Runs per command, the fastest counts. Default = 5.")
+@click.option("--top", default=10, help="Number of the slowest imports to show, default = 10.")
+def startup(repetitions, top):
+    """ Import time of processPool.py and wall time of its code paths that don't need the server """
+    here = Path(__file__).resolve().parent
+    for module in ('processPool', 'processPoolClient'):
+        total, times = importTimes(module, here)
+        print(f"import {module}: {total / 1000:.1f} ms, slowest imports:")
+        for selfTime, name in sorted(times, reverse=True)[:top]:
+            print(f"\t{selfTime / 1000:6.1f} ms {name}")
+    commands = {
+        'python -c pass': ['-c', 'pass'],
+        'processPoolClient.py --help': [str(here / 'processPoolClient.py'), '--help'],
+        'processPool.py --help': [str(here / 'processPool.py'), '--help'],
+        'processPool.py --print-command': [str(here / 'processPool.py'), '--print-command', '-f', 'document.tex'],
+    }
+    for name, arguments in commands.items():
+        wallTimes = []
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *arguments], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wallTimes.append(time.perf_counter() - start)
+        print(f"{name:32}: {1000 * min(wallTimes):6.1f} ms")
+
+def coldCompile(texFile: Path, outputDir: str, formatFile: Optional[Path] = None) -> float:
+    """ Wall time of lualatex alone, without pausing (started from formatFile if given) """
+    pipeline = processPool.LatexPipeline(texFile.parent / outputDir / 'cold', texFile.parent / outputDir, texFile, tools=[], formatFile=formatFile)
+    environment = {key: value for key, value in os.environ.items() if key != 'LATEX_ALLOW_PAUSE_EXECUTION'}
+    start = time.perf_counter()
+    subprocess.run(pipeline.latexCommand(), cwd=texFile.parent, env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {'mean': sum(values) / len(values), 'min': values[0], 'median': values[len(values) // 2], 'max': values[-1]} if values else {}
+
+async def formatRun(texFile: Path, outputDir: str, repetitions: int, cold: Dict[str, float]) -> Dict[str, object]:
+    """ The 'format' warm-start strategy: build the preamble format once, then every compilation starts lualatex from it """
+    preambleFormat = processPool.PreambleFormat(texFile, processPool.PreambleTracker(texFile, texFile.parent / outputDir), texFile.parent / 'formats')
+    strategy, processPool.WARM_START = processPool.WARM_START, 'format'
+    try:
+        formatFile = await preambleFormat.ready()
+    finally:
+        processPool.WARM_START = strategy # the pool of suiteRun pauses
+    if formatFile is None:
+        return {'unavailable': preambleFormat.reason}
+    loop = asyncio.get_running_loop()
+    compiles = [await loop.run_in_executor(None, coldCompile, texFile, outputDir, formatFile) for _ in range(repetitions)]
+    return {'buildSeconds': preambleFormat.buildTime, 'compileSeconds': summary(compiles), 'speedup': cold['median'] / summary(compiles)['median']}
+
+async def suiteRun(texFile: Path, outputDir: str, repetitions: int, saves: int, saveInterval: float) -> Dict[str, object]:
+    processPool.scheduler = processPool.RunnerScheduler()
+    processPool.metrics = processPool.Metrics()
+    loop = asyncio.get_running_loop()
+    try:
+        cold = [await loop.run_in_executor(None, coldCompile, texFile, outputDir) for _ in range(repetitions)]
+        formatResult = await formatRun(texFile, outputDir, repetitions, summary(cold))
+
+        await compileAll([texFile], outputDir) # starts the pool
+        await waitUntilWarm()
+        watcher = processPool.scheduler.get(processPool.watcherKey(texFile))
+        assert watcher is not None
+        memory = [processPool.processTreeRSS(runner.pid) for runner in watcher.runners if isinstance(runner, processPool.LatexRunner)]
+        warm = []
+        for _ in range(repetitions):
+            warm += await compileAll([texFile], outputDir)
+            await waitUntilWarm()
+
+        compilationsBefore = sum(watcher.servedBy.values())
+        async def save(delay: float) -> float:
+            await asyncio.sleep(delay)
+            return (await compileAll([texFile], outputDir))[0]
+        start = time.perf_counter()
+        saveLatencies = await asyncio.gather(*(save(i * saveInterval) for i in range(saves)))
+        savesTime = time.perf_counter() - start
+        await waitUntilWarm()
+    finally:
+        for watcher in processPool.scheduler.watchers.values():
+            await watcher.close()
+        if processPool.scheduler.sweepTask is not None:
+            processPool.scheduler.sweepTask.cancel()
+
+    stages: Dict[str, List[float]] = {}
+    for (name, labels), histogram in processPool.metrics.histograms.items():
+        stage = dict(labels).get('stage', name)
+        stages.setdefault(stage, [0, 0.0])
+        stages[stage][0] += histogram.count
+        stages[stage][1] += histogram.sum
+    return {
+        'coldSeconds': summary(cold),
+        'warmSeconds': summary(warm),
+        'speedup': summary(cold)['median'] / summary(warm)['median'],
+        'format': formatResult,
+        'runnerMemoryBytes': summary([rss for rss in memory if rss is not None]),
+        'repeatedSaves': {
+            'saves': saves, 'interval': saveInterval, 'seconds': savesTime,
+            'compilations': sum(watcher.servedBy.values()) - compilationsBefore,
+            'latencySeconds': summary(list(saveLatencies)),
+        },
+        'stageSeconds': {stage: total / count for stage, (count, total) in stages.items() if count},
+    }
+
+def gitCommit() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+@cli.command()
+@click.option("--variants", default=",".join(DOCUMENT_VARIANTS), help=f"Comma separated synthetic documents to measure, of {', '.join(DOCUMENT_VARIANTS)}.")
+@click.option("--repetitions", "-r", default=3, help="Cold and warm compilations per document, default = 3.")
+@click.option("--saves", default=5, help="Number of saves in the repeated saves measurement, default = 5.")
+@click.option("--save-interval", default=0.2, help="Seconds between those saves, default = 0.2.")
+@click.option("--output", "-o", default="benchmark-results.json", help="JSON file for the results, default = benchmark-results.json.")
+def suite(variants, repetitions, saves, save_interval, output):
+    """ Cold lualatex vs. warm runner vs. preamble format latency, repeated saves, memory per runner and stage timings for synthetic documents """
+    results: Dict[str, object] = {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'lualatex': shutil.which('lualatex'),
+        'backend': processPool.BACKEND,
+        'documents': {},
+    }
+    with tempfile.TemporaryDirectory(prefix="processPoolBenchmark") as target:
+        for variant in variants.split(','):
+            packages, fonts, paragraphs = DOCUMENT_VARIANTS[variant]
+            texFile = syntheticDocument(Path(target) / variant, packages, fonts, paragraphs)
+            result = asyncio.run(suiteRun(texFile, "out", repetitions, saves, save_interval))
+            result.update({'packages': packages, 'fonts': fonts, 'paragraphs': paragraphs})
+            results['documents'][variant] = result # type: ignore[index]
+            formatResult = result['format']
+            formatText = f"unavailable ({formatResult['unavailable']})" if 'unavailable' in formatResult else f"{formatResult['compileSeconds']['median']:.2f} s (x{formatResult['speedup']:.1f})"
+            print(f"{variant}: cold {result['coldSeconds']['median']:.2f} s, warm {result['warmSeconds']['median']:.2f} s (x{result['speedup']:.1f}), format {formatText}, "
+                  f"{result['repeatedSaves']['saves']} saves -> {result['repeatedSaves']['compilations']} compilations in {result['repeatedSaves']['seconds']:.2f} s")
+    Path(output).write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print("Results written to", output)
+
+async def stressRun(documents: int, compiles: int, script: processPool.MockScript) -> Dict[str, object]:
+    """ compiles compilations, spread over documents watchers with MockRunners that compile at the same time """
+    processPool.scheduler = processPool.RunnerScheduler()
+    parallelCompiles = processPool.scheduler.parallelCompiles
+    watchers = {}
+    for i in range(documents):
+        watchers[f"mock{i}"] = watcher = processPool.ProcessWatcher(lambda: processPool.MockRunner.newRunner(script), name=f"mock{i}")
+        processPool.scheduler.add(f"mock{i}", watcher)
+    latencies: List[float] = []
+    async def compileDocument(name: str, count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await processPool.scheduler.get(name).execute(waitForCompletion=True, fullLog=False) # type: ignore[union-attr]
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(compileDocument(name, compiles // documents + (i < compiles % documents)) for i, name in enumerate(watchers)))
+        seconds = time.perf_counter() - start
+    finally:
+        for watcher in watchers.values():
+            await watcher.close()
+        if processPool.scheduler.sweepTask is not None:
+            processPool.scheduler.sweepTask.cancel()
+    finishResults: Dict[str, int] = {}
+    servedBy: Dict[str, int] = {}
+    for watcher in watchers.values():
+        for errorState, count in watcher.finishResults.items():
+            finishResults[errorState.name] = finishResults.get(errorState.name, 0) + count
+        for state, count in watcher.servedBy.items():
+            servedBy[state] = servedBy.get(state, 0) + count
+    return {
+        'seconds': seconds,
+        'compilesPerSecond': len(latencies) / seconds,
+        'parallelCompiles': parallelCompiles,
+        'latencySeconds': summary(latencies),
+        'finishResults': finishResults,
+        'servedBy': servedBy,
+        'exitedWatchers': sum(1 for watcher in watchers.values() if watcher.exited),
+    }
+
+@cli.command()
+@click.option("--documents", "-n", default=8, help="Number of simulated documents, default = 8.")
+@click.option("--compiles", "-c", default=2000, help="Compilations of all documents together, default = 2000.")
+@click.option("--capacity", default=6, help="Server-wide maximum of live runners (--max-total-runners), default = 6.")
+@click.option("--outcomes", default="ok,ok,ok,ok,ok,ok,ok,ok,error,silent", help=f"Comma separated outcomes of the mock runners, used in turn (of {', '.join(processPool.MOCK_OUTCOMES)}).")
+@click.option("--preamble", default=0.0, help="Seconds a mock runner needs until its pause, default = 0.")
+@click.option("--body", default=0.0, help="Seconds a mock runner needs after being continued, default = 0.")
+@click.option("--silent-timeout", default=0.01, help="Seconds until a silent mock runner gets killed, default = 0.01.")
+@click.option("--max-parallel-compiles", default=0, help="Compilations that run at the same time. Default = 0: one per document, the mock runners don't use the CPU. With one per CPU core (as in the server) the timeouts of the silent runners hold the few slots and limit the throughput.")
+@click.option("--output", "-o", default="", help="Also write the results to this JSON file.")
+def stress(documents, compiles, capacity, outcomes, preamble, body, silent_timeout, max_parallel_compiles, output):
+    """ Pool, eviction and timeouts with simulated compilations (MockRunner) instead of LaTeX """
+    script = processPool.MockScript(preamble, body, outcomes.split(','), jitter=min(preamble, body) / 2, silentTimeout=silent_timeout, seed=0)
+    processPool.RunnerScheduler.maxTotalRunners = capacity
+    processPool.RunnerScheduler.maxParallelCompiles = max_parallel_compiles or documents
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # the watchers print every step
+        result = asyncio.run(stressRun(documents, compiles, script))
+    print(f"{compiles} compilations of {documents} documents with at most {capacity} runners and {result['parallelCompiles']} at the same time in {result['seconds']:.2f} s "
+          f"({result['compilesPerSecond']:.0f} per second, median latency {result['latencySeconds']['median'] * 1000:.2f} ms)")
+    print("Runners finished:", ", ".join(f"{name}: {count}" for name, count in result['finishResults'].items()))
+    print("Requests served by runners that were:", ", ".join(f"{state}: {count}" for state, count in result['servedBy'].items()))
+    if result['exitedWatchers']:
+        print(f"{result['exitedWatchers']} watchers gave up (too many runners that never waited).")
+    if output:
+        Path(output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+        print("Results written to", output)
+
+if __name__ == '__main__':
+    cli()
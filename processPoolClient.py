@@ -0,0 +1,111 @@
+""" Lean client for the server of processPool.py. An editor calls it on every save, so it only imports the standard library modules it needs:
+    python processPoolClient.py -f <file>.tex [-o out] [-l]
+The request is one line of JSON ({"texFile": ..., "outputDir": ..., "fullLog": ...}), sent over the Unix domain socket of the server
+or (where there is none) as POST to its /stream route. The answer is the log (or its errors and warnings) line by line,
+followed by a line with STATUS_LOG and a JSON status record. One socket connection can carry several requests one after another.
+If no server is running, the call is handed over to processPool.py, which starts one. """
+import itertools
+import json
+import os
+import socket
+import sys
+
+ROUTE_OBFUSCATION = 'aosijfoaisdoifnasodnifaosinf'
+DEFAULT_PORT = 65344
+DEFAULT_HOST = "127.0.0.1"
+STATUS_LOG = "PROCESSPOOL STATUS " # the last line of a streamed log, followed by a JSON status record
+CLIENT_TIMEOUT = 60 # seconds
+
+class UnexpectedAnswer(ConnectionError):
+    """ The server did not accept the request, e.g. because it is an older version """
+
+def socketPath(port: int) -> 'str | None':
+    """ The Unix domain socket of the server on port, None on platforms without them """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', f"processPool-{port}.sock")
+
+def requestLine(texFile: str, outputDir: str = "out", fullLog: bool = False) -> bytes:
+    return (json.dumps({'texFile': str(texFile), 'outputDir': str(outputDir), 'fullLog': fullLog}) + "\n").encode('utf8')
+
+def socketLines(request: bytes, path: str):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(CLIENT_TIMEOUT)
+        connection.connect(path)
+        connection.sendall(request)
+        with connection.makefile('rb') as answer:
+            for line in answer:
+                text = line.decode('utf8', errors='replace').rstrip('\r\n')
+                yield text
+                if text.startswith(STATUS_LOG):
+                    return
+
+def httpLines(request: bytes, port: int, host: str):
+    import http.client
+    connection = http.client.HTTPConnection(host, port, timeout=CLIENT_TIMEOUT)
+    try:
+        connection.request('POST', f"/stream{ROUTE_OBFUSCATION}", body=request, headers={'Content-Type': 'application/json'})
+        answer = connection.getresponse()
+        if answer.status != 200:
+            raise UnexpectedAnswer(f"The server answered {answer.status} {answer.reason}")
+        for line in answer:
+            yield line.decode('utf8', errors='replace').rstrip('\r\n')
+    finally:
+        connection.close()
+
+def compileRemotely(texFile: str, outputDir: str = "out", port: int = DEFAULT_PORT, host: str = DEFAULT_HOST, fullLog: bool = False, onLine=print) -> 'dict | None':
+    """ Let the server compile texFile. Passes every line of the answer to onLine and returns the status record (None if the answer had none).
+    Raises ConnectionRefusedError if no server is running and UnexpectedAnswer if it doesn't accept the request. """
+    request = requestLine(texFile, outputDir, fullLog)
+    path = socketPath(port)
+    lines = None
+    if path is not None and host in (DEFAULT_HOST, 'localhost') and os.path.exists(path):
+        lines = socketLines(request, path)
+        try:
+            lines = itertools.chain([next(lines)], lines) # connects
+        except (ConnectionRefusedError, FileNotFoundError, StopIteration): # a stale socket file
+            lines = None
+    if lines is None:
+        lines = httpLines(request, port, host)
+    status = None
+    for line in lines:
+        if line.startswith(STATUS_LOG):
+            status = json.loads(line[len(STATUS_LOG):])
+        else:
+            onLine(line)
+    return status
+
+def printStatus(status: dict):
+    passes = f" in {status['passes']} passes" if status.get('passes', 1) > 1 else ""
+    cached = " from the build cache" if status.get('cached') else ""
+    cached += " with the preamble format" if status.get('strategy') == 'format' else ""
+    print(f"Server finished: {status['status']} ({status['errorState']}) after {status['seconds']:.2f} s{passes}{cached}.")
+    if 'counts' in status:
+        print(f"pages: {status['pages']}, " + ", ".join(f"{kind}: {count}" for kind, count in status['counts'].items()) + (", rerun needed" if status['rerunNeeded'] else ""))
+
+def main(arguments):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tex-file", "--file", "--f", "-f", required=True)
+    parser.add_argument("--output-dir", "--output-directory", "--outdir", "--o", "-o", default="out", help="Path for LaTeX output, relative to the tex file.")
+    parser.add_argument("--port", "--p", "-p", type=int, default=DEFAULT_PORT, help=f"The port of the server, default = {DEFAULT_PORT}")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Host of the server. Default = {DEFAULT_HOST}")
+    parser.add_argument("--full-log", "-l", action='store_true', help="Print the complete LaTeX log instead of only the errors and warnings.")
+    options = parser.parse_args(arguments)
+    try:
+        status = compileRemotely(options.tex_file, options.output_dir, options.port, options.host, options.full_log, onLine=lambda line: print(line, flush=True))
+    except socket.timeout:
+        print(f"The server did not respond within {CLIENT_TIMEOUT} seconds timeout.")
+        return
+    except (ConnectionRefusedError, UnexpectedAnswer) as error: # processPool.py starts a server or talks to an older one
+        print("No server is running, starting one with processPool.py." if isinstance(error, ConnectionRefusedError) else error, flush=True)
+        processPool = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processPool.py')
+        os.execv(sys.executable, [sys.executable, processPool, *arguments])
+    except OSError as error:
+        print(f"The connection to the server failed: {error}")
+        return
+    if status is not None:
+        printStatus(status)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,41 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import automate
+
+
+class InputListGeneratorTest(unittest.TestCase):
+    """ The files an InputListGenerator lists follow the rules of automate.ps1 """
+
+    def setUp(self) -> None:
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporaryDirectory.cleanup)
+        self.project = Path(self.temporaryDirectory.name) / 'proj'
+        for name in (
+            'b.tex', 'A.tex', 'proj.tex', 'Proj.tex', 'other_proj.tex', 'proj_generated.tex', '_draft.tex', 'notes.txt',
+            '.hidden.tex', 'chapter/c.tex', 'chapter/ignored/d.tex', 'chapter/ignored/.texignore', 'chapter/ignored/deeper/e.tex',
+            '.git/f.tex',
+        ):
+            (self.project / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.project / name).write_text("")
+        self.generator = automate.InputListGenerator(self.project, 'proj.tex')
+
+    def names(self):
+        return [file.relative_to(self.project).as_posix() for file in self.generator.includedFiles()]
+
+    def test_exclusionRules(self):
+        self.assertEqual(self.names(), ['A.tex', 'b.tex', 'chapter/c.tex', 'chapter/ignored/deeper/e.tex'])
+
+    def test_updateKeepsTheListAndWritesOnlyChanges(self):
+        self.assertTrue(self.generator.update())
+        self.assertEqual(len(self.generator.files), 4)
+        self.assertFalse(self.generator.update())
+        (self.project / 'z.tex').write_text("")
+        self.generator.scans.clear() # the folder mtime may not show the new file yet
+        self.assertTrue(self.generator.update())
+        self.assertIn("z.tex}", self.generator.generatedFile.read_text(encoding='utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+import asyncio
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import processPool
+import processPoolBenchmark
+
+DOCUMENT = "\\documentclass{article}\n\\usepackage{amsmath}\n\\pauseExecution\n\\begin{document}\nHello\n\\end{document}\n"
+
+def setUpModule():
+    temporaryDirectory = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(temporaryDirectory.cleanup)
+    processPoolBenchmark.useFakeLualatex(Path(temporaryDirectory.name))
+
+
+class BuildCacheTest(unittest.TestCase):
+    """ BuildCache.lookup only returns builds whose inputs, .bib files and .idx/.bcf files are unchanged """
+
+    def setUp(self) -> None:
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporaryDirectory.cleanup)
+        root = Path(self.temporaryDirectory.name)
+        self.texFile = root / 'main.tex'
+        self.outputDirectory = root / 'out'
+        self.outputDirectory.mkdir()
+        self.texFile.write_text("\\documentclass{article}\n\\begin{document}\\cite{knuth}\\end{document}\n")
+        (root / 'refs.bib').write_text("@book{knuth, title={The TeXbook}}\n")
+        (self.outputDirectory / 'main.fls').write_text(f"PWD {root}\nINPUT main.tex\n")
+        (self.outputDirectory / 'main.bcf').write_text('<bcf:datasource type="file" datatype="bibtex">refs.bib</bcf:datasource>\n')
+        (self.outputDirectory / 'main.pdf').write_text("PDF\n")
+        self.cache = processPool.BuildCache(root / 'cache', 10**8)
+        self.assertTrue(self.cache.store(self.texFile, self.outputDirectory, {'passes': 2}, "", None, time.time() + 1))
+
+    def test_unchangedInputsHit(self):
+        self.assertIsNotNone(self.cache.lookup(self.texFile, self.outputDirectory))
+
+    def test_hitReportsNoPasses(self):
+        hit = self.cache.lookup(self.texFile, self.outputDirectory)
+        async def serve():
+            watcher = processPool.ProcessWatcher(lambda: None, name=str(self.texFile))
+            watcher._serveCached(processPool.CompileRequest(), hit, time.time())
+            return watcher.lastStatus
+        self.assertEqual(asyncio.run(serve())['passes'], 0)
+
+    def test_changedBibFileMisses(self):
+        (self.texFile.parent / 'refs.bib').write_text("@book{knuth, title={The METAFONTbook}}\n")
+        self.assertIsNone(self.cache.lookup(self.texFile, self.outputDirectory))
+
+    def test_changedBcfFileMisses(self):
+        with (self.outputDirectory / 'main.bcf').open('a') as bcf:
+            bcf.write('<bcf:citekey order="2">lamport</bcf:citekey>\n')
+        self.assertIsNone(self.cache.lookup(self.texFile, self.outputDirectory))
+
+
+class PreambleHashTest(unittest.TestCase):
+    """ The preamble hash covers the main file up to the PAUSE_COMMAND that pauses it, not up to an earlier mention """
+
+    def setUp(self) -> None:
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporaryDirectory.cleanup)
+        self.texFile = Path(self.temporaryDirectory.name) / 'main.tex'
+        self.tracker = processPool.PreambleTracker(self.texFile, self.texFile.parent / 'out')
+
+    def preambleHash(self, content: str) -> str:
+        self.texFile.write_text(content)
+        self.tracker._preambleCache = (None, "")
+        return self.tracker.preambleHash()
+
+    def test_editAfterDefinitionChangesHash(self):
+        document = "% \\pauseExecution pauses here\n\\def\\pauseExecution{\\relax}\n\\usepackage{PACKAGE}\n\\pauseExecution\n\\begin{document}\nBODY\n\\end{document}\n"
+        original = self.preambleHash(document)
+        self.assertNotEqual(self.preambleHash(document.replace('PACKAGE', 'amsmath')), original)
+        self.assertEqual(self.preambleHash(document.replace('BODY', 'Hello')), original)
+
+    def test_pauseCommandEnd(self):
+        self.assertEqual(processPool.pauseCommandEnd("\\usepackage{a}\n\\pauseExecution\n\\begin{document}"), len("\\usepackage{a}\n\\pauseExecution"))
+        self.assertEqual(processPool.pauseCommandEnd("% \\pauseExecution\n\\begin{document}\\pauseExecution"), -1)
+
+
+class NativeRunnerStopTest(unittest.IsolatedAsyncioTestCase):
+    """ A runner that gets stopped (evicted, closed watcher, cancelled stale compilation) must not publish its temp directory """
+
+    async def asyncSetUp(self) -> None:
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporaryDirectory.cleanup)
+        root = Path(self.temporaryDirectory.name)
+        self.texFile = root / 'main.tex'
+        self.texFile.write_text(DOCUMENT)
+        self.outputDirectory = root / 'out'
+        self.outputDirectory.mkdir()
+        (self.outputDirectory / 'main.aux').write_text("OLD AUX\n")
+        pipeline = processPool.LatexPipeline(processPool.tempDirectories.create(self.outputDirectory), self.outputDirectory, self.texFile, tools=[])
+        self.runner = await processPool.NativeLatexRunner.newRunner(pipeline, workingDirectory=root)
+
+    async def test_stoppedWaitingRunnerDoesNotPublish(self):
+        await asyncio.wait_for(self.runner.haltedEvent.wait(), 10)
+        (self.outputDirectory / 'main.aux').write_text("NEW AUX\n") # written by a later compilation
+        await self.runner.stop()
+        await asyncio.sleep(0.5) # a publish in the executor would have happened by now
+        self.assertEqual((self.outputDirectory / 'main.aux').read_text(), "NEW AUX\n")
+        self.assertFalse((self.outputDirectory / 'main.pdf').exists())
+
+    async def test_continuedRunnerPublishes(self):
+        await asyncio.wait_for(self.runner.haltedEvent.wait(), 10)
+        self.assertTrue(await self.runner.continueRun())
+        await asyncio.wait_for(self.runner.exitedEvent.wait(), 10)
+        self.assertTrue((self.outputDirectory / 'main.pdf').exists())
+
+    async def test_closedWatcherReleasesEveryTempDirectoryOnce(self):
+        await self.runner.stop()
+        watcher = processPool.newWatcher(self.texFile)
+        with mock.patch.object(processPool.tempDirectories, 'release', wraps=processPool.tempDirectories.release) as release:
+            await watcher.warmUp()
+            await asyncio.wait_for(asyncio.gather(*(runner.haltedEvent.wait() for runner in watcher.runners)), 10)
+            await watcher.close()
+        released = [call.args[0] for call in release.call_args_list]
+        self.assertEqual(len(released), processPool.POOL_DEFAULT_SIZE)
+        self.assertEqual(len(set(released)), len(released))
+
+
+class SilenceTimeoutTest(unittest.IsolatedAsyncioTestCase):
+    """ A runner gets killed after PROCESS_TIMEOUT seconds without output, except while it waits to be continued """
+
+    async def test_silentAfterContinueGetsKilled(self):
+        with mock.patch.object(processPool, 'PROCESS_TIMEOUT', 0.5):
+            runner = await processPool.LatexRunner.newRunner(f"echo '{processPool.HALT_LOG}'; read line; exec sleep 30")
+            self.addAsyncCleanup(runner.stop)
+            await asyncio.wait_for(runner.haltedEvent.wait(), 10)
+            await asyncio.sleep(1) # longer than the timeout, but paused
+            self.assertEqual(await runner.getState(), processPool.RunnerStates.WAITING)
+            self.assertTrue(await runner.continueRun())
+            await asyncio.wait_for(runner.exitedEvent.wait(), 5)
+            self.assertNotEqual(runner.errorState, processPool.ErrorStates.NONE)
+
+
+class LatexLogSummaryTest(unittest.TestCase):
+    """ LatexLogSummary sorts the lines of a log into errors, boxes, undefined references and citations and other warnings """
+
+    LOG = [
+        "./chapter/intro.tex:12: Undefined control sequence.",
+        "! Missing $ inserted.",
+        "Overfull \\hbox (3.2pt too wide) in paragraph at lines 20--22",
+        "LaTeX Warning: Reference `fig:plot' on page 2 undefined on input line 31.",
+        "LaTeX Warning: Citation 'knuth' on page 3 undefined on input line 40.",
+        "Package hyperref Warning: Token not allowed in a PDF string.",
+        "LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.",
+        "Output written on main.pdf (3 pages, 41234 bytes).",
+        "This line is no record.",
+    ]
+
+    def test_records(self):
+        summary = processPool.LatexLogSummary()
+        for line in self.LOG:
+            summary.feed(line)
+        self.assertEqual(summary.counts, {'error': 2, 'box': 1, 'reference': 1, 'citation': 1, 'warning': 2})
+        self.assertEqual(summary.pages, 3)
+        self.assertTrue(summary.rerunNeeded)
+        self.assertEqual(summary.records['error'][0], {'kind': 'error', 'file': './chapter/intro.tex', 'line': 12, 'message': 'Undefined control sequence.'})
+        self.assertEqual(summary.records['box'][0]['line'], 20)
+        self.assertEqual(summary.records['citation'][0]['line'], 40)
+        self.assertEqual(
+            summary.format().splitlines()[0],
+            "3 pages, 2 errors, 1 overfull/underfull boxes, 1 undefined references, 1 undefined citations, 2 other warnings. Rerun needed."
+        )
+
+    def test_recordsAreBounded(self):
+        summary = processPool.LatexLogSummary()
+        for line in range(processPool.MAX_LOG_RECORDS + 5):
+            summary.feed(f"./main.tex:{line + 1}: Undefined control sequence.")
+        self.assertEqual(summary.counts['error'], processPool.MAX_LOG_RECORDS + 5)
+        self.assertEqual(len(summary.records['error']), processPool.MAX_LOG_RECORDS)
+        self.assertEqual(summary.format().splitlines()[-1], "... and 5 more of kind error")
+
+
+class MockWatcherTest(unittest.IsolatedAsyncioTestCase):
+    """ Base for tests of ProcessWatchers with MockRunners and a scheduler of their own """
+
+    async def asyncSetUp(self) -> None:
+        self.scheduler = processPool.RunnerScheduler()
+        patcher = mock.patch.object(processPool, 'scheduler', self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watchers: list = []
+
+    async def asyncTearDown(self) -> None:
+        for watcher in self.watchers:
+            await watcher.close()
+        if self.scheduler.sweepTask is not None:
+            self.scheduler.sweepTask.cancel()
+
+    def newWatcher(self, name: str, bodyTime: float = 0.0) -> processPool.ProcessWatcher:
+        script = processPool.MockScript(preambleTime=0.05, bodyTime=bodyTime)
+        watcher = processPool.ProcessWatcher(lambda: processPool.MockRunner.newRunner(script), name=name)
+        watcher.debounce = 0
+        self.watchers.append(watcher)
+        return watcher
+
+
+class CoalescingTest(MockWatcherTest):
+    """ Requests that arrive during a compilation share one pending compilation; with cancelStale they stop the running one """
+
+    async def test_requestsDuringACompilationShareOne(self):
+        watcher = self.newWatcher('mock', bodyTime=0.3)
+        first = asyncio.ensure_future(watcher.execute(waitForCompletion=True))
+        await asyncio.sleep(0.15) # the first compilation is running
+        second, third = await asyncio.gather(watcher.execute(waitForCompletion=True), watcher.execute(waitForCompletion=True))
+        await first
+        self.assertEqual(len(watcher.requestTimes), 2)
+        self.assertEqual(second, third)
+        self.assertIn("Output written on mock.pdf", second)
+
+    async def test_cancelStaleStopsTheRunningCompilation(self):
+        watcher = self.newWatcher('mock', bodyTime=0.3)
+        watcher.cancelStale = True
+        first = asyncio.ensure_future(watcher.execute(waitForCompletion=True))
+        await asyncio.sleep(0.15)
+        staleRunner = watcher.runningRunners[0]
+        second = await watcher.execute(waitForCompletion=True)
+        self.assertEqual(await first, second)
+        self.assertNotIn("CANCELLED", second)
+        self.assertEqual(staleRunner.errorState, processPool.ErrorStates.ABORTED)
+        self.assertEqual(len(watcher.requestTimes), 2)
+
+
+class RunnerSchedulerTest(MockWatcherTest):
+    """ When the server-wide runner budget is used up, a watcher may take the idle runners of less recently used watchers """
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.scheduler.maxTotalRunners = 2
+        for name in ('a', 'b', 'c'):
+            watcher = self.newWatcher(name)
+            watcher.minPoolSize = watcher.maxPoolSize = 1
+            self.scheduler.add(name, watcher)
+        self.a, self.b, self.c = self.watchers
+
+    async def test_leastRecentlyUsedWatcherLosesItsRunner(self):
+        await self.a.refreshState()
+        await self.b.refreshState()
+        self.scheduler.get('a') # a is used more recently than b now
+        await self.c.refreshState()
+        self.assertEqual([watcher.liveRunners for watcher in self.watchers], [1, 0, 1])
+        self.assertEqual(self.b.finishResults[processPool.ErrorStates.ABORTED], 1)
+
+    async def test_noEvictionForALessRecentlyUsedWatcher(self):
+        await self.b.refreshState()
+        await self.c.refreshState()
+        await self.a.refreshState() # least recently used
+        self.assertEqual([watcher.liveRunners for watcher in self.watchers], [0, 1, 1])
+
+
+class RerunDetectorTest(unittest.TestCase):
+    """ RerunDetector asks for another pass if LaTeX says so or the pass changed the .aux, .idx or .bcf file """
+
+    def setUp(self) -> None:
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporaryDirectory.cleanup)
+        root = Path(self.temporaryDirectory.name)
+        self.outputDirectory = root / 'out'
+        self.outputDirectory.mkdir()
+        (root / 'main.tex').write_text(DOCUMENT)
+        (self.outputDirectory / 'main.aux').write_text("\\relax\n")
+        preambleTracker = processPool.PreambleTracker(root / 'main.tex', self.outputDirectory)
+        self.detector = processPool.RerunDetector(preambleTracker, processPool.PreprocessingTracker(preambleTracker))
+        self.before = self.detector.snapshot()
+        self.runner = mock.Mock(errorState=processPool.ErrorStates.NONE, logSummary=processPool.LatexLogSummary())
+
+    def test_unchangedPassNeedsNoRerun(self):
+        self.assertIsNone(self.detector.reason(self.runner, self.before))
+
+    def test_changedAuxFile(self):
+        (self.outputDirectory / 'main.aux').write_text("\\relax\n\\newlabel{fig:plot}{{1}{1}}\n")
+        self.assertEqual(self.detector.reason(self.runner, self.before), "the pass changed the .aux file")
+
+    def test_changedBcfFile(self):
+        (self.outputDirectory / 'main.bcf').write_text("<bcf:citekey>knuth</bcf:citekey>\n")
+        self.assertEqual(self.detector.reason(self.runner, self.before), "the pass changed the bibliography (.bcf)")
+
+    def test_rerunAskedByLatex(self):
+        self.runner.logSummary.feed("LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.")
+        self.assertEqual(self.detector.reason(self.runner, self.before), "LaTeX asked for a rerun")
+
+    def test_noRerunAfterAnError(self):
+        (self.outputDirectory / 'main.aux').write_text("\\relax\n\\newlabel{fig:plot}{{1}{1}}\n")
+        self.runner.errorState = processPool.ErrorStates.RETURN_CODE_NONZERO
+        self.assertIsNone(self.detector.reason(self.runner, self.before))
+
+
+if __name__ == '__main__':
+    unittest.main()